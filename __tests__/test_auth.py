@@ -0,0 +1,121 @@
+import threading
+import pytest
+
+pytest.importorskip('fakeredis')
+
+import auth
+import benchmark
+import mailer
+
+ADMIN = "admin@example.com"
+
+@pytest.fixture
+def redis(monkeypatch):
+    benchmark.install_fakes()
+    auth.get_redis().flushall()
+    monkeypatch.setenv('ADMIN_EMAIL', ADMIN)
+    return auth.get_redis()
+
+# Users as they were stored before the status indexes, statuses cycling
+# through pending, approved, rejected, pending. One script writes them all,
+# as fakeredis is slow to take 100k separate commands.
+SEED_LEGACY_USERS_SCRIPT = """
+local statuses = {'pending', 'approved', 'rejected', 'pending'}
+for i = 0, tonumber(ARGV[1]) - 1 do
+    local email = 'user' .. i .. '@example.com'
+    redis.call('HSET', 'user:' .. email, 'email', email, 'name', 'user' .. i, 'status', statuses[i % 4 + 1],
+               'created_at', string.format('2024-01-%02dT%02d:%02d:%02d', 1 + math.floor(i / 86400),
+                                           math.floor(i / 3600) % 24, math.floor(i / 60) % 60, i % 60),
+               'approved_at', '', 'last_login', '')
+end
+"""
+
+def seed_legacy_users(redis, count: int):
+    redis.eval(SEED_LEGACY_USERS_SCRIPT, 0, count)
+
+def test_backfill_indexes_100k_users_for_counting_and_paging(redis):
+    users = 100_000
+    seed_legacy_users(redis, users)
+    # Keys that are not users are skipped
+    redis.hset("user:broken", "status", "unknown")
+
+    assert auth.count_users('pending') == 0
+    # fakeredis sorts the whole keyspace on every SCAN, so scan in bigger batches
+    assert auth.backfill_user_indexes(batch_size=10000) == users + 1
+
+    assert auth.count_users('pending') == users // 2
+    assert auth.count_users('approved') == users // 4
+    assert auth.count_users('rejected') == users // 4
+
+    # Pages come oldest first and carry every user field
+    first = auth.list_pending_users(limit=50)
+    assert [user['email'] for user in first[:3]] == ["user0@example.com", "user3@example.com", "user4@example.com"]
+    assert len(first) == 50
+    assert set(first[0]) == set(auth.USER_FIELDS)
+    middle = auth.list_users('approved', offset=users // 8, limit=50)
+    assert [user['email'] for user in middle[:2]] == [f"user{users // 2 + 1}@example.com",
+                                                      f"user{users // 2 + 5}@example.com"]
+    assert auth.list_users('rejected', offset=users // 4) == []
+
+def test_backfill_moves_users_whose_status_changed(redis):
+    seed_legacy_users(redis, 8)
+    auth.backfill_user_indexes()
+    redis.hset("user:user0@example.com", 'status', 'rejected')
+
+    auth.backfill_user_indexes()
+
+    assert "user0@example.com" not in [user['email'] for user in auth.list_pending_users()]
+    assert auth.count_users('rejected') == 3
+
+def test_created_and_approved_users_keep_the_indexes_in_step(redis):
+    for i in range(3):
+        auth.create_user(f"new{i}@example.com", f"New {i}")
+
+    assert [user['email'] for user in auth.list_pending_users()] == [f"new{i}@example.com" for i in range(3)]
+
+    assert not auth.approve_user("new1@example.com", "someone@example.com")
+    assert auth.approve_user("new1@example.com", ADMIN)
+    assert not auth.approve_user("new1@example.com", ADMIN)
+    assert not auth.approve_user("missing@example.com", ADMIN)
+
+    assert [user['email'] for user in auth.list_pending_users()] == ["new0@example.com", "new2@example.com"]
+    assert auth.count_users('pending') == 2
+    approved = auth.list_users('approved')
+    assert [user['email'] for user in approved] == ["new1@example.com"]
+    assert approved[0]['status'] == 'approved' and approved[0]['approved_at']
+    # The approval index keeps the registration order
+    assert redis.zscore(auth._status_key('approved'), "new1@example.com") == \
+        auth._created_score(auth.get_user("new1@example.com")['created_at'])
+
+def test_last_login_is_only_recorded_for_existing_users(redis):
+    auth.create_user("new@example.com", "New")
+
+    auth.update_last_login("new@example.com")
+    auth.update_last_login("missing@example.com")
+
+    assert auth.get_user("new@example.com")['last_login']
+    assert not redis.exists("user:missing@example.com")
+
+def test_concurrent_approvals_and_magic_link_clicks_succeed_once(redis):
+    auth.create_user("new@example.com", "New")
+    token = auth.generate_magic_link("new@example.com")
+    results = {'approved': [], 'verified': []}
+
+    def approve():
+        results['approved'].append(auth.approve_user("new@example.com", ADMIN))
+
+    def verify():
+        results['verified'].append(auth.verify_magic_link(token))
+
+    threads = [threading.Thread(target=work) for _ in range(8) for work in (approve, verify)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results['approved']) == [False] * 7 + [True]
+    assert sorted(results['verified'], key=bool) == [None] * 7 + ["new@example.com"]
+    assert auth.count_users('pending') == 0
+    assert auth.count_users('approved') == 1
+    # One approval email, through the outbox
+    assert redis.llen(mailer.OUTBOX_KEY) == 1
@@ -0,0 +1,28 @@
+import re
+import benchmark
+import transcription
+import transcript_store
+
+def result(min_ms):
+    return {'min_ms': min_ms, 'median_ms': min_ms, 'mean_ms': min_ms, 'repeat': 1}
+
+def test_compare_flags_only_slowdowns_above_threshold_and_noise():
+    baseline = {'meta': {'scale': 'small'}, 'results': {
+        'a': result(10.0), 'b': result(10.0), 'c': result(0.1)
+    }}
+    current = {'meta': {'scale': 'small'}, 'results': {
+        'a': result(20.0), 'b': result(11.0), 'c': result(0.3), 'd': result(5.0)
+    }}
+
+    assert benchmark.compare(current, baseline, threshold=0.25) == ['a']
+
+def test_fake_transcript_goes_through_the_real_pipeline(tmp_path):
+    transcript = benchmark.fake_transcript(utterances=120, words_per_utterance=8)
+
+    text = transcription.format_transcript(transcript)
+    transcript_store.write(transcript, str(tmp_path / "fake.sst"))
+
+    assert len(re.findall(r"^Chapter \d+:", text, re.M)) == 3
+    with transcript_store.TranscriptStore(str(tmp_path / "fake.sst")) as store:
+        assert store.utterance_count == 120
+        assert len(store.words()) == sum(len(u.words) for u in transcript.utterances)
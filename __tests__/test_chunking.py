@@ -0,0 +1,141 @@
+import os
+import stat
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import chunking
+import storage
+import transcription
+
+def utterance(speaker, text, start, end):
+    return SimpleNamespace(speaker=speaker, text=text, start=start, end=end, confidence=0.9)
+
+def chunk_transcript(transcript_id, utterances, chapters=None):
+    return SimpleNamespace(id=transcript_id, utterances=utterances, chapters=chapters or [], sentiment_analysis=[])
+
+def test_plan_chunks_overlaps_neighbours():
+    chunks = chunking.plan_chunks([10000, 20000], 30000, 1000)
+
+    assert [(c.start, c.end) for c in chunks] == [(0, 11000), (9000, 21000), (19000, 30000)]
+    assert [(c.own_start, c.own_end) for c in chunks] == [(0, 10000), (10000, 20000), (20000, 30000)]
+
+def test_find_pause_picks_the_quiet_stretch():
+    rate = chunking.preprocessing.SAMPLE_RATE
+    samples = (np.sin(np.arange(rate * 3) * 0.1) * 10000).astype(np.int16)
+    samples[int(rate * 1.8):int(rate * 2.2)] = 0
+
+    assert 1.8 * rate <= chunking.find_pause(samples) <= 2.2 * rate
+
+def test_stitch_shifts_times_and_drops_overlap_duplicates():
+    first, second = chunking.plan_chunks([10000], 20000, 2000)
+    results = [
+        (first, chunk_transcript('t1', [
+            utterance('A', "hello there.", 1000, 4000),
+            utterance('B', "how are you?", 8500, 11500),
+        ])),
+        # Times are relative to the chunk, which starts at 8000
+        (second, chunk_transcript('t2', [
+            utterance('A', "how are you?", 600, 3400),
+            utterance('A', "fine thanks.", 5000, 7000),
+        ])),
+    ]
+
+    stitched = chunking.stitch(results)
+
+    assert [(u.text, u.start, u.end) for u in stitched.utterances] == [
+        ("hello there.", 1000, 4000),
+        ("how are you?", 8600, 11400),
+        ("fine thanks.", 13000, 15000),
+    ]
+    assert stitched.id == 't1,t2'
+
+def test_stitch_reconciles_speaker_labels_across_chunks():
+    first, second = chunking.plan_chunks([10000], 20000, 2000)
+    results = [
+        (first, chunk_transcript('t1', [
+            utterance('A', "welcome everyone.", 0, 3000),
+            utterance('B', "thanks for having me.", 8200, 9900),
+        ])),
+        # The second chunk letters the guest A because they speak first in it
+        (second, chunk_transcript('t2', [
+            utterance('A', "thanks for having me.", 200, 1900),
+            utterance('B', "let's begin.", 4000, 6000),
+            utterance('A', "sounds good.", 7000, 9000),
+        ])),
+    ]
+
+    stitched = chunking.stitch(results)
+
+    assert [(u.speaker, u.text) for u in stitched.utterances] == [
+        ('A', "welcome everyone."),
+        ('B', "thanks for having me."),
+        ('A', "let's begin."),
+        ('B', "sounds good."),
+    ]
+
+def test_stitched_transcript_formats_like_a_single_transcript():
+    first, second = chunking.plan_chunks([10000], 20000, 2000)
+    results = [
+        (first, chunk_transcript('t1', [utterance('A', "one. two.", 0, 5000)],
+                                 [SimpleNamespace(headline="start", summary="it starts.", gist="s", start=0, end=5000)])),
+        (second, chunk_transcript('t2', [utterance('A', "three.", 4000, 6000)])),
+    ]
+    whole = SimpleNamespace(
+        utterances=[utterance('A', "one. two.", 0, 5000), utterance('A', "three.", 12000, 14000)],
+        chapters=[SimpleNamespace(headline="start", summary="it starts.", gist="s", start=0, end=5000)]
+    )
+
+    assert transcription.format_transcript(chunking.stitch(results)) == transcription.format_transcript(whole)
+
+def test_chunks_are_written_to_the_temp_dir_not_next_to_the_source(tmp_path, monkeypatch):
+    source_dir = tmp_path / "readonly"
+    source_dir.mkdir()
+    audio_path = str(source_dir / "long.wav")
+    open(audio_path, 'wb').close()
+    os.chmod(source_dir, stat.S_IRUSR | stat.S_IXUSR)
+    monkeypatch.setattr(storage, 'TEMP_DIR', str(tmp_path / "tmp"))
+    os.mkdir(storage.TEMP_DIR)
+    monkeypatch.setattr(chunking.preprocessing, 'decode', lambda path, start, duration: np.zeros(1600, np.int16))
+    submitted = []
+
+    class Transcriber:
+        def submit(self, path, config):
+            submitted.append((os.path.dirname(path), os.path.exists(path)))
+            return "transcript"
+
+    monkeypatch.setattr(transcription, 'get_transcriber', Transcriber)
+    monkeypatch.setattr(transcription, 'wait_for_transcript', lambda transcript, progress: transcript)
+    try:
+        chunk = chunking.plan_chunks([], 1000, 0)[0]
+        assert chunking.transcribe_chunk(audio_path, chunk, config=None) == "transcript"
+    finally:
+        os.chmod(source_dir, stat.S_IRWXU)
+
+    assert submitted == [(storage.TEMP_DIR, True)]
+    assert os.listdir(storage.TEMP_DIR) == []
+
+def test_a_chunk_out_of_retries_fails_the_recording_at_once(monkeypatch):
+    monkeypatch.setattr(chunking.preprocessing, 'probe_duration', lambda path: 3600)
+    monkeypatch.setattr(chunking, 'plan_cuts', lambda path, duration_ms: [600000 * i for i in range(1, 6)])
+    release = threading.Event()
+    finished = []
+
+    def transcribe_chunk(audio_path, chunk, config, cancelled):
+        if chunk.index == 0:
+            raise RuntimeError("chunk 0 rejected")
+        release.wait(5)
+        finished.append(chunk.index)
+        return chunk_transcript(f"t{chunk.index}", [])
+
+    monkeypatch.setattr(chunking, 'transcribe_chunk', transcribe_chunk)
+
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="chunk 0 rejected"):
+        chunking.transcribe_long_audio("long.wav", config=None)
+
+    # Raised while the other chunks were still in flight
+    assert time.monotonic() - started < 1
+    assert finished == []
+    release.set()
@@ -0,0 +1,73 @@
+import json
+import os
+import pytest
+import cli
+import transcription
+
+@pytest.fixture
+def recordings(tmp_path, monkeypatch):
+    """Three recordings and a transcriber that fails on the ones named in .broken"""
+    directory = tmp_path / "recordings"
+    directory.mkdir()
+    for name in ("a.wav", "b.mp3", "c.wav"):
+        (directory / name).write_bytes(name.encode() * 100)
+    (directory / "notes.txt").write_text("not audio")
+
+    calls = []
+    broken = {"b.mp3"}
+
+    def transcribe_audio(audio_path, original_filename, audio_hash=None, **options):
+        calls.append(original_filename)
+        if original_filename in broken:
+            raise RuntimeError("unsupported codec")
+        return {'transcript_path': str(tmp_path / f"{original_filename}.txt"), 'cached': False}
+
+    monkeypatch.setattr(transcription, 'transcribe_audio', transcribe_audio)
+    return directory, calls, broken
+
+def checkpoint(directory) -> dict:
+    with open(directory / cli.CHECKPOINT_FILENAME, encoding='utf-8') as f:
+        return json.load(f)
+
+def test_failures_set_the_exit_code_and_are_checkpointed(recordings):
+    directory, calls, _ = recordings
+
+    assert cli.main([str(directory), '--workers', '2']) == 1
+
+    assert sorted(calls) == ["a.wav", "b.mp3", "c.wav"]
+    entries = checkpoint(directory)
+    assert entries[str(directory / "a.wav")]['status'] == 'completed'
+    assert entries[str(directory / "b.mp3")] == {'status': 'failed', 'error': "unsupported codec"}
+
+def test_rerun_resumes_from_the_checkpoint(recordings):
+    directory, calls, broken = recordings
+    cli.run_batch(str(directory))
+    calls.clear()
+
+    # Done and failed files are skipped; a changed file is transcribed again
+    os.utime(directory / "c.wav", (1, 1))
+    assert cli.run_batch(str(directory)) == {'completed': 1, 'failed': 0, 'skipped': 2}
+    assert calls == ["c.wav"]
+
+    calls.clear()
+    broken.clear()
+    assert cli.main([str(directory), '--retry-failed']) == 0
+    assert calls == ["b.mp3"]
+    assert checkpoint(directory)[str(directory / "b.mp3")]['status'] == 'completed'
+
+def test_missing_manifest_entries_fail_without_stopping_the_run(recordings, tmp_path):
+    directory, calls, broken = recordings
+    broken.clear()
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# today's calls\nrecordings/a.wav\n\nrecordings/gone.wav\nrecordings/c.wav\n")
+
+    assert cli.run_batch(str(manifest)) == {'completed': 2, 'failed': 1, 'skipped': 0}
+    assert sorted(calls) == ["a.wav", "c.wav"]
+    assert checkpoint(tmp_path)[str(directory / "gone.wav")]['status'] == 'failed'
+
+    # A file that was done and has since been deleted is failed too
+    os.unlink(directory / "a.wav")
+    calls.clear()
+    assert cli.run_batch(str(manifest)) == {'completed': 0, 'failed': 1, 'skipped': 2}
+    assert calls == []
+    assert checkpoint(tmp_path)[str(directory / "a.wav")] == {'status': 'failed', 'error': "File not found"}
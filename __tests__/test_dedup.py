@@ -0,0 +1,101 @@
+import glob
+import os
+import shutil
+import threading
+import pytest
+import benchmark
+import dedup
+import search
+import storage
+import transcription
+
+# Three transcription runs over the same recording, saved in the repository
+RECORDINGS = sorted(glob.glob(os.path.join(storage.TRANSCRIPT_DIR, '*_mpjd1.txt')))
+
+@pytest.fixture
+def transcripts(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, 'INDEX_PATH', str(tmp_path / "dedup.db"))
+    monkeypatch.setattr(dedup, '_local', threading.local())
+    directory = tmp_path / "transcripts"
+    directory.mkdir()
+    paths = []
+    for i, path in enumerate(RECORDINGS):
+        paths.append(str(directory / os.path.basename(path)))
+        shutil.copyfile(path, paths[-1])
+        os.utime(paths[-1], (1000 + i, 1000 + i))
+    unrelated = storage.save_transcript(str(directory / "20250101_000000_standup.txt"),
+                                        transcription.iter_transcript(benchmark.fake_transcript(300, 12)))
+    return str(directory), paths, unrelated
+
+def test_runs_over_the_same_recording_are_near_duplicates(transcripts):
+    _, paths, unrelated = transcripts
+    assert len(paths) == 3
+    signatures = [dedup.transcript_signature(path) for path in paths]
+
+    for i in range(3):
+        for j in range(i + 1, 3):
+            assert dedup.similarity(signatures[i], signatures[j]) >= dedup.DUPLICATE_THRESHOLD
+        assert dedup.similarity(signatures[i], dedup.transcript_signature(unrelated)) < 0.1
+
+def test_dedupe_links_each_group_to_its_oldest_copy(transcripts):
+    directory, paths, unrelated = transcripts
+
+    result = dedup.dedupe(directory)
+
+    assert result == {
+        'transcripts': 4, 'groups': 1, 'duplicates': 2,
+        'duplicate_bytes': os.path.getsize(paths[1]) + os.path.getsize(paths[2])
+    }
+    assert dedup.canonical_paths(paths + [unrelated]) == {paths[1]: paths[0], paths[2]: paths[0]}
+    assert dedup.duplicates_of(paths[0]) == paths[1:]
+
+    # Deleted files are forgotten on the next pass
+    os.unlink(paths[0])
+    assert dedup.dedupe(directory)['transcripts'] == 3
+    assert dedup.canonical_paths(paths) == {paths[2]: paths[1]}
+
+def test_check_transcript_links_a_new_save_to_the_canonical_copy(transcripts, tmp_path):
+    directory, paths, unrelated = transcripts
+    dedup.dedupe(directory)
+    new_path = os.path.join(directory, "20260101_000000_mpjd1.txt")
+    shutil.copyfile(paths[2], new_path)
+
+    assert dedup.check_transcript(new_path) == paths[0]
+    assert dedup.canonical_paths([new_path]) == {new_path: paths[0]}
+    assert dedup.find_duplicates(storage.read_transcript(unrelated)) == [{'path': unrelated, 'similarity': 1.0}]
+
+    other = storage.save_transcript(str(tmp_path / "other.txt"),
+                                    transcription.iter_transcript(benchmark.fake_transcript(300, 12, seed=1)))
+    assert dedup.check_transcript(other) is None
+
+def test_search_shows_one_hit_per_group_of_duplicates(transcripts, tmp_path, monkeypatch):
+    directory, paths, _ = transcripts
+    monkeypatch.setattr(search, 'INDEX_PATH', str(tmp_path / "search.db"))
+    monkeypatch.setattr(search, '_local', threading.local())
+    monkeypatch.setattr(search, '_synced', True)
+    search.sync_index(directory)
+    dedup.dedupe(directory)
+    for path in paths:
+        search.add_owner(path, "user@example.com")
+
+    hits = search.search("island", "user@example.com")
+
+    assert len(hits) == 1
+    assert hits[0]['path'] in paths
+    assert hits[0]['duplicates'] == 2
+
+def test_migrated_transcripts_stay_linked(transcripts, tmp_path, monkeypatch):
+    pytest.importorskip('zstandard')
+    directory, paths, unrelated = transcripts
+    monkeypatch.setattr(search, 'INDEX_PATH', str(tmp_path / "search.db"))
+    monkeypatch.setattr(search, '_local', threading.local())
+    monkeypatch.setattr(storage, 'TRANSCRIPT_DIR', directory)
+    monkeypatch.setattr(storage, 'DICTIONARY_DIR', str(tmp_path))
+    monkeypatch.setattr(storage, 'TRANSCRIPT_COMPRESSION', True)
+    dedup.dedupe(directory)
+
+    storage.migrate_transcripts(directory)
+
+    compressed = [path + storage.COMPRESSED_SUFFIX for path in paths]
+    assert dedup.canonical_paths(paths + compressed + [unrelated]) == {compressed[1]: compressed[0],
+                                                                      compressed[2]: compressed[0]}
@@ -0,0 +1,73 @@
+import glob
+import os
+import re
+import pytest
+import storage
+import transcription
+from benchmark import fake_transcript
+
+pytest.importorskip('pytest_benchmark')
+
+# Lines of the transcripts saved in the repository, as written and lower-cased
+# the way AssemblyAI returns unformatted text
+SAVED_LINES = [
+    line
+    for path in sorted(glob.glob(os.path.join(storage.TRANSCRIPT_DIR, '*.txt')))
+    for text in [storage.read_transcript(path)]
+    for line in text.splitlines() + [text] + [text.lower()]
+    if line.strip()
+]
+
+def original_format_text(text):
+    """format_text as it was before its patterns were precompiled"""
+    if not text:
+        return ""
+    sentences = re.split(r'([.!?]+)\s*', text)
+    formatted_sentences = []
+    for i in range(0, len(sentences)-1, 2):
+        sentence = sentences[i].strip()
+        punctuation = sentences[i+1] if i+1 < len(sentences) else "."
+        if sentence:
+            sentence = sentence[0].upper() + sentence[1:] if len(sentence) > 1 else sentence.upper()
+            formatted_sentences.append(sentence + punctuation)
+    formatted_text = " ".join(formatted_sentences)
+    formatted_text = re.sub(r'\s+([.,!?])', r'\1', formatted_text)
+    formatted_text = re.sub(r'\s+', ' ', formatted_text)
+    formatted_text = re.sub(r'\s*\n\s*', '\n', formatted_text)
+    return formatted_text
+
+def test_format_text_matches_the_original_on_saved_and_synthetic_text():
+    synthetic = [u.text for u in fake_transcript(2000, 15).utterances]
+    edge_cases = ["", "no punctuation", "  spaced  out  .  a ! b??", "\n\nnew\nlines. x", ".!?", "ü. é?"]
+
+    for text in SAVED_LINES + synthetic + edge_cases:
+        assert transcription.format_text(text) == original_format_text(text)
+
+def utterances_per_second(benchmark, utterances: int):
+    # Stats are missing when benchmarks are disabled (--benchmark-disable)
+    if benchmark.stats:
+        benchmark.extra_info['utterances_per_sec'] = round(utterances / benchmark.stats.stats.mean)
+
+def test_format_text_throughput_on_saved_transcripts(benchmark):
+    lines = [line for line in SAVED_LINES if len(line) < 5000]
+
+    benchmark(lambda: [transcription.format_text(line) for line in lines])
+
+    utterances_per_second(benchmark, len(lines))
+
+def test_format_transcript_throughput_on_a_long_meeting(benchmark):
+    transcript = fake_transcript(10000, 15)
+
+    text = benchmark(transcription.format_transcript, transcript)
+
+    assert text.count("\nSpeaker ") > 1000
+    utterances_per_second(benchmark, len(transcript.utterances))
+
+def test_write_transcript_throughput_on_a_long_meeting(benchmark, tmp_path):
+    transcript = fake_transcript(10000, 15)
+    path = tmp_path / "meeting.txt"
+
+    benchmark(lambda: transcription.write_transcript(transcription.iter_transcript(transcript), path))
+
+    assert path.read_text(encoding='utf-8') == transcription.format_transcript(transcript)
+    utterances_per_second(benchmark, len(transcript.utterances))
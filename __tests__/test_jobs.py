@@ -0,0 +1,129 @@
+import json
+import threading
+import pytest
+
+pytest.importorskip('fakeredis')
+
+import benchmark
+import jobs
+import search
+import transcription
+import webhooks
+
+OWNER = "user@example.com"
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    benchmark.install_fakes()
+    jobs.get_redis().flushall()
+    monkeypatch.setattr(jobs, 'start_workers', lambda count=None: None)
+    monkeypatch.setattr(webhooks, 'WEBHOOK_URL', '')
+    monkeypatch.setattr(search, 'INDEX_PATH', str(tmp_path / "search.db"))
+    monkeypatch.setattr(search, '_local', threading.local())
+
+    def submit(name="meeting.wav"):
+        audio_path = tmp_path / name
+        audio_path.write_bytes(b'\0' * 64)
+        return jobs.submit_job(str(audio_path), name, None, OWNER), str(audio_path)
+
+    return submit
+
+def fake_transcribe(tmp_path, fail=False):
+    def transcribe_audio(audio_path, original_filename, audio_hash=None, progress=None,
+                         on_transcript=None, on_intelligence=None, **options):
+        progress('transcribing', 50)
+        if fail:
+            raise RuntimeError("upload rejected")
+        transcript_path = tmp_path / f"{original_filename}.txt"
+        transcript_path.write_text("\nSpeaker A:\nHello.")
+        on_transcript(str(transcript_path), False)
+        for name in transcription.INTELLIGENCE_TASKS:
+            on_intelligence(name, [], None)
+        return {'transcript_path': str(transcript_path)}
+    return transcribe_audio
+
+def test_submitted_job_is_transcribed_by_a_worker(queue, tmp_path, monkeypatch):
+    monkeypatch.setattr(transcription, 'transcribe_audio', fake_transcribe(tmp_path))
+    job_id, audio_path = queue()
+    assert jobs.get_job(job_id)['status'] == 'queued'
+
+    assert jobs.work_once(timeout=1)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == 'completed'
+    assert job['progress'] == 100
+    assert job['intelligence_pending'] == []
+    assert job['intelligence'] == {name: [] for name in transcription.INTELLIGENCE_TASKS}
+    assert not (tmp_path / "meeting.wav").exists()
+    assert jobs.get_redis().llen(jobs._processing_key()) == 0
+    assert not jobs.work_once(timeout=0.1)
+
+    listed, = jobs.list_jobs(OWNER)
+    assert listed == jobs.get_job(job_id)
+
+def test_failed_transcription_fails_the_job(queue, tmp_path, monkeypatch):
+    monkeypatch.setattr(transcription, 'transcribe_audio', fake_transcribe(tmp_path, fail=True))
+    job_id, _ = queue()
+
+    assert jobs.work_once(timeout=1)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == 'failed'
+    assert job['error'] == "upload rejected"
+    assert job['intelligence_pending'] == []
+    assert jobs.get_redis().llen(jobs._processing_key()) == 0
+
+def test_work_of_a_stopped_worker_is_recovered(queue, tmp_path, monkeypatch):
+    monkeypatch.setattr(transcription, 'transcribe_audio', fake_transcribe(tmp_path))
+    running_id, _ = queue("running.wav")
+    waiting_id, _ = queue("waiting.wav")
+    completion = json.dumps({'job_id': running_id, 'transcript_id': 't1', 'status': 'completed'})
+
+    # Another process took all three items off the queues, then stopped sending heartbeats
+    redis = jobs.get_redis()
+    dead = jobs._processing_key("dead:1")
+    redis.delete(jobs._queue_key())
+    redis.rpush(dead, running_id, waiting_id, completion)
+    redis.hset(jobs._job_key(running_id), 'status', 'running')
+    redis.zadd(jobs.WORKERS_KEY, {"dead:1": 1000, "alive:2": 5000})
+
+    assert jobs.reap_workers(now=1000 + jobs.WORKER_TIMEOUT + 1) == 3
+    assert jobs.reap_workers(now=1000 + jobs.WORKER_TIMEOUT + 1) == 0
+
+    assert redis.exists(dead) == 0
+    assert redis.zrange(jobs.WORKERS_KEY, 0, -1) == ["alive:2"]
+    assert jobs.get_job(running_id)['status'] == 'failed'
+    assert redis.lrange(jobs._queue_key(), 0, -1) == [waiting_id]
+    assert redis.lrange(webhooks.COMPLETIONS_KEY, 0, -1) == [completion]
+
+    # The finished transcript for the failed job is dropped; the queued job runs
+    assert jobs.work_once(timeout=1)
+    assert jobs.work_once(timeout=1)
+    assert jobs.get_job(running_id)['status'] == 'failed'
+    assert jobs.get_job(waiting_id)['status'] == 'completed'
+
+def test_intelligence_still_pending_after_the_deadline_is_failed(queue, tmp_path, monkeypatch):
+    def transcribe_audio(audio_path, original_filename, audio_hash=None, progress=None,
+                         on_transcript=None, on_intelligence=None, **options):
+        transcript_path = tmp_path / "meeting.txt"
+        transcript_path.write_text("\nSpeaker A:\nHello.")
+        on_transcript(str(transcript_path), False)
+        on_intelligence('summary', "They said hello.", None)
+        # The worker stops before the other sections are saved
+        raise SystemExit()
+
+    monkeypatch.setattr(transcription, 'transcribe_audio', transcribe_audio)
+    job_id, _ = queue()
+    with pytest.raises(SystemExit):
+        jobs.work_once(timeout=1)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == 'completed'
+    assert job['intelligence_pending'] == [name for name in transcription.INTELLIGENCE_TASKS if name != 'summary']
+
+    monkeypatch.setattr(jobs, 'INTELLIGENCE_DEADLINE', -1)
+    job = jobs.get_job(job_id)
+    assert job['intelligence_pending'] == []
+    assert job['intelligence'] == {'summary': "They said hello."}
+    assert sorted(job['intelligence_errors']) == sorted(name for name in transcription.INTELLIGENCE_TASKS
+                                                        if name != 'summary')
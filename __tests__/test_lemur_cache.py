@@ -0,0 +1,139 @@
+import threading
+import time
+import pytest
+
+pytest.importorskip('fakeredis')
+
+import benchmark
+import lemur_cache
+
+TRANSCRIPT = "Speaker A:\nWe ship next week."
+PARAMS = {'format_text': True}
+
+@pytest.fixture
+def redis():
+    benchmark.install_fakes()
+    lemur_cache.get_redis().flushall()
+    return lemur_cache.get_redis()
+
+def slow_answer(calls, answer="- Ship it", delay=0.2):
+    def compute():
+        calls.append(1)
+        time.sleep(delay)
+        return answer
+    return compute
+
+def run_threads(count, work):
+    answers = [None] * count
+    def run(i):
+        answers[i] = work()
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return answers
+
+def test_concurrent_identical_queries_share_one_call(redis):
+    calls = []
+
+    answers = run_threads(8, lambda: lemur_cache.get_or_compute(
+        TRANSCRIPT, "What was decided?", PARAMS, slow_answer(calls)))
+
+    assert answers == ["- Ship it"] * 8
+    assert len(calls) == 1
+    stats = lemur_cache.get_stats()
+    assert (stats['misses'], stats['coalesced'], stats['hits']) == (1, 7, 0)
+
+    # Spelling differences in the prompt still hit the cache
+    assert lemur_cache.get_or_compute(TRANSCRIPT, "  what was DECIDED? ", PARAMS, slow_answer(calls)) == "- Ship it"
+    assert len(calls) == 1
+    assert lemur_cache.get_stats()['hits'] == 1
+    assert redis.keys("*:lock") == []
+
+def test_query_locked_by_another_process_waits_for_its_answer(redis):
+    key = lemur_cache.cache_key(TRANSCRIPT, "What was decided?", PARAMS)
+    redis.set(f"{key}:lock", "other-process", ex=lemur_cache.LEMUR_LOCK_TIMEOUT)
+    threading.Timer(0.3, lambda: redis.set(key, "- From the other process")).start()
+    calls = []
+
+    answer = lemur_cache.get_or_compute(TRANSCRIPT, "What was decided?", PARAMS, slow_answer(calls))
+
+    assert answer == "- From the other process"
+    assert calls == []
+    stats = lemur_cache.get_stats()
+    assert (stats['misses'], stats['coalesced'], stats['hit_rate']) == (0, 1, 1.0)
+
+def test_answer_written_while_taking_the_lock_is_not_a_miss(redis, monkeypatch):
+    calls = []
+    lookup = lemur_cache._lookup
+
+    def racing_lookup(key):
+        # The other process finishes after our lookup but before we take the lock
+        response = lookup(key)
+        redis.set(key, "- From the other process")
+        return response
+
+    monkeypatch.setattr(lemur_cache, '_lookup', racing_lookup)
+
+    answer = lemur_cache.get_or_compute(TRANSCRIPT, "What was decided?", PARAMS, slow_answer(calls))
+
+    assert answer == "- From the other process"
+    assert calls == []
+    stats = lemur_cache.get_stats()
+    assert (stats['misses'], stats['coalesced']) == (0, 1)
+
+def test_stale_lock_is_given_up_on_but_not_released(redis, monkeypatch):
+    monkeypatch.setattr(lemur_cache, 'LEMUR_LOCK_TIMEOUT', 1)
+    key = lemur_cache.cache_key(TRANSCRIPT, "What was decided?", PARAMS)
+    redis.set(f"{key}:lock", "other-process")
+    calls = []
+
+    answer = lemur_cache.get_or_compute(TRANSCRIPT, "What was decided?", PARAMS, slow_answer(calls, delay=0))
+
+    assert answer == "- Ship it"
+    assert len(calls) == 1
+    # The lock still belongs to the process that took it
+    assert redis.get(f"{key}:lock") == "other-process"
+
+def test_failed_query_reaches_every_waiter_and_frees_the_lock(redis):
+    def compute():
+        time.sleep(0.2)
+        raise TimeoutError("LeMUR timed out")
+
+    def ask():
+        try:
+            return lemur_cache.get_or_compute(TRANSCRIPT, "What was decided?", PARAMS, compute)
+        except TimeoutError as e:
+            return str(e)
+
+    assert run_threads(4, ask) == ["LeMUR timed out"] * 4
+    assert redis.keys("*") == [lemur_cache.STATS_KEY]
+    assert lemur_cache.get_or_compute(TRANSCRIPT, "What was decided?", PARAMS, lambda: "- Retried") == "- Retried"
+
+def test_least_recently_used_answers_are_evicted_over_the_cap(redis, monkeypatch):
+    monkeypatch.setattr(lemur_cache, 'LEMUR_CACHE_MAX_ENTRIES', 2)
+    for prompt in ("first", "second"):
+        lemur_cache.get_or_compute(TRANSCRIPT, prompt, PARAMS, lambda: prompt)
+        time.sleep(0.01)
+    # Reading the first answer makes the second the least recently used
+    lemur_cache.get_or_compute(TRANSCRIPT, "first", PARAMS, lambda: None)
+    time.sleep(0.01)
+
+    lemur_cache.get_or_compute(TRANSCRIPT, "third", PARAMS, lambda: "third")
+
+    assert redis.get(lemur_cache.cache_key(TRANSCRIPT, "first", PARAMS)) == "first"
+    assert redis.get(lemur_cache.cache_key(TRANSCRIPT, "second", PARAMS)) is None
+    assert lemur_cache.get_stats()['evictions'] == 1
+    assert lemur_cache.get_or_compute(TRANSCRIPT, "second", PARAMS, lambda: "recomputed") == "recomputed"
+
+def test_hits_renew_the_answer_ttl(redis, monkeypatch):
+    lemur_cache.get_or_compute(TRANSCRIPT, "What was decided?", PARAMS, lambda: "- Ship it")
+    key = lemur_cache.cache_key(TRANSCRIPT, "What was decided?", PARAMS)
+    redis.expire(key, 5)
+    redis.zadd(lemur_cache.LRU_KEY, {key: time.time() - lemur_cache.LEMUR_CACHE_TTL + 5})
+
+    assert lemur_cache.get_or_compute(TRANSCRIPT, "What was decided?", PARAMS, lambda: None) == "- Ship it"
+
+    assert redis.ttl(key) > lemur_cache.LEMUR_CACHE_TTL - 5
+    assert redis.zscore(lemur_cache.LRU_KEY, key) > time.time() - 5
@@ -0,0 +1,94 @@
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('fakeredis')
+
+import benchmark
+import lemur_chunks
+import transcription
+
+class StubLeMUR:
+    """Answers every prompt after a short delay, recording the requests and how many overlapped"""
+
+    def __init__(self):
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def analyze(self, transcript_text, prompt, **params):
+        with self.lock:
+            self.requests.append((transcript_text, prompt))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        if prompt == lemur_chunks.SUMMARY_PROMPT:
+            return SimpleNamespace(response=f"notes on {transcript_text.split()[1]}")
+        return SimpleNamespace(response=f"answer from {transcript_text.count('Part ')} parts")
+
+@pytest.fixture
+def lemur(monkeypatch):
+    benchmark.install_fakes()
+    benchmark.auth.get_redis().flushall()
+    stub = StubLeMUR()
+    monkeypatch.setattr(transcription, '_lemur', stub)
+    monkeypatch.setattr(lemur_chunks, 'LEMUR_CHUNK_CHARS', 2000)
+    return stub
+
+def test_split_transcript_breaks_between_turns_and_repeats_split_labels():
+    text = transcription.format_transcript(benchmark.fake_transcript(utterances=60, words_per_utterance=10))
+    long_turn = "\nSpeaker Z:\n" + "\n".join(f"Line {i} of a very long turn." for i in range(100))
+
+    chunks = lemur_chunks.split_transcript(text + "\n" + long_turn, max_chars=500)
+
+    assert all(len(chunk) <= 500 for chunk in chunks)
+    assert all(chunk.startswith("Speaker ") or chunk.startswith("Chapter ") for chunk in chunks)
+    assert sum(chunk.startswith("Speaker Z:") for chunk in chunks) > 1
+    # Nothing is lost or reordered apart from the repeated speaker labels
+    said = lambda text: [line for line in text.split("\n")
+                         if line and not lemur_chunks.SPEAKER_LABEL_PATTERN.fullmatch(line)]
+    assert said("\n\n".join(chunks)) == said(text + long_turn)
+
+def test_split_transcript_splits_an_utterance_longer_than_a_chunk():
+    text = "\nSpeaker A:\n" + " ".join(["word"] * 500)
+
+    chunks = lemur_chunks.split_transcript(text, max_chars=200)
+
+    assert all(len(chunk) <= 200 and chunk.startswith("Speaker A:\n") for chunk in chunks)
+    assert sum(chunk.count("word") for chunk in chunks) == 500
+
+def test_long_transcript_is_summarised_in_chunks_and_follow_ups_reuse_them(lemur):
+    text = transcription.format_transcript(benchmark.fake_transcript(utterances=200, words_per_utterance=10))
+    chunks = lemur_chunks.split_transcript(text)
+    assert len(chunks) > lemur_chunks.LEMUR_CONCURRENCY
+
+    answer = transcription.analyze_with_lemur(text, "What was decided?")
+
+    assert answer == f"answer from {len(chunks)} parts"
+    assert len(lemur.requests) == len(chunks) + 1
+    assert 1 < lemur.max_active <= lemur_chunks.LEMUR_CONCURRENCY
+    assert "What was decided?" in lemur.requests[-1][1]
+
+    assert transcription.analyze_with_lemur(text, "Who owns the roadmap?") == f"answer from {len(chunks)} parts"
+    assert len(lemur.requests) == len(chunks) + 2
+    assert lemur.requests[-1][1].endswith("Who owns the roadmap?")
+
+def test_short_transcript_is_sent_whole(lemur):
+    transcription.analyze_with_lemur("\nSpeaker A:\nHello there.", "What was said?")
+
+    assert lemur.requests == [("\nSpeaker A:\nHello there.", "What was said?")]
+
+def test_action_items_are_always_text(lemur, monkeypatch):
+    transcript = benchmark.fake_transcript(utterances=5, words_per_utterance=8)
+
+    assert transcription.extract_action_items(transcript) == "answer from 0 parts"
+    assert transcription.extract_action_items(SimpleNamespace(text='')) == ''
+    assert transcription.empty_intelligence()['action_items'] == ''
+
+    # No answer from LeMUR is still an empty string
+    monkeypatch.setattr(transcription, 'analyze_with_lemur', lambda text, query: None)
+    assert transcription.extract_action_items(transcript) == ''
@@ -0,0 +1,140 @@
+import json
+import socket
+import pytest
+
+pytest.importorskip('fakeredis')
+pytest.importorskip('aiosmtpd')
+
+from aiosmtpd.controller import Controller
+import benchmark
+import mailer
+
+class Relay:
+    """An aiosmtpd handler that keeps what it receives and can refuse recipients"""
+
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+        self.refuse = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.peers.add(session.peer)
+        self.messages.append((envelope.rcpt_tos[0], envelope.content.decode('utf-8', 'replace')))
+        return '250 Message accepted'
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def relay(monkeypatch):
+    benchmark.install_fakes()
+    mailer.auth.get_redis().flushall()
+    handler = Relay()
+    controller = Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    monkeypatch.setenv('SMTP_SERVER', '127.0.0.1')
+    monkeypatch.setenv('SMTP_PORT', str(controller.port))
+    monkeypatch.setenv('SMTP_STARTTLS', 'false')
+    monkeypatch.delenv('SMTP_USERNAME', raising=False)
+    monkeypatch.setenv('SMTP_FROM_EMAIL', 'noreply@example.com')
+    monkeypatch.setenv('SMTP_FROM_NAME', 'SpeechScribe')
+    handler.controller = controller
+    yield handler
+    mailer._close_smtp()
+    handler.controller.stop()
+
+def message(to: str) -> dict:
+    return {'to': to, 'subject': "Your Magic Link", 'html': "<a href='x'>Sign in</a>", 'attempts': 0}
+
+def test_batches_share_one_connection(relay):
+    assert mailer.send_batch([message(f"user{i}@example.com") for i in range(3)]) == 3
+    assert mailer.send_batch([message("later@example.com")]) == 1
+
+    assert [to for to, _ in relay.messages] == ["user0@example.com", "user1@example.com",
+                                                "user2@example.com", "later@example.com"]
+    assert "Subject: Your Magic Link" in relay.messages[0][1]
+    assert len(relay.peers) == 1
+    assert mailer.get_stats()['sent'] == 4
+
+def test_refused_message_is_retried_then_given_up_on(relay, monkeypatch):
+    monkeypatch.setattr(mailer, 'MAIL_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(mailer, 'MAIL_RETRY_BASE', 0)
+    relay.refuse.add("gone@example.com")
+
+    assert mailer.send_batch([message("gone@example.com"), message("ok@example.com")]) == 1
+    assert [to for to, _ in relay.messages] == ["ok@example.com"]
+    assert mailer.get_stats()['retrying'] == 1
+
+    # Due retries go back on the outbox and fail again, for good this time
+    mailer._promote_due_retries()
+    raw = mailer.auth.get_redis().lpop(mailer.OUTBOX_KEY)
+    assert json.loads(raw)['attempts'] == 1
+    assert mailer.send_batch([json.loads(raw)]) == 0
+
+    stats = mailer.get_stats()
+    assert (stats['retrying'], stats['dead'], stats['retried']) == (0, 1, 1)
+    dead = json.loads(mailer.auth.get_redis().lindex(mailer.DEAD_KEY, 0))
+    assert dead['to'] == "gone@example.com" and "No such user" in dead['last_error']
+
+def test_lost_connection_is_replaced(relay, monkeypatch):
+    assert mailer.send_batch([message("first@example.com")]) == 1
+
+    # The relay restarts on another port; the health check notices the dead connection
+    relay.controller.stop()
+    controller = Controller(relay, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    relay.controller = controller
+    monkeypatch.setenv('SMTP_PORT', str(controller.port))
+
+    assert mailer.send_batch([message("second@example.com")]) == 1
+    assert [to for to, _ in relay.messages] == ["first@example.com", "second@example.com"]
+    assert len(relay.peers) == 2
+
+def test_missing_settings_fail_each_message_instead_of_the_batch(relay, monkeypatch):
+    monkeypatch.delenv('SMTP_PORT')
+
+    assert mailer.send_batch([message("a@example.com"), message("b@example.com")]) == 0
+
+    assert mailer.get_stats()['retrying'] == 2
+    assert relay.messages == []
+
+def test_batch_of_a_crashed_sender_is_sent_by_another(relay, monkeypatch):
+    monkeypatch.setattr(mailer, 'start_worker', lambda: None)
+    for to in ("one@example.com", "two@example.com", "three@example.com"):
+        mailer.enqueue(to, "Your Magic Link", "<a href='x'>Sign in</a>")
+    redis = mailer.auth.get_redis()
+    redis.zadd(mailer.WORKERS_KEY, {mailer.PROCESS_ID: 1000})
+
+    # The sender dies after the first message of its batch
+    send_batch = mailer.send_batch
+    calls = []
+
+    def crash_on_second(messages):
+        calls.append(messages)
+        if len(calls) == 2:
+            raise SystemExit()
+        return send_batch(messages)
+
+    monkeypatch.setattr(mailer, 'send_batch', crash_on_second)
+    with pytest.raises(SystemExit):
+        mailer.work_once()
+    monkeypatch.setattr(mailer, 'send_batch', send_batch)
+    assert redis.llen(mailer._processing_key()) == 2
+
+    # Another process reaps it once its heartbeat is stale
+    dead = mailer.PROCESS_ID
+    monkeypatch.setattr(mailer, 'PROCESS_ID', "other:2")
+    assert mailer.reap_workers(now=1000 + mailer.MAIL_WORKER_TIMEOUT + 1) == 2
+    assert redis.exists(mailer._processing_key(dead)) == 0
+
+    assert mailer.work_once() == 2
+    assert [to for to, _ in relay.messages] == ["one@example.com", "two@example.com", "three@example.com"]
+    assert redis.llen(mailer._processing_key()) == 0
@@ -0,0 +1,74 @@
+import json
+import os
+import pstats
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import metrics
+
+@pytest.fixture(autouse=True)
+def clean_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', True)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def test_spans_record_counts_errors_and_percentiles():
+    for seconds in (0.002, 0.02, 0.2):
+        metrics.observe('upload', seconds)
+    with pytest.raises(ValueError):
+        with metrics.span('upload'):
+            raise ValueError("boom")
+
+    upload = metrics.get_metrics()['upload']
+
+    assert upload['count'] == 4
+    assert upload['errors'] == 1
+    assert upload['p50'] == 0.02
+    assert upload['max'] == 0.2
+
+def test_prometheus_export_has_cumulative_buckets_per_label():
+    metrics.observe('redis', 0.003, command='GET')
+    metrics.observe('redis', 0.5, command='GET')
+    metrics.observe('redis', 0.003, command='HSET')
+
+    text = metrics.export_prometheus()
+
+    assert 'speechscribe_stage_seconds_bucket{stage="redis",command="GET",le="0.005"} 1' in text
+    assert 'speechscribe_stage_seconds_bucket{stage="redis",command="GET",le="+Inf"} 2' in text
+    assert 'speechscribe_stage_seconds_count{stage="redis",command="HSET"} 1' in text
+    assert json.loads(metrics.export_json())['redis,command=GET']['count'] == 2
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', False)
+
+    with metrics.span('upload'):
+        pass
+    metrics.observe('upload', 1.0)
+
+    assert metrics.get_metrics() == {}
+
+def test_profile_writes_a_report_only_when_enabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'PROFILE_DIR', str(tmp_path))
+
+    with metrics.profile('skipped', enabled=False) as report:
+        assert report is None
+    with metrics.profile('request') as report:
+        sum(range(1000))
+
+    assert os.path.exists(report)
+    assert os.listdir(tmp_path) == [os.path.basename(report)]
+
+def test_profile_includes_work_submitted_to_executors(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setitem(sys.modules, 'pyinstrument', None)
+
+    def executor_work():
+        return sum(range(1000))
+
+    assert metrics.profiled(executor_work) is executor_work
+    with ThreadPoolExecutor(max_workers=1) as executor, metrics.profile('request') as report:
+        assert executor.submit(metrics.profiled(executor_work)).result() == sum(range(1000))
+
+    functions = {function for _, _, function in pstats.Stats(report).stats}
+    assert 'executor_work' in functions
@@ -0,0 +1,152 @@
+import io
+import os
+import subprocess
+import sys
+import wave
+import numpy as np
+import pytest
+import preprocessing
+import transcription
+
+RATE = preprocessing.SAMPLE_RATE
+PADDING = RATE * preprocessing.VAD_PADDING_MS // 1000
+FRAME = RATE * preprocessing.VAD_FRAME_MS // 1000
+
+def speech(before=2.0, tone=1.0, after=3.0):
+    """Silence, a 440 Hz tone, then silence again, as 16 kHz PCM16"""
+    t = np.arange(int(tone * RATE)) / RATE
+    return np.concatenate([
+        np.zeros(int(before * RATE), dtype=np.int16),
+        (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16),
+        np.zeros(int(after * RATE), dtype=np.int16)
+    ])
+
+def write_wav(path, samples, rate=RATE):
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def without_ffmpeg(monkeypatch):
+    monkeypatch.setattr(preprocessing, 'has_ffmpeg', lambda: False)
+
+def test_speech_is_found_between_the_silences():
+    start, end = preprocessing.detect_speech(speech())
+
+    assert abs(start - (2 * RATE - PADDING)) <= FRAME
+    assert abs(end - (3 * RATE + PADDING)) <= FRAME
+
+    # Nothing voiced keeps the whole file
+    silence = np.zeros(RATE, dtype=np.int16)
+    assert preprocessing.detect_speech(silence) == (0, RATE)
+
+def test_processed_times_map_back_to_the_original():
+    offset_map = [[0, 1700], [5000, 9000]]
+
+    assert preprocessing.to_original_ms(offset_map, 0) == 1700
+    assert preprocessing.to_original_ms(offset_map, 4999) == 6699
+    assert preprocessing.to_original_ms(offset_map, 5000) == 9000
+    assert preprocessing.to_original_ms(offset_map, 5250) == 9250
+    assert preprocessing.to_original_ms([], 1234) == 1234
+
+def test_preprocess_trims_silence_and_keeps_the_timeline(tmp_path):
+    # 44.1 kHz input is resampled down to 16 kHz on the way
+    t = np.arange(int(6 * 44100)) / 44100
+    tone = (np.abs(t - 2.5) < 0.5) * np.sin(2 * np.pi * 440 * t) * 8000
+    audio_path = write_wav(tmp_path / "meeting.wav", tone.astype(np.int16), rate=44100)
+
+    result = preprocessing.preprocess(audio_path)
+
+    assert result['path'] == f"{audio_path}.speech.wav"
+    assert result['duration_ms'] == 6000
+    assert result['processed_bytes'] < result['original_bytes']
+    [[processed_start, original_start]] = result['offset_map']
+    assert processed_start == 0
+    assert abs(original_start - (2000 - preprocessing.VAD_PADDING_MS)) <= preprocessing.VAD_FRAME_MS
+    with wave.open(result['path'], 'rb') as wav:
+        kept_ms = wav.getnframes() * 1000 // wav.getframerate()
+        assert wav.getframerate() == RATE
+    assert abs(kept_ms + result['trimmed_ms'] - 6000) <= 1
+
+    # The tone's onset lands back where it was in the original
+    processed = preprocessing.decode(result['path'])
+    onset_ms = int(np.flatnonzero(preprocessing.frame_energy_db(processed) > -20)[0]) * preprocessing.VAD_FRAME_MS
+    assert abs(preprocessing.to_original_ms(result['offset_map'], onset_ms) - 2000) <= 2 * preprocessing.VAD_FRAME_MS
+
+def test_pcm_is_read_in_chunks_past_a_short_estimate(monkeypatch):
+    monkeypatch.setattr(preprocessing, 'DECODE_CHUNK_BYTES', 4096)
+    samples = speech(0.5, 1.0, 0.5)
+
+    assert np.array_equal(preprocessing.read_pcm(io.BytesIO(samples.tobytes()), len(samples)), samples)
+    assert np.array_equal(preprocessing.read_pcm(io.BytesIO(samples.tobytes())), samples)
+    assert len(preprocessing.read_pcm(io.BytesIO(b''))) == 0
+
+def test_ffmpeg_output_is_streamed_from_its_pipe(tmp_path, monkeypatch):
+    # A stand-in ffmpeg that writes the WAV's samples to stdout, or fails on request
+    audio_path = write_wav(tmp_path / "meeting.wav", speech())
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "ffmpeg"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import sys, wave\n"
+        "path = sys.argv[sys.argv.index('-i') + 1]\n"
+        "if path.endswith('.broken'):\n"
+        "    sys.stderr.write('Invalid data found')\n"
+        "    sys.exit(1)\n"
+        "with wave.open(path, 'rb') as wav:\n"
+        "    sys.stdout.buffer.write(wav.readframes(wav.getnframes()))\n"
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bin_dir), prepend=os.pathsep)
+    monkeypatch.setattr(preprocessing, 'has_ffmpeg', lambda: True)
+    monkeypatch.setattr(preprocessing, 'DECODE_CHUNK_BYTES', 4096)
+
+    assert np.array_equal(preprocessing.decode(audio_path), speech())
+
+    broken = tmp_path / "meeting.broken"
+    broken.write_bytes(b'not audio')
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        preprocessing.decode(str(broken), duration=1.0)
+    assert b'Invalid data' in error.value.stderr
+
+@pytest.mark.parametrize('broken', ['decode', 'encode'])
+def test_original_is_uploaded_when_preprocessing_fails(tmp_path, monkeypatch, broken):
+    audio_path = write_wav(tmp_path / "meeting.wav", speech())
+    submitted = []
+
+    class Transcriber:
+        def submit(self, path, config=None):
+            submitted.append(path)
+            return "transcript"
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("no encoder")
+
+    monkeypatch.setattr(transcription, 'get_transcriber', Transcriber)
+    monkeypatch.setattr(preprocessing, broken, fail)
+
+    assert transcription.upload_audio(audio_path, None, preprocess=True) == ("transcript", None)
+    assert submitted == [audio_path]
+
+def test_processed_file_is_uploaded_then_removed(tmp_path, monkeypatch):
+    audio_path = write_wav(tmp_path / "meeting.wav", speech())
+    submitted = []
+
+    class Transcriber:
+        def submit(self, path, config=None):
+            with wave.open(path, 'rb') as wav:
+                submitted.append(wav.getnframes())
+            return "transcript"
+
+    monkeypatch.setattr(transcription, 'get_transcriber', Transcriber)
+
+    transcript, offset_map = transcription.upload_audio(audio_path, None, preprocess=True)
+
+    assert transcript == "transcript"
+    assert offset_map[0][1] > 1000
+    assert submitted[0] < len(speech()) // 2
+    assert not (tmp_path / "meeting.wav.speech.wav").exists()
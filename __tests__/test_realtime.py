@@ -0,0 +1,177 @@
+import base64
+import json
+import threading
+import time
+import wave
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pytest
+import realtime
+import transcription
+
+websockets_server = pytest.importorskip('websockets.sync.server')
+
+class MockRealtimeService:
+    """A local websocket server speaking AssemblyAI's real-time protocol.
+
+    It decodes the base64 PCM16 audio streamed to it, sends a partial
+    transcript for every 500 ms of audio and a final one every second, each
+    after delay seconds, with audio_end counted from the session's start as
+    the service does. With drop_after set, the first session is closed with
+    an internal error once that many seconds of audio have arrived.
+    """
+
+    def __init__(self, delay: float = 0.05, respond: bool = True, drop_after: int = None):
+        self.delay = delay
+        self.respond = respond
+        self.drop_after = drop_after
+        self.sessions = []
+        self.requests = []
+        self.terminated = 0
+        self.server = websockets_server.serve(self.handle, "127.0.0.1", 0)
+        self.url = f"ws://127.0.0.1:{self.server.socket.getsockname()[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def samples(self) -> int:
+        return sum(self.sessions)
+
+    def handle(self, websocket):
+        session = len(self.sessions)
+        self.sessions.append(0)
+        self.requests.append(websocket.request)
+        websocket.send(json.dumps({'message_type': 'SessionBegins', 'session_id': str(session),
+                                   'expires_at': "2024-01-01T00:00:00"}))
+        for message in websocket:
+            message = json.loads(message)
+            if message.get('terminate_session'):
+                self.terminated += 1
+                return
+
+            before = self.sessions[session] * 1000 // realtime.SAMPLE_RATE
+            self.sessions[session] += len(base64.b64decode(message['audio_data'])) // 2
+            after = self.sessions[session] * 1000 // realtime.SAMPLE_RATE
+            if self.respond and after // 500 > before // 500:
+                end = after // 500 * 500
+                threading.Timer(self.delay, self.send, (websocket, session, end)).start()
+            if session == 0 and self.drop_after and after >= self.drop_after * 1000:
+                websocket.close(1011, "Internal error")
+                return
+
+    def send(self, websocket, session: int, audio_end: int):
+        final = audio_end % 1000 == 0
+        text = f"session {session} second {audio_end // 1000}" if final else "speaking"
+        message = {'message_type': 'FinalTranscript' if final else 'PartialTranscript',
+                   'audio_start': audio_end - (1000 if final else 500), 'audio_end': audio_end,
+                   'confidence': 0.9, 'text': text, 'words': [], 'created': "2024-01-01T00:00:00"}
+        if final:
+            message.update(punctuated=True, text_formatted=True)
+        try:
+            websocket.send(json.dumps(message))
+        except Exception:
+            pass  # The session closed first
+
+    def shutdown(self):
+        self.server.shutdown()
+
+@pytest.fixture
+def service(monkeypatch):
+    """Start a mock service and point the AssemblyAI SDK at it"""
+    aai = transcription.assemblyai()
+    services = []
+
+    def start(**options):
+        services.append(MockRealtimeService(**options))
+        monkeypatch.setattr(aai.settings, 'base_url', services[-1].url)
+        monkeypatch.setattr(aai.settings, 'api_key', "test-key")
+        return services[-1]
+
+    yield start
+    for started in services:
+        started.shutdown()
+
+def write_wav(path, seconds: float, rate: int = 44100, channels: int = 2):
+    samples = (np.sin(np.arange(int(rate * seconds)) / 20) * 8000).astype(np.int16)
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.repeat(samples, channels).tobytes())
+    return str(path)
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+def test_replayed_file_is_transcribed_with_capture_to_text_latency(tmp_path, service):
+    service = service(delay=0.05)
+    source = realtime.FileSource(write_wav(tmp_path / "talk.wav", 3), speed=3)
+    pipeline = realtime.RealtimePipeline(source)
+
+    pipeline.start()
+    pipeline.wait()
+    # Let the streamed audio and the last delayed transcript arrive before closing
+    assert wait_for(lambda: len(pipeline.finals) == 3)
+    pipeline.stop()
+
+    query = parse_qs(urlparse(service.requests[0].path).query)
+    assert query['sample_rate'] == [str(realtime.SAMPLE_RATE)]
+    assert service.requests[0].headers['Authorization'] == "test-key"
+    assert wait_for(lambda: service.terminated == 1)
+    assert abs(service.samples - 3 * realtime.SAMPLE_RATE) < realtime.CHUNK_SAMPLES
+    assert pipeline.finals == ["session 0 second 1", "session 0 second 2", "session 0 second 3"]
+    assert pipeline.text == "session 0 second 1 session 0 second 2 session 0 second 3"
+    assert pipeline.errors == [] and pipeline.overruns == 0 and pipeline.reconnects == 0
+
+    # Each transcript arrives the service's delay after the chunk ending its
+    # audio was captured, plus up to one chunk of buffering
+    stats = pipeline.latency_stats()
+    assert stats['count'] >= 5
+    assert 0.05 <= stats['p50'] < 0.05 + realtime.CHUNK_MS / 1000 + 0.15
+
+def test_dropped_session_is_reopened_and_keeps_the_timeline(tmp_path, service):
+    service = service(delay=0, drop_after=1)
+    source = realtime.FileSource(write_wav(tmp_path / "talk.wav", 3, rate=16000, channels=1), speed=2)
+    pipeline = realtime.RealtimePipeline(source)
+
+    pipeline.start()
+    pipeline.wait()
+    assert wait_for(lambda: any(text.startswith("session 1 second 2") for text in pipeline.finals))
+    pipeline.stop()
+
+    assert len(service.sessions) == 2 and pipeline.reconnects == 1
+    assert pipeline.errors == ["Internal error"]
+    assert pipeline.finals[0] == "session 0 second 1"
+    assert pipeline.finals[-1] == "session 1 second 2"
+    # Only audio already handed to the dropped connection is lost
+    assert service.samples > 3 * realtime.SAMPLE_RATE - 3 * realtime.CHUNK_SAMPLES
+
+    # Second-session transcripts map onto the whole recording's capture times:
+    # without the session's start offset they would look half a second or more late
+    assert pipeline.latency_stats()['max'] < 0.4
+
+def test_session_that_keeps_dropping_is_given_up_on(tmp_path, service, monkeypatch):
+    monkeypatch.setattr(realtime, 'REALTIME_RECONNECTS', 0)
+    service(respond=False, drop_after=1)
+    source = realtime.FileSource(write_wav(tmp_path / "talk.wav", 10, rate=16000, channels=1), speed=10)
+    pipeline = realtime.RealtimePipeline(source)
+
+    pipeline.start()
+    assert wait_for(lambda: not pipeline.running)
+
+    assert pipeline.errors == ["Internal error", "The real-time session kept dropping"]
+    pipeline.stop()
+
+def test_capture_times_are_capped_when_no_transcript_arrives(tmp_path, service, monkeypatch):
+    monkeypatch.setattr(realtime, 'LATENCY_HISTORY_SECONDS', 1)
+    service(respond=False)
+    source = realtime.FileSource(write_wav(tmp_path / "talk.wav", 2, rate=16000, channels=1), speed=20)
+    pipeline = realtime.RealtimePipeline(source)
+
+    pipeline.start()
+    pipeline.stop(drain=True)
+
+    assert len(pipeline._captured) == 1000 // source.block_ms
+    assert pipeline.latency_stats() == {}
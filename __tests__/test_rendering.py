@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+import rendering
+import transcript_store
+import transcription
+
+def make_transcript(count):
+    return SimpleNamespace(
+        utterances=[
+            SimpleNamespace(speaker='AB'[i // 2 % 2], text=f"line {i} <b>bold</b>.", start=i * 1000,
+                            end=i * 1000 + 900, confidence=0.9, words=[])
+            for i in range(count)
+        ],
+        chapters=[SimpleNamespace(headline="wrap up", summary="done.", gist="end", start=0, end=count * 1000)],
+        sentiment_analysis=[]
+    )
+
+def write_transcript(tmp_path, count, with_store):
+    transcript = make_transcript(count)
+    path = str(tmp_path / "talk.txt")
+    transcription.write_transcript(transcription.iter_transcript(transcript), path)
+    if with_store:
+        transcript_store.write(transcript, transcript_store.store_path_for(path))
+    return path
+
+def test_store_pages_cover_every_utterance_once(tmp_path):
+    path = write_transcript(tmp_path, 25, with_store=True)
+
+    pages = [rendering.render_transcript_page(path, page, page_size=10) for page in (1, 2, 3)]
+
+    assert [p[2] for p in pages] == [3, 3, 3]
+    html = "".join(p[0] for p in pages)
+    assert all(html.count(f"Line {i} ") == 1 for i in range(25))
+    assert "&lt;b&gt;bold&lt;/b&gt;" in html
+    assert "Chapter Summary" in pages[2][0] and "Chapter Summary" not in pages[0][0]
+
+def test_text_pages_slice_the_rendered_lines(tmp_path):
+    path = write_transcript(tmp_path, 25, with_store=False)
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().split('\n')
+
+    html, page, pages = rendering.render_transcript_page(path, 2, page_size=10)
+
+    assert (page, pages) == (2, -(-len(lines) // 10))
+    assert html.split('<br>') == [line.replace('<', '&lt;').replace('>', '&gt;') for line in lines[10:20]]
+
+def test_out_of_range_pages_are_clamped(tmp_path):
+    path = write_transcript(tmp_path, 5, with_store=True)
+
+    assert rendering.render_transcript_page(path, 99, page_size=10)[1:] == (1, 1)
+    assert rendering.render_sentiment_page(path, [], 3)[1:] == (1, 1)
+
+def test_sentiment_pages_render_one_block(tmp_path):
+    sentiment = [{'text': f"row {i}", 'sentiment': 'NEGATIVE', 'confidence': 0.5} for i in range(7)]
+
+    html, page, pages = rendering.render_sentiment_page(str(tmp_path / "talk.txt"), sentiment, 2, page_size=3)
+
+    assert (page, pages) == (2, 3)
+    assert html == "🔴 row 3<br>🔴 row 4<br>🔴 row 5"
+
+def test_text_pages_are_cached_without_the_text():
+    text = "\n".join(f"line {i} <b>" for i in range(25))
+    loads = []
+
+    def load_text():
+        loads.append(1)
+        return text
+
+    assert rendering.render_text_page("result-1", load_text, 2, page_size=10) == \
+        ("<br>".join(f"line {i} &lt;b&gt;" for i in range(10, 20)), 2, 3)
+    assert rendering.render_text_page("result-1", load_text, 2, page_size=10)[1:] == (2, 3)
+    assert len(loads) == 1
+
+    rendering.render_text_page("result-1", load_text, 3, page_size=10)
+    assert len(loads) == 2
+    assert not any(value is text for value in rendering._cache.values())
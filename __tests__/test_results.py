@@ -0,0 +1,164 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+import redis
+import auth
+import benchmark
+import results
+import storage
+import transcription
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OWNER = "user@example.com"
+
+# Two app replicas sharing Redis: the first finishes a job and saves the
+# transcript to its own disk, the second serves it to the same user
+INSTANCE_A = """
+import os, sys
+import benchmark, jobs, search, storage, transcription
+jobs.start_workers = lambda count=None: None
+owner, path = sys.argv[1:]
+search.INDEX_PATH = os.path.join(os.path.dirname(path), 'search.db')
+transcript = benchmark.fake_transcript(500, 12)
+path = storage.save_transcript(path, transcription.iter_transcript(transcript))
+job_id = jobs.submit_job('', 'meeting.wav', None, owner)
+callbacks = jobs._job_callbacks(job_id, owner)
+callbacks['on_transcript'](path, False)
+callbacks['on_intelligence']('summary', transcription.extract_summary(transcript), None)
+callbacks['on_intelligence']('sentiment', transcription.extract_sentiment(transcript), None)
+print(job_id, path)
+"""
+INSTANCE_B = """
+import json, sys
+import jobs, results
+owner, job_id = sys.argv[1:]
+job = jobs.get_job(job_id)
+print(json.dumps({'job': job, 'text': results.get_transcript(owner, job['result_id'])}))
+"""
+
+# Uploads are queued on the host that saved them; workers there transcribe
+# them, here with a stand-in for AssemblyAI
+SUBMIT = """
+import sys
+import jobs
+jobs.start_workers = lambda count=None: None
+owner, audio_path = sys.argv[1:]
+print(jobs.submit_job(audio_path, 'meeting.wav', None, owner))
+"""
+WORK = """
+import os, sys
+import jobs, search, transcription
+directory, = sys.argv[1:]
+search.INDEX_PATH = os.path.join(directory, 'search.db')
+
+def transcribe_audio(audio_path, original_filename, audio_hash=None, progress=None,
+                     on_transcript=None, on_intelligence=None, **options):
+    with open(audio_path, 'rb'):
+        pass
+    transcript_path = os.path.join(directory, 'meeting.txt')
+    with open(transcript_path, 'w') as f:
+        f.write("\\nSpeaker A:\\nHello.")
+    on_transcript(transcript_path, False)
+    return {'transcript_path': transcript_path}
+
+transcription.transcribe_audio = transcribe_audio
+print(jobs.work_once(timeout=0.5))
+"""
+
+@pytest.fixture
+def shared_redis():
+    benchmark.install_fakes()
+    benchmark.auth.get_redis().flushall()
+    return benchmark.auth.get_redis()
+
+def save(tmp_path, utterances=300):
+    transcript = benchmark.fake_transcript(utterances, 12)
+    path = storage.save_transcript(str(tmp_path / "meeting.txt"), transcription.iter_transcript(transcript))
+    return transcript, path
+
+def test_results_are_compressed_and_expire(shared_redis, tmp_path):
+    transcript, path = save(tmp_path)
+    text = storage.read_transcript(path)
+
+    result_id = results.save_transcript(OWNER, path)
+    results.save_intelligence(OWNER, result_id, 'summary', transcription.extract_summary(transcript))
+    results.save_intelligence(OWNER, result_id, 'action_items', '', TimeoutError("too slow"))
+
+    key = f"result:{OWNER}:{result_id}"
+    assert len(shared_redis.hget(key, 'text')) < len(text) / 2
+    assert 0 < shared_redis.ttl(key) <= results.RESULT_TTL
+    assert results.get_transcript(OWNER, result_id) == text
+
+    result = results.get_result(OWNER, result_id)
+    assert 'text' not in result
+    assert result['filename'] == "meeting.txt"
+    assert result['text_bytes'] == len(text.encode('utf-8'))
+    assert result['intelligence'] == {'summary': transcription.extract_summary(transcript), 'action_items': ''}
+    assert result['intelligence_errors'] == {'action_items': "too slow"}
+    assert [r['id'] for r in results.list_results(OWNER)] == [result_id]
+
+    # Other users cannot read it, and an expired result is not brought back by a late section
+    assert results.get_result("someone@example.com", result_id) is None
+    shared_redis.delete(key)
+    results.save_intelligence(OWNER, result_id, 'topics', [])
+    assert results.get_result(OWNER, result_id) is None
+    assert results.list_results(OWNER) == []
+
+@pytest.fixture
+def instances():
+    """Run code as separate app instances sharing one fake Redis server"""
+    server = fakeredis.TcpFakeServer(('127.0.0.1', 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = dict(os.environ, REDIS_URL=f"127.0.0.1:{server.server_address[1]}", METRICS_ENABLED='false')
+    env.pop('REDIS_PASSWORD', None)
+    env.pop('ASSEMBLYAI_WEBHOOK_URL', None)
+    # The fake TCP server drops a connection after any error reply, so load
+    # the script up front rather than letting EVALSHA hit NOSCRIPT first
+    redis.Redis(*server.server_address).script_load(auth.HSET_IF_EXISTS_SCRIPT)
+
+    def instance(code, *args, host='a'):
+        result = subprocess.run([sys.executable, '-c', code, *args], cwd=ROOT,
+                                env=dict(env, TRANSCRIPTION_WORKER_HOST=host),
+                                capture_output=True, text=True, check=True)
+        return result.stdout.split()
+
+    instance.redis = redis.Redis(*server.server_address, decode_responses=True)
+    yield instance
+    server.shutdown()
+    server.server_close()
+
+def test_result_from_one_instance_is_served_by_another(instances, tmp_path):
+    job_id, path = instances(INSTANCE_A, OWNER, str(tmp_path / "meeting.txt"))
+    expected = storage.read_transcript(path)
+    # The second instance has no copy of the first one's disk
+    os.unlink(path)
+
+    served = json.loads(" ".join(instances(INSTANCE_B, OWNER, job_id, host='b')))
+
+    transcript = benchmark.fake_transcript(500, 12)
+    assert served['text'] == expected == transcription.format_transcript(transcript)
+    assert served['job']['status'] == 'completed'
+    assert served['job']['intelligence'] == {
+        'summary': transcription.extract_summary(transcript),
+        'sentiment': transcription.extract_sentiment(transcript)
+    }
+
+def test_jobs_run_on_the_host_holding_their_audio(instances, tmp_path):
+    audio_path = tmp_path / "meeting.wav"
+    audio_path.write_bytes(b'\0' * 64)
+    job_id, = instances(SUBMIT, OWNER, str(audio_path))
+
+    # Another host has no copy of the upload, so its workers leave the job alone
+    assert instances(WORK, str(tmp_path), host='b') == ["False"]
+    assert instances.redis.hget(f"job:{job_id}", 'status') == 'queued'
+
+    assert instances(WORK, str(tmp_path), host='a') == ["True"]
+    assert instances.redis.hget(f"job:{job_id}", 'status') == 'completed'
+    assert not audio_path.exists()
+    assert instances(WORK, str(tmp_path), host='a') == ["False"]
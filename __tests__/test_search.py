@@ -0,0 +1,96 @@
+import os
+import threading
+import pytest
+import dedup
+import search
+import storage
+
+ALICE = "alice@example.com"
+BOB = "bob@example.com"
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(search, 'INDEX_PATH', str(tmp_path / "search.db"))
+    monkeypatch.setattr(search, '_local', threading.local())
+    monkeypatch.setattr(search, '_synced', True)
+    monkeypatch.setattr(dedup, 'INDEX_PATH', str(tmp_path / "dedup.db"))
+    monkeypatch.setattr(dedup, '_local', threading.local())
+    monkeypatch.setattr(storage, 'TRANSCRIPT_COMPRESSION', False)
+    directory = tmp_path / "transcripts"
+    directory.mkdir()
+
+    def save(name, text, owner=ALICE):
+        path = storage.save_transcript(str(directory / name), [text])
+        if owner:
+            search.add_owner(path, owner)
+        return path
+
+    return str(directory), save
+
+def test_blocks_are_matched_by_speaker_with_snippets(index):
+    directory, save = index
+    pricing = save("pricing.txt", "\nSpeaker A:\nThe pricing decision waits for finance.\n"
+                                  "\nSpeaker B:\nPricing again? Fine.\n\nChapter Summary:\nThey discuss pricing.")
+    save("hiring.txt", "\nSpeaker A:\nWe are hiring two engineers.")
+    assert search.sync_index(directory) == 2
+
+    hits = search.search("pricing decision", ALICE)
+    assert [hit['filename'] for hit in hits] == ["pricing.txt"]
+    assert hits[0]['path'] == pricing
+    assert hits[0]['speaker'] == 'A'
+    assert "**pricing**" in hits[0]['snippet'] and "**decision**" in hits[0]['snippet']
+
+    # One hit per transcript, narrowed to a speaker or the chapter summary on request
+    assert len(search.search("pricing", ALICE)) == 1
+    assert search.search("pricing", ALICE, speaker='B')[0]['snippet'] == "**Pricing** again? Fine."
+    assert search.search("discuss", ALICE)[0]['speaker'] == ''
+    assert search.search("engineers", ALICE, speaker='B') == []
+
+    # User input is never parsed as FTS syntax: every word has to appear
+    assert search.search('pricing" OR NEAR(', ALICE) == []
+    assert search.search('pricing" AND "finance', ALICE) == []
+    assert search.search('pricing finance', ALICE)[0]['path'] == pricing
+    assert search.search("!?", ALICE) == []
+
+def test_users_only_find_their_own_transcripts(index):
+    directory, save = index
+    save("mine.txt", "\nSpeaker A:\nThe roadmap for next quarter.")
+    save("theirs.txt", "\nSpeaker A:\nA secret roadmap.", owner=BOB)
+    shared = save("shared.txt", "\nSpeaker A:\nA shared roadmap.", owner=BOB)
+    save("nobody.txt", "\nSpeaker A:\nAn old roadmap.", owner=None)
+    search.add_owner(shared, ALICE)
+    search.sync_index(directory)
+
+    assert sorted(hit['filename'] for hit in search.search("roadmap", ALICE)) == ["mine.txt", "shared.txt"]
+    assert sorted(hit['filename'] for hit in search.search("roadmap", BOB)) == ["shared.txt", "theirs.txt"]
+    assert search.search("roadmap", "eve@example.com") == []
+    assert search.is_owner(shared, ALICE) and search.is_owner(shared, BOB)
+    assert not search.is_owner(shared + storage.COMPRESSED_SUFFIX, "eve@example.com")
+
+def test_changed_and_deleted_files_are_resynced(index, monkeypatch):
+    directory, save = index
+    path = save("standup.txt", "\nSpeaker A:\nThe build is broken.")
+    search.sync_index(directory)
+    assert search.sync_index(directory) == 0
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\nSpeaker A:\nThe build is green.")
+    os.utime(path, (1, 1))
+    assert search.sync_index(directory) == 1
+    assert search.search("broken", ALICE) == []
+    assert search.search("green", ALICE)[0]['path'] == path
+
+    os.unlink(path)
+    search.sync_index(directory)
+    assert search.search("green", ALICE) == []
+
+    # A transcript compressed since it was indexed keeps its owner
+    pytest.importorskip('zstandard')
+    monkeypatch.setattr(storage, 'TRANSCRIPT_COMPRESSION', True)
+    compressed = save("retro.txt", "\nSpeaker A:\nThe retro went well.", owner=None)
+    search.add_owner(compressed[:-len(storage.COMPRESSED_SUFFIX)], ALICE)
+    search.index_transcript(compressed)
+    assert search.search("retro", ALICE)[0]['filename'] == "retro.txt"
+
+    search.remove_transcript(compressed)
+    assert search.search("retro", ALICE) == []
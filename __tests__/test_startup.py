@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+import benchmark
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def loaded(code: str, modules: tuple) -> list:
+    """Which of modules a fresh interpreter has imported after running code"""
+    check = f"import sys, json; sys.path.insert(0, {APP_DIR!r}); {code}; " \
+            f"print(json.dumps([name for name in {list(modules)!r} if name in sys.modules]))"
+    completed = subprocess.run([sys.executable, '-c', check], cwd=APP_DIR, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.splitlines()[-1])
+
+def test_login_page_imports_stay_light():
+    # app.py's top-level imports, which every visitor pays for (streamlit
+    # is left out where it is not installed)
+    always, _ = benchmark.app_imports(APP_DIR)
+    login = "; ".join(f"import {name}" for name in always)
+
+    assert loaded(login, ('assemblyai', 'numpy', 'redis', 'smtplib', 'http.server')) == []
+
+def test_sdk_loads_only_when_first_used():
+    always, signed_in = benchmark.app_imports(APP_DIR)
+    app = "; ".join(f"import {name}" for name in always + signed_in)
+
+    assert loaded(app, ('assemblyai', 'redis')) == []
+    assert loaded(f"{app}; transcription.assemblyai()", ('assemblyai',)) == ['assemblyai']
+    assert loaded("import benchmark", ('assemblyai',)) == []
+
+def test_redis_client_is_still_available_from_auth():
+    pytest.importorskip('fakeredis')
+    import auth
+    benchmark.install_fakes()
+
+    assert auth.redis_client is auth.get_redis()
+    with pytest.raises(AttributeError):
+        auth.no_such_name
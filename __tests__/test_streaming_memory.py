@@ -0,0 +1,65 @@
+import tracemalloc
+from types import SimpleNamespace
+import pytest
+import storage
+import transcription
+
+MIB = 1024 * 1024
+
+class ZeroUpload:
+    """An upload of size bytes that allocates nothing while it is read"""
+
+    def __init__(self, size: int):
+        self.remaining = size
+        self.zeros = memoryview(bytes(storage.CHUNK_SIZE))
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.remaining)
+        buffer[:count] = self.zeros[:count]
+        self.remaining -= count
+        return count
+
+def peak_allocation(work) -> int:
+    tracemalloc.start()
+    try:
+        work()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_save_stream_memory_does_not_grow_with_upload_size(tmp_path):
+    uploads = {size: ZeroUpload(size * MIB) for size in (8, 64)}
+    peaks = {size: peak_allocation(lambda: storage.save_stream(upload, "talk.wav", str(tmp_path)))
+             for size, upload in uploads.items()}
+
+    # One reused chunk buffer, whatever the size of the upload
+    assert peaks[64] < storage.CHUNK_SIZE + MIB
+    assert peaks[64] < peaks[8] * 1.5
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_saving_a_long_transcript_streams_it_to_disk(tmp_path, monkeypatch, compressed):
+    if compressed:
+        pytest.importorskip('zstandard')
+    monkeypatch.setattr(storage, 'TRANSCRIPT_COMPRESSION', compressed)
+    # No trained dictionary; the one in storage/ would be loaded inside the measurement
+    monkeypatch.setattr(storage, 'current_dictionary', lambda: None)
+    utterances = 100_000
+    transcript = SimpleNamespace(
+        utterances=(SimpleNamespace(speaker="AB"[i // 3 % 2], text=f"item {i} is on the agenda. next one?")
+                    for i in range(utterances)),
+        chapters=[]
+    )
+
+    path = None
+
+    def save():
+        nonlocal path
+        path = storage.save_transcript(str(tmp_path / "meeting.txt"), transcription.iter_transcript(transcript))
+
+    peak = peak_allocation(save)
+
+    # The document is megabytes long, but only a piece of it is held at a time
+    with storage.open_transcript(path, 'rb') as f:
+        assert len(f.read()) > 2 * MIB
+    assert path.endswith(storage.COMPRESSED_SUFFIX) == compressed
+    assert peak < MIB
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+import pytest
+
+pytest.importorskip('fakeredis')
+
+import benchmark
+import dedup
+import search
+import storage
+import transcript_cache
+import transcription
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcript_cache, 'CACHE_DIR', str(tmp_path / "cache"))
+    monkeypatch.setattr(transcript_cache, '_stats', dict.fromkeys(transcript_cache._stats, 0))
+    os.makedirs(transcript_cache.CACHE_DIR)
+    return tmp_path
+
+@pytest.fixture
+def assemblyai(cache, tmp_path, monkeypatch):
+    """Transcriptions that go through the cache, with AssemblyAI replaced by a counter"""
+    benchmark.install_fakes()
+    benchmark.auth.get_redis().flushall()
+    monkeypatch.setattr(transcription, 'TRANSCRIPT_DIR', str(tmp_path))
+    monkeypatch.setattr(storage, 'TRANSCRIPT_COMPRESSION', False)
+    monkeypatch.setattr(search, 'INDEX_PATH', str(tmp_path / "search.db"))
+    monkeypatch.setattr(search, '_local', threading.local())
+    monkeypatch.setattr(dedup, 'INDEX_PATH', str(tmp_path / "dedup.db"))
+    monkeypatch.setattr(dedup, '_local', threading.local())
+    # The pinned SDK's TranscriptionConfig has no 'topics' option
+    monkeypatch.setattr(transcription, 'TRANSCRIPTION_OPTIONS',
+                        {k: v for k, v in transcription.TRANSCRIPTION_OPTIONS.items() if k != 'topics'})
+    monkeypatch.setattr(transcription.chunking, 'is_long', lambda audio_path: False)
+    uploads = []
+
+    def upload_audio(audio_path, config, preprocess):
+        uploads.append(audio_path)
+        return benchmark.fake_transcript(40, 8), None
+
+    monkeypatch.setattr(transcription, 'upload_audio', upload_audio)
+    monkeypatch.setattr(transcription, 'wait_for_transcript', lambda transcript, progress: transcript)
+
+    def transcribe(audio_hash, name="meeting.wav", preprocess=False):
+        audio_path = tmp_path / name
+        audio_path.write_bytes(b'\0' * 64)
+        return transcription.transcribe_audio(str(audio_path), name, audio_hash, preprocess=preprocess)
+
+    return transcribe, uploads
+
+def test_identical_audio_is_served_from_the_cache(assemblyai):
+    transcribe, uploads = assemblyai
+
+    first = transcribe("hash-1")
+    # Same day, so a distinct name keeps the saved transcripts apart
+    second = transcribe("hash-1", name="again.wav")
+
+    assert len(uploads) == 1
+    assert not first['cached'] and second['cached']
+    assert second['transcript_path'] == first['transcript_path']
+    assert second['intelligence'] == first['intelligence']
+    assert second['chapters'] == first['chapters']
+    assert transcript_cache.get_stats() == {'hits': 1, 'misses': 1, 'stores': 1, 'evictions': 0, 'hit_rate': 0.5}
+
+    # A deleted transcript is restored from the cache's own copy
+    text = storage.read_transcript(first['transcript_path'])
+    os.unlink(first['transcript_path'])
+    third = transcribe("hash-1", name="restored.wav")
+    assert len(uploads) == 1
+    assert storage.read_transcript(third['transcript_path']) == text
+
+def test_other_audio_or_options_miss(assemblyai):
+    transcribe, uploads = assemblyai
+    transcribe("hash-1")
+
+    transcribe("hash-2", name="other.wav")
+    transcribe("hash-1", name="preprocessed.wav", preprocess=True)
+
+    assert len(uploads) == 3
+    assert transcript_cache.get_stats()['hits'] == 0
+    assert transcript_cache.get_stats()['misses'] == 3
+
+def test_key_covers_every_option():
+    options = {'speaker_labels': True, 'language_code': 'en'}
+
+    assert transcript_cache.cache_key("hash", options) == \
+        transcript_cache.cache_key("hash", {'language_code': 'en', 'speaker_labels': True})
+    assert transcript_cache.cache_key("hash", options) != \
+        transcript_cache.cache_key("hash", dict(options, language_code='de'))
+    assert transcript_cache.cache_key("hash", options) != transcript_cache.cache_key("other", options)
+
+def test_least_recently_used_entries_are_evicted_past_the_size_limit(cache, monkeypatch):
+    text_path = cache / "meeting.txt"
+    text_path.write_text("x" * 1000)
+    now = time.time()
+    for age, key in ((300, "old"), (200, "used"), (100, "new")):
+        transcript_cache.put(key, {'chapters': []}, str(text_path))
+        os.utime(transcript_cache._entry_path(key), (now - age, now - age))
+    assert transcript_cache.get("used")['chapters'] == []
+
+    # Room for two entries: the oldest one not looked at since goes
+    monkeypatch.setattr(transcript_cache, 'CACHE_MAX_BYTES', 2200)
+    transcript_cache.evict()
+
+    assert transcript_cache.get("old") is None
+    assert transcript_cache.get("used") is not None and transcript_cache.get("new") is not None
+    assert not os.path.exists(transcript_cache._text_path("old"))
+
+    # Entries past the max age go whatever the size
+    monkeypatch.setattr(transcript_cache, 'CACHE_MAX_AGE', 150)
+    os.utime(transcript_cache._entry_path("new"), (now - 160, now - 160))
+    assert transcript_cache.get("new") is None
+
+    stats = transcript_cache.get_stats()
+    assert (stats['stores'], stats['evictions'], stats['hits'], stats['misses']) == (3, 2, 3, 2)
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+import transcript_store
+import transcription
+
+def word(text, start, end):
+    return SimpleNamespace(text=text, start=start, end=end, confidence=0.9)
+
+def make_transcript():
+    return SimpleNamespace(
+        utterances=[
+            SimpleNamespace(speaker='A', text="hello there. how are you?", start=0, end=2000, confidence=0.95,
+                            words=[word("hello", 0, 400), word("there.", 450, 900),
+                                   word("how", 1000, 1200), word("are", 1250, 1400), word("you?", 1450, 2000)]),
+            SimpleNamespace(speaker='B', text="fine, thanks.", start=2500, end=3500, confidence=0.9,
+                            words=[word("fine,", 2500, 2900), word("thanks.", 3000, 3500)]),
+            SimpleNamespace(speaker='A', text="great. let's start.", start=4000, end=5500, confidence=0.85,
+                            words=[word("great.", 4000, 4500), word("let's", 4800, 5000), word("start.", 5100, 5500)]),
+        ],
+        chapters=[SimpleNamespace(headline="greetings", summary="they say hello.", gist="hi", start=0, end=5500)],
+        sentiment_analysis=[
+            SimpleNamespace(text="fine, thanks.", sentiment='POSITIVE', confidence=0.8, speaker='B', start=2500, end=3500),
+        ]
+    )
+
+def test_store_regenerates_the_text_format(tmp_path):
+    transcript = make_transcript()
+    store_path = str(tmp_path / "talk.sst")
+    transcript_store.write(transcript, store_path)
+
+    text_path = transcript_store.render_text(store_path)
+
+    with open(text_path, encoding='utf-8') as f:
+        assert f.read() == transcription.format_transcript(transcript)
+
+def test_store_slices_by_time_and_speaker(tmp_path):
+    store_path = str(tmp_path / "talk.sst")
+    transcript_store.write(make_transcript(), store_path)
+
+    with transcript_store.TranscriptStore(store_path) as store:
+        assert [w.text for w in store.words(1000, 3000)] == ["how", "are", "you?", "fine,"]
+        assert [w.text for w in store.words(speaker='B')] == ["fine,", "thanks."]
+        assert [w.text for w in store.words(2000, speaker='A')] == ["great.", "let's", "start."]
+        assert [u.text for u in store.utterances(speaker='A')] == ["hello there. how are you?", "great. let's start."]
+        assert store.words(speaker='C') == []
+        assert store.sentiment()[0].sentiment == 'POSITIVE'
+        assert store.sentiment()[0].speaker == 'B'
+
+def test_store_maps_times_back_to_the_original_audio(tmp_path):
+    store_path = str(tmp_path / "talk.sst")
+    transcript_store.write(make_transcript(), store_path, offset_map=[[0, 1500]])
+
+    with transcript_store.TranscriptStore(store_path) as store:
+        assert store.words()[0].start == 1500
+        assert store.chapters[0].end == 7000
+
+def test_store_handles_a_transcript_without_words(tmp_path):
+    store_path = str(tmp_path / "empty.sst")
+    transcript_store.write(SimpleNamespace(utterances=None, chapters=None, sentiment_analysis=None), store_path)
+
+    with transcript_store.TranscriptStore(store_path) as store:
+        assert store.words() == []
+        assert store.utterances(0, 1000) == []
@@ -0,0 +1,211 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+pytest.importorskip('fakeredis')
+
+import assemblyai as aai
+import benchmark
+import dedup
+import jobs
+import search
+import storage
+import transcription
+import webhooks
+
+SECRET = 'test-secret'
+
+def transcript_json(transcript_id: str, audio_url: str) -> dict:
+    words = [{'text': text, 'start': i * 500, 'end': i * 500 + 400, 'confidence': 0.9}
+             for i, text in enumerate("hello there. how are you?".split())]
+    return {
+        'id': transcript_id,
+        'status': 'completed',
+        'audio_url': audio_url,
+        'text': "hello there. how are you?",
+        'utterances': [{'speaker': 'A', 'text': "hello there. how are you?", 'start': 0, 'end': 2400,
+                        'confidence': 0.9, 'words': words}],
+        'chapters': [{'headline': "greetings", 'summary': "they say hello.", 'gist': "hi", 'start': 0, 'end': 2400}],
+        'sentiment_analysis_results': [{'text': "hello there.", 'start': 0, 'end': 900, 'confidence': 0.8,
+                                        'sentiment': 'POSITIVE', 'speaker': 'A'}]
+    }
+
+class FakeAssemblyAI(ThreadingHTTPServer):
+    """Answers the SDK's upload, submit and fetch calls, then calls the webhook like AssemblyAI does"""
+
+    def __init__(self, send_webhooks: bool = True):
+        super().__init__(('127.0.0.1', 0), FakeAssemblyAIHandler)
+        self.send_webhooks = send_webhooks
+        self.transcripts = {}
+        self.webhook_responses = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def call_webhook(self, request: dict, transcript_id: str):
+        webhook = urllib.request.Request(
+            request['webhook_url'],
+            data=json.dumps({'transcript_id': transcript_id, 'status': 'completed'}).encode('utf-8'),
+            headers={request['webhook_auth_header_name']: request['webhook_auth_header_value'],
+                     'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(webhook) as response:
+            self.webhook_responses.append(response.status)
+
+class FakeAssemblyAIHandler(BaseHTTPRequestHandler):
+    def _reply(self, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/v2/upload':
+            self._reply({'upload_url': f"{self.server.url}/audio/{len(body)}"})
+        elif self.path == '/v2/transcript':
+            request = json.loads(body)
+            transcript_id = f"t{len(self.server.transcripts) + 1}"
+            self.server.transcripts[transcript_id] = request
+            self._reply({'id': transcript_id, 'status': 'queued', 'audio_url': request['audio_url']})
+            if self.server.send_webhooks:
+                threading.Timer(0.05, self.server.call_webhook, (request, transcript_id)).start()
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        transcript_id = self.path.rsplit('/', 1)[-1]
+        request = self.server.transcripts.get(transcript_id)
+        if request is None:
+            self.send_error(404)
+            return
+        self._reply(transcript_json(transcript_id, request['audio_url']))
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def fake_services(tmp_path, monkeypatch):
+    benchmark.install_fakes()
+    jobs.get_redis().flushall()
+    monkeypatch.setattr(aai.settings, 'api_key', 'test-key')
+    monkeypatch.setattr(transcription, '_transcriber', None)
+    # The pinned SDK's TranscriptionConfig has no 'topics' option
+    monkeypatch.setattr(transcription, 'TRANSCRIPTION_OPTIONS',
+                        {k: v for k, v in transcription.TRANSCRIPTION_OPTIONS.items() if k != 'topics'})
+    monkeypatch.setattr(transcription, 'TRANSCRIPT_DIR', str(tmp_path))
+    monkeypatch.setattr(storage, 'TRANSCRIPT_COMPRESSION', False)
+    monkeypatch.setattr(search, 'INDEX_PATH', str(tmp_path / "search.db"))
+    monkeypatch.setattr(search, '_local', threading.local())
+    monkeypatch.setattr(dedup, 'INDEX_PATH', str(tmp_path / "dedup.db"))
+    monkeypatch.setattr(dedup, '_local', threading.local())
+    monkeypatch.setattr(jobs, 'start_workers', lambda count=None: None)
+
+    receiver = webhooks._handler_class()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), receiver)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(webhooks, 'WEBHOOK_URL', f"http://127.0.0.1:{server.server_address[1]}/assemblyai/webhook")
+    monkeypatch.setattr(webhooks, 'WEBHOOK_SECRET', SECRET)
+
+    def start(send_webhooks=True):
+        assemblyai = FakeAssemblyAI(send_webhooks)
+        threading.Thread(target=assemblyai.serve_forever, daemon=True).start()
+        monkeypatch.setattr(aai.settings, 'base_url', assemblyai.url)
+        return assemblyai
+
+    yield start
+    server.shutdown()
+
+def submit(tmp_path) -> str:
+    audio_path = str(tmp_path / "meeting.wav")
+    with wave.open(audio_path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b'\0\0' * 16000)
+    job_id = jobs.submit_job(audio_path, "meeting.wav", None, "user@example.com")
+    assert jobs.work_once(timeout=1)
+    return job_id
+
+def test_webhook_completes_a_submitted_job(fake_services, tmp_path):
+    assemblyai = fake_services()
+
+    job_id = submit(tmp_path)
+
+    job = jobs.get_job(job_id)
+    assert job['status'] == 'running'
+    assert job['stage'] == 'processing at AssemblyAI'
+    request = assemblyai.transcripts[job['transcript_id']]
+    assert request['webhook_url'].endswith(f"?job={job_id}")
+    assert request['webhook_auth_header_value'] == SECRET
+
+    # The worker thread was released; the callback queues the rest of the work
+    assert jobs.work_once(timeout=5)
+    job = jobs.get_job(job_id)
+    assert assemblyai.webhook_responses == [200]
+    assert job['status'] == 'completed'
+    assert job['intelligence_done'] == '1'
+    assert storage.read_transcript(job['transcript_path']) == "\nSpeaker A:\nHello there. How are you?\n" \
+        "\n\nChapter Summary:\n\nChapter 1: \nThey say hello."
+
+def test_missed_webhook_is_found_by_polling(fake_services, tmp_path, monkeypatch):
+    fake_services(send_webhooks=False)
+    monkeypatch.setattr(webhooks, 'WEBHOOK_GRACE', 0)
+
+    job_id = submit(tmp_path)
+
+    assert not jobs.work_once(timeout=0.1)
+    assert webhooks.poll_missed() == 1
+    assert webhooks.poll_missed() == 0
+    assert jobs.work_once(timeout=1)
+    assert jobs.get_job(job_id)['status'] == 'completed'
+
+def test_receiver_refuses_bad_secrets_and_counts_each_job_once(fake_services, tmp_path):
+    fake_services(send_webhooks=False)
+    job_id = submit(tmp_path)
+    transcript_id = jobs.get_job(job_id)['transcript_id']
+
+    def call(secret, transcript):
+        request = urllib.request.Request(
+            webhooks.webhook_url_for(job_id),
+            data=json.dumps({'transcript_id': transcript, 'status': 'completed'}).encode('utf-8'),
+            headers={webhooks.WEBHOOK_AUTH_HEADER: secret}, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    assert call('wrong', transcript_id) == 401
+    assert call(SECRET, 'someone-else') == 400
+    assert call(SECRET, transcript_id) == 200
+    assert call(SECRET, transcript_id) == 200
+    assert jobs.get_redis().llen(webhooks.COMPLETIONS_KEY) == 1
+
+def test_webhooks_stay_off_without_a_secret(monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_URL', "https://example.com/assemblyai/webhook")
+    monkeypatch.setattr(webhooks, 'WEBHOOK_SECRET', '')
+
+    assert not webhooks.enabled()
+    assert webhooks.start_receiver() is None
+
+def test_submission_that_never_got_a_transcript_id_is_failed(fake_services, monkeypatch):
+    monkeypatch.setattr(webhooks, 'WEBHOOK_GRACE', 0)
+    webhooks.track("stuck")
+    webhooks.track("submitting")
+    jobs.get_redis().zadd(webhooks.PENDING_KEY, {"stuck": 1000})
+
+    assert webhooks.poll_missed(now=1000 + webhooks.WEBHOOK_SUBMIT_TIMEOUT + 1) == 1
+
+    assert jobs.get_redis().zrange(webhooks.PENDING_KEY, 0, -1) == ["submitting"]
+    assert json.loads(jobs.get_redis().lindex(webhooks.COMPLETIONS_KEY, 0)) == \
+        {'job_id': "stuck", 'transcript_id': '', 'status': 'error'}
@@ -1,234 +1,129 @@
 import streamlit as st
-import assemblyai as aai
 import os
+import time
 from datetime import datetime
 from dotenv import load_dotenv
-import re
 from auth import (
     generate_magic_link, verify_magic_link, create_user, 
     get_user, approve_user, update_last_login, 
-    list_pending_users, is_admin, send_magic_link
+    list_pending_users, count_users, is_admin, send_magic_link
 )
+# jobs, storage, transcription and the other feature modules are imported
+# under "Main routing" below, only for signed-in users
 
 # Load environment variables from .env.local
 load_dotenv('.env.local')
 
-# Configure AssemblyAI with API key from environment
-aai.settings.api_key = os.getenv('ASSEMBLYAI_API_KEY')
-
-# Configure local storage
-STORAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage')
-AUDIO_DIR = os.path.join(STORAGE_DIR, 'audio')
-TRANSCRIPT_DIR = os.path.join(STORAGE_DIR, 'transcripts')
-
-# Create storage directories if they don't exist
-os.makedirs(AUDIO_DIR, exist_ok=True)
-os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
-
 # Initialize session state
 if 'user' not in st.session_state:
     st.session_state.user = None
 
 def upload_to_s3(file_obj, filename):
     """Upload a file to local storage"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    s3_key = f"{timestamp}_{filename}"
-    
     try:
-        file_path = os.path.join(AUDIO_DIR, s3_key)
-        with open(file_path, 'wb') as f:
-            f.write(file_obj.getvalue())
-        return file_path
+        return storage.save_stream(file_obj, filename)['path']
     except Exception as e:
         st.error(f"Error uploading to local storage: {str(e)}")
         return None
 
 def save_uploaded_file(uploaded_file):
-    """Save uploaded file to local storage"""
+    """Save uploaded file to local storage and return its path and content hash"""
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{uploaded_file.name}"
-        file_path = os.path.join(AUDIO_DIR, filename)
-        
-        with open(file_path, 'wb') as f:
-            f.write(uploaded_file.getvalue())
-        return file_path
+        with metrics.span('file_save'):
+            saved = storage.save_stream(uploaded_file, uploaded_file.name)
+        return saved['path'], saved['sha256']
     except Exception as e:
         st.error(f"Error saving file: {str(e)}")
-        return None
-
-def format_text(text):
-    """Format text with proper capitalization and punctuation"""
-    if not text:
-        return ""
-        
-    # Split into sentences (handling multiple spaces and newlines)
-    sentences = re.split(r'([.!?]+)\s*', text)
-    
-    formatted_sentences = []
-    for i in range(0, len(sentences)-1, 2):
-        # Get sentence and its punctuation
-        sentence = sentences[i].strip()
-        punctuation = sentences[i+1] if i+1 < len(sentences) else "."
-        
-        # Capitalize first letter of sentence
-        if sentence:
-            sentence = sentence[0].upper() + sentence[1:] if len(sentence) > 1 else sentence.upper()
-            formatted_sentences.append(sentence + punctuation)
-    
-    # Join sentences with proper spacing
-    formatted_text = " ".join(formatted_sentences)
-    
-    # Fix common formatting issues
-    formatted_text = re.sub(r'\s+([.,!?])', r'\1', formatted_text)  # Remove spaces before punctuation
-    formatted_text = re.sub(r'\s+', ' ', formatted_text)  # Remove multiple spaces
-    formatted_text = re.sub(r'\s*\n\s*', '\n', formatted_text)  # Clean up newlines
-    
-    return formatted_text
-
-def format_transcript(transcript):
-    """Format transcript with speaker labels and proper formatting"""
-    formatted_parts = []
-    current_speaker = None
-    
-    # Format utterances with speaker labels
-    for utterance in transcript.utterances:
-        if utterance.speaker != current_speaker:
-            formatted_parts.append(f"\nSpeaker {utterance.speaker}:")
-            current_speaker = utterance.speaker
-        
-        # Format the utterance text
-        text = format_text(utterance.text)
-        formatted_parts.append(text)
-    
-    # Add chapters if available
-    if transcript.chapters:
-        formatted_parts.append("\n\nChapter Summary:")
-        for i, chapter in enumerate(transcript.chapters, 1):
-            formatted_parts.append(f"\nChapter {i}: {format_text(chapter.headline)}")
-            formatted_parts.append(format_text(chapter.summary))
-    
-    return "\n".join(formatted_parts)
+        return None, None
 
 def analyze_with_lemur(transcript_text: str, query: str) -> str:
     """Analyze transcript using LeMUR"""
     try:
-        lemur = aai.LeMUR()
-        response = lemur.analyze(
-            transcript_text=transcript_text,
-            prompt=query,
-            format_text=True
-        )
-        return response.response
+        return transcription.analyze_with_lemur(transcript_text, query)
     except Exception as e:
         st.error(f"Error during LeMUR analysis: {str(e)}")
         return None
 
-def get_audio_intelligence(transcript) -> dict:
-    """Extract audio intelligence features"""
-    intelligence = {
-        'sentiment': [],
-        'topics': [],
-        'summary': '',
-        'action_items': []
-    }
-    
-    try:
-        # Get sentiment analysis
-        if transcript.sentiment_analysis:
-            for result in transcript.sentiment_analysis:
-                intelligence['sentiment'].append({
-                    'text': result.text,
-                    'sentiment': result.sentiment,
-                    'confidence': result.confidence
-                })
-        
-        # Get topic detection
-        if transcript.topics:
-            intelligence['topics'] = [
-                {'topic': topic.text, 'confidence': topic.confidence}
-                for topic in transcript.topics
-            ]
-        
-        # Get auto chapters (summary)
-        if transcript.chapters:
-            intelligence['summary'] = "\n".join([
-                f"• {chapter.headline}: {chapter.summary}"
-                for chapter in transcript.chapters
-            ])
-        
-        # Get action items
-        if transcript.text:
-            intelligence['action_items'] = analyze_with_lemur(
-                transcript.text,
-                "Extract action items and tasks mentioned in this transcript."
-            )
-        
-        return intelligence
-    except Exception as e:
-        st.error(f"Error during audio intelligence analysis: {str(e)}")
-        return intelligence
+def load_transcript(job) -> str:
+    """A job's transcript from the local file, or the shared result store if another replica saved it"""
+    if job.get('result_id') and not os.path.exists(storage.resolve_transcript(job['transcript_path'])):
+        text = results.get_transcript(st.session_state.user['email'], job['result_id'])
+        if text is not None:
+            return text
+    return storage.read_transcript(job['transcript_path'])
 
-def start_realtime_transcription():
-    """Initialize real-time transcription"""
-    transcriber = aai.RealtimeTranscriber(
-        sample_rate=16000,
-        word_boost=["SpeechScribe", "transcript"],
-        language_code="en"
-    )
-    
-    return transcriber
+def render_transcript_page(job, page):
+    """Render a page of a job's transcript, from the shared result store if another replica saved the file"""
+    if os.path.exists(storage.resolve_transcript(job['transcript_path'])):
+        return rendering.render_transcript_page(job['transcript_path'], page)
+    return rendering.render_text_page(job.get('result_id') or job['id'], lambda: load_transcript(job), page)
 
-def handle_realtime_transcript(transcript):
-    """Handle real-time transcript updates"""
-    if transcript.text:
-        st.session_state.realtime_text = transcript.text
-        
-def transcribe_audio(audio_path, original_filename):
-    try:
-        # Create a transcriber with formatting options
-        transcriber = aai.Transcriber()
-        
-        # Configure transcription options
-        config = aai.TranscriptionConfig(
-            punctuate=True,
-            format_text=True,
-            speaker_labels=True,
-            auto_chapters=True,
-            sentiment_analysis=True,
-            topics=True
-        )
-        
-        # Start the transcription
-        transcript = transcriber.transcribe(
-            audio_path,
-            config=config
-        )
-        
-        # Format the transcript with speaker labels and chapters
-        formatted_text = format_transcript(transcript)
-        
-        # Save transcript to local storage
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        transcript_filename = f"{timestamp}_{os.path.splitext(original_filename)[0]}.txt"
-        transcript_path = os.path.join(TRANSCRIPT_DIR, transcript_filename)
-        
-        with open(transcript_path, 'w', encoding='utf-8') as f:
-            f.write(formatted_text)
-        
-        # Store transcript and intelligence for analysis tab
-        st.session_state.last_transcript = formatted_text
-        st.session_state.last_intelligence = get_audio_intelligence(transcript)
-            
-        return {
-            'text': formatted_text,
-            'transcript_path': transcript_path,
-            'chapters': transcript.chapters
-        }
-        
-    except Exception as e:
-        st.error(f"Error during transcription: {str(e)}")
+def start_realtime_transcription(source):
+    """Start streaming a capture source to real-time transcription"""
+    pipeline = realtime.RealtimePipeline(source)
+    pipeline.start()
+    return pipeline
+
+def stop_realtime_transcription():
+    """Stop the running real-time pipeline and keep its final transcript"""
+    pipeline = st.session_state.pop('realtime_pipeline', None)
+    if pipeline:
+        pipeline.stop()
+        st.session_state.realtime_text = pipeline.text
+
+def show_job(job_id):
+    """Show progress for a transcription job and its results once done"""
+    job = jobs.get_job(job_id)
+    if not job:
+        st.warning("This transcription job has expired.")
         return None
+    
+    if job['status'] in ('queued', 'running'):
+        # The page reruns itself until the worker finishes (see main_app)
+        st.progress(job['progress'])
+        st.info(f"{job['filename']}: {job['stage']}...")
+        return job
+    
+    if job['status'] == 'failed':
+        st.error(f"Error during transcription: {job.get('error')}")
+        return None
+    
+    # Display success message
+    st.success("Transcription completed!")
+    if job['cached']:
+        st.info("Identical audio was transcribed before; served from cache.")
+    duplicate_of = dedup.canonical_paths([job['transcript_path']]).get(job['transcript_path'])
+    # Only name the earlier transcript to the user it belongs to
+    if duplicate_of and search.is_owner(duplicate_of, st.session_state.user['email']):
+        st.info(f"This recording looks like one you transcribed before: {storage.display_name(duplicate_of)}")
+    elif duplicate_of:
+        st.info("This recording looks like one transcribed before.")
+    
+    # Display the results in a scrollable box, one page at a time
+    st.subheader("Transcription Results")
+    page = st.session_state.get(f"transcript_page_{job['id']}", 1)
+    transcript_html, page, pages = render_transcript_page(job, page)
+    st.markdown('<div class="transcript-box">' + transcript_html + '</div>', 
+              unsafe_allow_html=True)
+    if pages > 1:
+        st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=page,
+                        key=f"transcript_page_{job['id']}")
+    st.success(f"Transcript saved locally")
+    
+    # The page reruns every second or two while work is pending, so the full
+    # transcript is only read once asked for, and kept for this job alone
+    download = st.session_state.get('download')
+    if download and download[0] == job['id']:
+        st.download_button(
+            label="💾 Download Full Transcription",
+            data=download[1],
+            file_name=storage.display_name(job['transcript_path']),
+            mime="text/plain",
+        )
+    elif st.button("💾 Prepare Download", key=f"prepare_download_{job['id']}"):
+        st.session_state.download = (job['id'], load_transcript(job).encode('utf-8'))
+        st.experimental_rerun()
+    return job
 
 def login_page():
     st.markdown("""
@@ -282,9 +177,16 @@ def login_page():
 def admin_page():
     st.title("Admin Dashboard")
     
-    pending_users = list_pending_users()
+    # Pending users are listed one page at a time from the status index
+    page_size = 50
+    pending_count = count_users('pending')
+    page = 1
+    if pending_count > page_size:
+        page = st.number_input("Page", min_value=1, max_value=(pending_count - 1) // page_size + 1, value=1)
+    
+    pending_users = list_pending_users(offset=(page - 1) * page_size, limit=page_size)
     if pending_users:
-        st.subheader("Pending Approvals")
+        st.subheader(f"Pending Approvals ({pending_count})")
         for user in pending_users:
             col1, col2 = st.columns([3, 1])
             with col1:
@@ -297,8 +199,63 @@ def admin_page():
                         st.experimental_rerun()
     else:
         st.info("No pending approvals")
+    
+    cache_stats = transcript_cache.get_stats()
+    st.caption(
+        f"Transcript cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['evictions']} evictions"
+    )
+    mail_stats = mailer.get_stats()
+    st.caption(
+        f"Mail outbox: {mail_stats['queued']} queued, {mail_stats['retrying']} awaiting retry, "
+        f"{mail_stats['dead']} failed, {mail_stats['sent']} sent"
+    )
+    lemur_stats = lemur_cache.get_stats()
+    st.caption(
+        f"LeMUR cache: {lemur_stats['entries']} answers, {lemur_stats['hits']} hits, "
+        f"{lemur_stats['coalesced']} coalesced, {lemur_stats['misses']} misses "
+        f"({lemur_stats['hit_rate']:.0%} hit rate)"
+    )
+    storage_stats = storage.get_storage_stats()
+    st.caption(
+        f"Storage: audio {storage_stats['audio']['bytes'] / 1024 ** 2:,.1f} MB "
+        f"({storage_stats['audio']['files']} files), archive {storage_stats['archive']['bytes'] / 1024 ** 2:,.1f} MB, "
+        f"transcripts {storage_stats['transcripts']['bytes'] / 1024 ** 2:,.1f} MB; "
+        f"{storage_stats['compression']['files']} compressed at {storage_stats['compression']['ratio']:.1f}x"
+    )
+    if st.button("Link near-duplicate transcripts"):
+        with st.spinner("Comparing saved transcripts..."):
+            result = dedup.dedupe()
+        st.success(
+            f"{result['duplicates']} of {result['transcripts']} transcripts are near-duplicates, "
+            f"in {result['groups']} groups ({result['duplicate_bytes'] / 1024 ** 2:,.1f} MB)"
+        )
+
+    # Stage latencies recorded by this process since it started
+    stage_metrics = metrics.get_metrics()
+    if stage_metrics:
+        st.subheader("Stage Latency")
+        st.table([
+            {
+                'Stage': stage,
+                'Count': values['count'],
+                'Errors': values['errors'],
+                'p50 (ms)': round(values['p50'] * 1000, 1),
+                'p95 (ms)': round(values['p95'] * 1000, 1),
+                'p99 (ms)': round(values['p99'] * 1000, 1),
+                'Max (ms)': round(values['max'] * 1000, 1)
+            }
+            for stage, values in stage_metrics.items()
+        ])
+        st.download_button("Download metrics (Prometheus)", metrics.export_prometheus(), file_name="metrics.txt")
 
 def main_app():
+    # Pick up queued jobs and due email retries even if nobody has submitted
+    # one in this process yet
+    jobs.start_workers()
+    mailer.start_worker()
+    metrics.start_server()
+    
     # Initialize session state for real-time transcription
     if 'realtime_text' not in st.session_state:
         st.session_state.realtime_text = ""
@@ -390,86 +347,104 @@ def main_app():
     st.markdown("---")
 
     # Add tabs for different features
-    tabs = st.tabs(["File Upload", "Real-time Recording", "Analysis"])
+    tabs = st.tabs(["File Upload", "Real-time Recording", "Analysis", "Search"])
     
     with tabs[0]:
         # Existing file upload code
         st.subheader("Upload Your Audio")
         st.markdown("Supported formats: MP3, WAV, M4A, and more.")
 
-        uploaded_file = st.file_uploader("Choose an audio file", type=["mp3", "wav", "m4a", "ogg", "wma", "aac"])
+        uploaded_file = st.file_uploader("Choose an audio file", type=storage.SUPPORTED_FORMATS)
 
         if uploaded_file is not None:
             audio_file = uploaded_file
             
+            # Admins can profile a single transcription to see where its time goes
+            profile = is_admin(st.session_state.user['email']) and st.checkbox("Profile this transcription")
+
             if st.button("Transcribe Audio", type="primary"):
-                temp_audio_path = save_uploaded_file(audio_file)
+                temp_audio_path, audio_hash = save_uploaded_file(audio_file)
                 
                 if temp_audio_path:
-                    try:
-                        # Create a progress placeholder
-                        progress_placeholder = st.empty()
-                        status_placeholder = st.empty()
-                        progress_bar = progress_placeholder.progress(0)
-                        
-                        # Update status for file processing
-                        status_placeholder.info("Processing audio file...")
-                        progress_bar.progress(25)
-                        
-                        # Get the transcription
-                        status_placeholder.info("Transcribing audio... This may take a few minutes...")
-                        progress_bar.progress(50)
-                        
-                        result = transcribe_audio(temp_audio_path, audio_file.name)
-                        progress_bar.progress(75)
-                        
-                        # Clear progress indicators
-                        progress_placeholder.empty()
-                        status_placeholder.empty()
-                        
-                        # Display success message
-                        st.success("Transcription completed!")
-                        
-                        # Display the results in a scrollable box
-                        st.subheader("Transcription Results")
-                        st.markdown('<div class="transcript-box">' + result['text'].replace('\n', '<br>') + '</div>', 
-                                  unsafe_allow_html=True)
-                        
-                        if result['transcript_path']:
-                            st.success(f"Transcript saved locally")
-                        
-                        # Add a download button for the transcription
-                        st.download_button(
-                            label="💾 Download Full Transcription",
-                            data=result['text'],
-                            file_name=f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.path.splitext(audio_file.name)[0]}.txt",
-                            mime="text/plain",
-                        )
-                        
-                    finally:
-                        # Clean up temporary file
-                        os.unlink(temp_audio_path)
+                    # The worker pool transcribes in the background; we only keep the job id
+                    st.session_state.current_job = jobs.submit_job(
+                        temp_audio_path, audio_file.name, audio_hash, st.session_state.user['email'],
+                        profile=profile
+                    )
         else:
             st.info("👆 Upload an audio file to get started!")
+        
+        current_job = show_job(st.session_state.current_job) if st.session_state.get('current_job') else None
+        
+        # Earlier jobs stay available when users leave and come back
+        recent_jobs = [job for job in jobs.list_jobs(st.session_state.user['email'])
+                       if job['id'] != st.session_state.get('current_job')]
+        if recent_jobs:
+            st.write("#### Recent Transcriptions")
+            for job in recent_jobs:
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.write(f"**{job['filename']}** — {job['status']} ({job['created_at'][:16]})")
+                with col2:
+                    if job['status'] != 'failed' and st.button("Open", key=f"open_{job['id']}"):
+                        st.session_state.current_job = job['id']
+                        st.experimental_rerun()
 
     with tabs[1]:
         st.subheader("Real-time Transcription")
-        st.write("Transcribe audio in real-time using your microphone")
+        st.write("Transcribe audio in real-time from your microphone, or replay a WAV recording")
+        
+        # The microphone is the server's input device, so it is only offered when running locally
+        if realtime.MICROPHONE_ENABLED:
+            source_type = st.radio("Audio source", ["Microphone", "WAV file"], horizontal=True, key="realtime_source")
+        else:
+            source_type = "WAV file"
+            st.caption("Live microphone capture is only available when SpeechScribe runs on your own machine "
+                       "(REALTIME_MICROPHONE=true) or from the command line: python realtime.py")
+        replay_file = None
+        if source_type == "WAV file":
+            replay_file = st.file_uploader("Choose a WAV file to replay", type=['wav'], key="realtime_file")
+        
+        pipeline = st.session_state.get('realtime_pipeline')
+        if pipeline and not pipeline.running:
+            # A replayed file has been sent in full; closing flushes the last final transcript
+            stop_realtime_transcription()
+            pipeline = None
         
         col1, col2 = st.columns(2)
         with col1:
-            if st.button("🎙️ Start Recording", key="start_recording"):
-                transcriber = start_realtime_transcription()
-                transcriber.on_transcript(handle_realtime_transcript)
-                st.session_state.transcriber = transcriber
-                st.success("Recording started! Speak into your microphone.")
+            if st.button("🎙️ Start Recording", key="start_recording", disabled=pipeline is not None):
+                try:
+                    if source_type == "WAV file":
+                        if replay_file is None:
+                            raise ValueError("Choose a WAV file to replay first")
+                        source = realtime.FileSource(storage.save_stream(replay_file, replay_file.name)['path'])
+                    else:
+                        source = realtime.MicrophoneSource()
+                    st.session_state.realtime_pipeline = start_realtime_transcription(source)
+                    st.session_state.realtime_text = ""
+                    st.experimental_rerun()
+                except Exception as e:
+                    st.error(f"Error starting real-time transcription: {str(e)}")
         
         with col2:
-            if st.button("⏹️ Stop Recording", key="stop_recording"):
-                if hasattr(st.session_state, 'transcriber'):
-                    st.session_state.transcriber.close()
-                    del st.session_state.transcriber
+            if st.button("⏹️ Stop Recording", key="stop_recording", disabled=pipeline is None):
+                stop_realtime_transcription()
                 st.info("Recording stopped.")
+                pipeline = None
+        
+        if pipeline:
+            st.session_state.realtime_text = pipeline.text
+            st.success("Recording... speak into your microphone." if source_type == "Microphone" else "Replaying file...")
+            for error in pipeline.errors:
+                st.error(f"Real-time transcription error: {error}")
+            latency = pipeline.latency_stats()
+            if latency:
+                st.caption(
+                    f"Capture-to-text latency: p50 {latency['p50']:.2f}s, p95 {latency['p95']:.2f}s, "
+                    f"max {latency['max']:.2f}s over {latency['count']} updates"
+                    + (f" | {pipeline.overruns / realtime.SAMPLE_RATE:.1f}s of audio dropped" if pipeline.overruns else "")
+                )
         
         # Display real-time transcript
         st.markdown("""
@@ -482,7 +457,10 @@ def main_app():
     with tabs[2]:
         st.subheader("Advanced Analysis")
         
-        if 'last_transcript' in st.session_state:
+        # The session only keeps the job id; the transcript and intelligence are
+        # read from the shared result store, so any replica can show them
+        analysis_job = jobs.get_job(st.session_state.current_job) if st.session_state.get('current_job') else None
+        if analysis_job and analysis_job['status'] == 'completed':
             # LeMUR Analysis
             st.write("### 🤖 LeMUR Analysis")
             query = st.text_input("Ask a question about the transcript:", 
@@ -490,48 +468,79 @@ def main_app():
             
             if query and st.button("Analyze"):
                 with st.spinner("Analyzing with LeMUR..."):
-                    analysis = analyze_with_lemur(st.session_state.last_transcript, query)
+                    analysis = analyze_with_lemur(load_transcript(analysis_job), query)
                     if analysis:
                         st.write(analysis)
             
             # Audio Intelligence
             st.write("### 📊 Audio Intelligence")
             
-            if 'last_intelligence' in st.session_state:
-                intel = st.session_state.last_intelligence
-                
-                # Sentiment Analysis
-                if intel['sentiment']:
-                    st.write("#### Sentiment Analysis")
-                    for sent in intel['sentiment']:
-                        sentiment_color = {
-                            'POSITIVE': '🟢',
-                            'NEGATIVE': '🔴',
-                            'NEUTRAL': '⚪'
-                        }.get(sent['sentiment'], '⚪')
-                        st.write(f"{sentiment_color} {sent['text']}")
-                
-                # Topics
-                if intel['topics']:
-                    st.write("#### Topics Detected")
-                    topics_html = ["<div style='display: inline-block; padding: 5px 10px; margin: 5px; background-color: #e9ecef; border-radius: 15px;'>"]
-                    for topic in intel['topics']:
-                        topics_html.append(f"🏷️ {topic['topic']}")
-                    topics_html.append("</div>")
-                    st.markdown(" ".join(topics_html), unsafe_allow_html=True)
-                
-                # Summary
-                if intel['summary']:
-                    st.write("#### Chapter Summary")
-                    st.write(intel['summary'])
-                
-                # Action Items
-                if intel['action_items']:
-                    st.write("#### Action Items")
-                    st.write(intel['action_items'])
+            intel = analysis_job['intelligence']
+            pending = analysis_job['intelligence_pending']
+            errors = analysis_job['intelligence_errors']
+            
+            # Sections fill in as their extraction finishes
+            for name in pending:
+                st.info(f"⏳ Extracting {name.replace('_', ' ')}...")
+            for name, error in errors.items():
+                st.warning(f"Could not extract {name.replace('_', ' ')}: {error}")
+            
+            # Sentiment Analysis, rendered a page at a time as one block
+            if intel.get('sentiment'):
+                st.write("#### Sentiment Analysis")
+                page_key = f"sentiment_page_{analysis_job['id']}"
+                page = st.session_state.get(page_key, 1)
+                sentiment_html, page, pages = rendering.render_sentiment_page(
+                    analysis_job['id'], intel['sentiment'], page
+                )
+                st.markdown(sentiment_html, unsafe_allow_html=True)
+                if pages > 1:
+                    st.number_input(f"Sentiment page (of {pages})", min_value=1, max_value=pages,
+                                    value=page, key=page_key)
+            
+            # Topics
+            if intel.get('topics'):
+                st.write("#### Topics Detected")
+                topics_html = ["<div style='display: inline-block; padding: 5px 10px; margin: 5px; background-color: #e9ecef; border-radius: 15px;'>"]
+                for topic in intel['topics']:
+                    topics_html.append(f"🏷️ {topic['topic']}")
+                topics_html.append("</div>")
+                st.markdown(" ".join(topics_html), unsafe_allow_html=True)
+            
+            # Summary
+            if intel.get('summary'):
+                st.write("#### Chapter Summary")
+                st.write(intel['summary'])
+            
+            # Action Items
+            if intel.get('action_items'):
+                st.write("#### Action Items")
+                st.write(intel['action_items'])
         else:
             st.info("Upload or record audio to see advanced analysis.")
 
+    with tabs[3]:
+        st.subheader("Search Transcripts")
+        
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            search_query = st.text_input("Search saved transcripts:", 
+                                       placeholder="e.g., pricing decision")
+        with col2:
+            search_speaker = st.text_input("Speaker (optional):", placeholder="e.g., A")
+        
+        if search_query:
+            hits = search.search(search_query, st.session_state.user['email'],
+                                 speaker=search_speaker.strip() or None)
+            if hits:
+                for hit in hits:
+                    speaker_label = f"Speaker {hit['speaker']}" if hit['speaker'] else "Chapter Summary"
+                    duplicates = f" · {hit['duplicates']} near-duplicate(s)" if hit['duplicates'] else ""
+                    st.markdown(f"**{hit['filename']}** · {speaker_label}{duplicates}")
+                    st.markdown(f"> {hit['snippet']}")
+            else:
+                st.info("No transcripts match your search.")
+    
     # Footer
     st.markdown("---")
     st.markdown("""
@@ -540,9 +549,39 @@ def main_app():
             <p style='font-size: 0.8rem;'>Built with Streamlit and ❤️</p>
         </div>
     """, unsafe_allow_html=True)
+    
+    # Keep refreshing while the current transcription is queued or running
+    if current_job and current_job['status'] in ('queued', 'running'):
+        time.sleep(1)
+        st.experimental_rerun()
+    
+    # Keep refreshing while a real-time session is streaming
+    if st.session_state.get('realtime_pipeline'):
+        time.sleep(0.5)
+        st.experimental_rerun()
+    
+    # Keep refreshing while audio intelligence sections are still arriving
+    if analysis_job and analysis_job['intelligence_pending']:
+        time.sleep(2)
+        st.experimental_rerun()
 
 # Main routing
 if st.session_state.user:
+    # The feature modules, and the AssemblyAI SDK, NumPy and Redis behind them,
+    # are only imported once someone is signed in; the login page never needs them
+    import dedup
+    import jobs
+    import lemur_cache
+    import mailer
+    import metrics
+    import realtime
+    import rendering
+    import results
+    import search
+    import storage
+    import transcript_cache
+    import transcription
+
     if is_admin(st.session_state.user['email']):
         tabs = st.tabs(["Transcription", "Admin"])
         with tabs[0]:
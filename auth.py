@@ -1,33 +1,114 @@
-import redis
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
 import secrets
+import sys
+import threading
 from datetime import datetime, timedelta
 import json
 from dotenv import load_dotenv
+import mailer
+import metrics
 
 load_dotenv('.env.local')
 
-# Initialize Redis connection
-redis_client = redis.Redis.from_url(
-    f"redis://{os.getenv('REDIS_URL')}",
-    password=os.getenv('REDIS_PASSWORD'),
-    decode_responses=True
-)
+_redis_client = None
+_redis_lock = threading.Lock()
+_scripts = {}
+
+def _timed_client_class(redis):
+    class TimedPipeline(redis.client.Pipeline):
+        def execute(self, raise_on_error=True):
+            with metrics.span('redis', command='PIPELINE'):
+                return super().execute(raise_on_error)
+
+    class TimedRedis(redis.Redis):
+        """Redis client that records every command's round trip as a 'redis' stage"""
+
+        def execute_command(self, *args, **options):
+            with metrics.span('redis', command=str(args[0]).upper()):
+                return super().execute_command(*args, **options)
+
+        def pipeline(self, transaction=True, shard_hint=None):
+            return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+    return TimedRedis
+
+def get_redis():
+    """The Redis client shared by every module in the process, created on first use.
+
+    redis-py is only imported here, so pages that never touch Redis don't
+    pay for it. The socket timeout must stay above the longest blocking
+    call (BLMOVE in jobs.py).
+    """
+    global _redis_client
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                import redis
+                pool = redis.ConnectionPool.from_url(
+                    f"redis://{os.getenv('REDIS_URL')}",
+                    password=os.getenv('REDIS_PASSWORD'),
+                    decode_responses=True,
+                    max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+                    socket_timeout=float(os.getenv('REDIS_SOCKET_TIMEOUT', 10)),
+                    socket_connect_timeout=float(os.getenv('REDIS_CONNECT_TIMEOUT', 5)),
+                    socket_keepalive=True,
+                    health_check_interval=int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+                    retry_on_timeout=True
+                )
+                client_class = _timed_client_class(redis) if metrics.METRICS_ENABLED else redis.Redis
+                _redis_client = client_class(connection_pool=pool)
+    return _redis_client
+
+def __getattr__(name: str):
+    # redis_client used to be a client created at import; it stays as a lazy
+    # alias for get_redis() so callers outside this repo keep working
+    if name == 'redis_client':
+        return get_redis()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def script(source: str):
+    """A Lua script registered with the shared client the first time it is run"""
+    registered = _scripts.get(source)
+    if registered is None:
+        registered = _scripts.setdefault(source, get_redis().register_script(source))
+    return registered
+
+# Users are also indexed in one sorted set per status, scored by created_at,
+# so listing never has to scan the keyspace
+USER_STATUSES = ('pending', 'approved', 'rejected')
+USER_FIELDS = ('email', 'name', 'status', 'created_at', 'approved_at', 'last_login')
+
+def _status_key(status: str) -> str:
+    return f"users:{status}"
+
+def _created_score(created_at: str) -> float:
+    return datetime.fromisoformat(created_at).timestamp()
+
+# Set fields on a user hash only if the user exists, in one round trip
+HSET_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+# Approve a pending user and move it between status indexes atomically.
+# Returns 0 when the user is missing or no longer pending, so concurrent
+# approvals only succeed once.
+APPROVE_PENDING_USER_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'status') ~= 'pending' then
+    return 0
+end
+local score = redis.call('ZSCORE', KEYS[2], ARGV[1]) or 0
+redis.call('HSET', KEYS[1], 'status', 'approved', 'approved_at', ARGV[2])
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZADD', KEYS[3], score, ARGV[1])
+return 1
+"""
 
 def send_magic_link(email: str, token: str):
-    """Send magic link via email"""
-    sender_email = os.getenv('SMTP_FROM_EMAIL')
-    sender_name = os.getenv('SMTP_FROM_NAME')
-    
-    # Create message
-    msg = MIMEMultipart()
-    msg['From'] = f"{sender_name} <{sender_email}>"
-    msg['To'] = email
-    msg['Subject'] = "Your Magic Link for SpeechScribe"
-    
+    """Queue the magic link email; the mailer worker sends it in the background"""
     # Create the magic link
     magic_link = f"{os.getenv('APP_URL')}/verify?token={token}"
     
@@ -50,13 +131,7 @@ def send_magic_link(email: str, token: str):
     </html>
     """
     
-    msg.attach(MIMEText(html, 'html'))
-    
-    # Send email
-    with smtplib.SMTP(os.getenv('SMTP_SERVER'), int(os.getenv('SMTP_PORT'))) as server:
-        server.starttls()
-        server.login(os.getenv('SMTP_USERNAME'), os.getenv('SMTP_PASSWORD'))
-        server.send_message(msg)
+    mailer.enqueue(email, "Your Magic Link for SpeechScribe", html)
 
 def generate_magic_link(email: str) -> str:
     """Generate a magic link token and store in Redis"""
@@ -64,19 +139,16 @@ def generate_magic_link(email: str) -> str:
     expiry = 1800  # 30 minutes
     
     # Store token in Redis with expiry
-    redis_client.setex(f"magic_link:{token}", expiry, email)
+    get_redis().setex(f"magic_link:{token}", expiry, email)
     
     return token
 
 def verify_magic_link(token: str) -> str:
     """Verify magic link token and return associated email"""
-    key = f"magic_link:{token}"
-    email = redis_client.get(key)
-    
-    if email:
-        redis_client.delete(key)
-        return email
-    return None
+    # GETDEL consumes the token atomically, so a link only works once
+    # even when it is clicked twice at the same time
+    email = get_redis().getdel(f"magic_link:{token}")
+    return email if email else None
 
 def create_user(email: str, name: str) -> dict:
     """Create a new user pending admin approval"""
@@ -85,16 +157,20 @@ def create_user(email: str, name: str) -> dict:
         'name': name,
         'status': 'pending',  # pending, approved, rejected
         'created_at': datetime.now().isoformat(),
-        'approved_at': None,
-        'last_login': None
+        'approved_at': '',  # Redis hashes cannot hold None
+        'last_login': ''
     }
     
-    redis_client.hset(f"user:{email}", mapping=user)
+    # Write the user and its status index entry in one transaction
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.hset(f"user:{email}", mapping=user)
+    pipe.zadd(_status_key('pending'), {email: _created_score(user['created_at'])})
+    pipe.execute()
     return user
 
 def get_user(email: str) -> dict:
     """Get user details from Redis"""
-    user = redis_client.hgetall(f"user:{email}")
+    user = get_redis().hgetall(f"user:{email}")
     return user if user else None
 
 def approve_user(email: str, admin_email: str) -> bool:
@@ -102,12 +178,11 @@ def approve_user(email: str, admin_email: str) -> bool:
     if admin_email != os.getenv('ADMIN_EMAIL'):
         return False
         
-    user = get_user(email)
-    if user and user['status'] == 'pending':
-        user['status'] = 'approved'
-        user['approved_at'] = datetime.now().isoformat()
-        redis_client.hset(f"user:{email}", mapping=user)
-        
+    approved = script(APPROVE_PENDING_USER_SCRIPT)(
+        keys=[f"user:{email}", _status_key('pending'), _status_key('approved')],
+        args=[email, datetime.now().isoformat()]
+    )
+    if approved:
         # Send approval notification
         token = generate_magic_link(email)
         send_magic_link(email, token)
@@ -116,20 +191,72 @@ def approve_user(email: str, admin_email: str) -> bool:
 
 def update_last_login(email: str):
     """Update user's last login timestamp"""
-    user = get_user(email)
-    if user:
-        user['last_login'] = datetime.now().isoformat()
-        redis_client.hset(f"user:{email}", mapping=user)
-
-def list_pending_users() -> list:
-    """List all pending users for admin review"""
-    pending_users = []
-    for key in redis_client.scan_iter("user:*"):
-        user = redis_client.hgetall(key)
-        if user['status'] == 'pending':
-            pending_users.append(user)
-    return pending_users
+    script(HSET_IF_EXISTS_SCRIPT)(keys=[f"user:{email}"], args=['last_login', datetime.now().isoformat()])
+
+def list_users(status: str, offset: int = 0, limit: int = 50) -> list:
+    """List users with a status, oldest first, one page at a time"""
+    emails = get_redis().zrange(_status_key(status), offset, offset + limit - 1)
+    
+    # Fetch every user on the page in a single round trip
+    pipe = get_redis().pipeline(transaction=False)
+    for email in emails:
+        pipe.hmget(f"user:{email}", USER_FIELDS)
+    
+    users = []
+    for values in pipe.execute():
+        if values[0] is not None:
+            users.append(dict(zip(USER_FIELDS, values)))
+    return users
+
+def count_users(status: str) -> int:
+    """Count users with a status"""
+    return get_redis().zcard(_status_key(status))
+
+def list_pending_users(offset: int = 0, limit: int = 50) -> list:
+    """List pending users for admin review"""
+    return list_users('pending', offset, limit)
+
+def backfill_user_indexes(batch_size: int = 1000) -> int:
+    """Index existing user:* hashes by status; safe to run more than once"""
+    indexed = 0
+    batch = []
+    
+    def flush():
+        pipe = get_redis().pipeline(transaction=False)
+        for key in batch:
+            pipe.hmget(key, 'email', 'status', 'created_at')
+        users = pipe.execute()
+        
+        # One ZREM per other status and one ZADD per status for the whole batch
+        by_status = {status: {} for status in USER_STATUSES}
+        for email, status, created_at in users:
+            if email and status in USER_STATUSES:
+                by_status[status][email] = _created_score(created_at) if created_at else 0
+        pipe = get_redis().pipeline(transaction=False)
+        for status, scores in by_status.items():
+            moved = [email for other in USER_STATUSES if other != status for email in by_status[other]]
+            if moved:
+                pipe.zrem(_status_key(status), *moved)
+            if scores:
+                pipe.zadd(_status_key(status), scores)
+        pipe.execute()
+        return len(users)
+    
+    for key in get_redis().scan_iter("user:*", count=batch_size):
+        batch.append(key)
+        if len(batch) >= batch_size:
+            indexed += flush()
+            batch = []
+    if batch:
+        indexed += flush()
+    return indexed
 
 def is_admin(email: str) -> bool:
     """Check if user is admin"""
     return email == os.getenv('ADMIN_EMAIL')
+
+if __name__ == "__main__":
+    # One-time migration for users created before the status indexes:
+    # python auth.py backfill-indexes
+    if sys.argv[1:] == ['backfill-indexes']:
+        print(f"Indexed {backfill_user_indexes()} users")
@@ -0,0 +1,493 @@
+import argparse
+import ast
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+import auth
+import dedup
+import lemur_cache
+import mailer
+import metrics
+import search
+import storage
+import transcript_store
+import transcription
+
+# Offline benchmarks for the transcript, storage and auth code paths.
+# AssemblyAI transcripts are synthetic, LeMUR is stubbed, and Redis is
+# fakeredis (pip install fakeredis), so no service or API key is needed:
+#
+#   python benchmark.py                      run at the medium scale and print the results
+#   python benchmark.py --save               write benchmark_baseline.json
+#   python benchmark.py --compare            compare against benchmark_baseline.json
+#   python benchmark.py --startup-only       only the cold start and rerun import benchmarks
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# medium is about an hour-long meeting and a mid-sized user base
+SCALES = {
+    'small': {'utterances': 200, 'words_per_utterance': 12, 'users': 1000, 'audio_mb': 8, 'documents': 5000},
+    'medium': {'utterances': 2000, 'words_per_utterance': 15, 'users': 10000, 'audio_mb': 64, 'documents': 50000},
+    'large': {'utterances': 10000, 'words_per_utterance': 15, 'users': 100000, 'audio_mb': 256, 'documents': 200000}
+}
+
+# A benchmark regresses when its fastest run is this much slower than the
+# baseline's, and by more than the noise floor in milliseconds
+REGRESSION_THRESHOLD = float(os.getenv('BENCHMARK_REGRESSION_THRESHOLD', 0.25))
+NOISE_FLOOR_MS = float(os.getenv('BENCHMARK_NOISE_FLOOR_MS', 0.5))
+
+# Seconds the stubbed LeMUR takes to answer
+FAKE_LEMUR_LATENCY = float(os.getenv('BENCHMARK_LEMUR_LATENCY', 0))
+
+VOCABULARY = (
+    "we should ship the new release next week after the review i think "
+    "budget timeline customer feedback roadmap so um yeah right okay "
+    "migration dashboard onboarding hiring metrics quarter goals"
+).split()
+
+class FakeLeMUR:
+    """Stands in for the SDK's LeMUR, answering every prompt after FAKE_LEMUR_LATENCY"""
+
+    calls = 0
+
+    def analyze(self, transcript_text, prompt, **params):
+        FakeLeMUR.calls += 1
+        if FAKE_LEMUR_LATENCY:
+            time.sleep(FAKE_LEMUR_LATENCY)
+        return SimpleNamespace(response=f"- Follow up on {prompt[:40].lower()}\n- Share the notes")
+
+def _sentence(rng: random.Random, words: int) -> str:
+    # Lower-case sentences with stray spacing, as format_text sees them
+    text = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+    return text + rng.choice((".", "?", " .", "!"))
+
+def fake_transcript(utterances: int = 2000, words_per_utterance: int = 15, seed: int = 0):
+    """A completed transcript shaped like AssemblyAI's, with every field the app reads"""
+    rng = random.Random(seed)
+    utterance_list = []
+    sentiment = []
+    position = 0
+    speaker = 'A'
+    for _ in range(utterances):
+        # Speakers hold the floor for a few utterances at a time
+        if rng.random() < 0.4:
+            speaker = rng.choice('ABCD')
+        sentences = [_sentence(rng, max(3, words_per_utterance // 2)) for _ in range(2)]
+        text = " ".join(sentences)
+        words = []
+        for word in text.split():
+            words.append(SimpleNamespace(text=word, start=position, end=position + 250,
+                                         confidence=rng.uniform(0.7, 1.0), speaker=speaker))
+            position += 300
+        utterance = SimpleNamespace(speaker=speaker, text=text, start=words[0].start, end=words[-1].end,
+                                    confidence=rng.uniform(0.8, 1.0), words=words)
+        utterance_list.append(utterance)
+        sentiment.append(SimpleNamespace(
+            text=sentences[0], sentiment=rng.choice(('POSITIVE', 'NEUTRAL', 'NEGATIVE')),
+            confidence=rng.uniform(0.5, 1.0), speaker=speaker, start=utterance.start, end=utterance.end
+        ))
+        position += 500
+
+    # One chapter for every 50 utterances
+    chapters = [
+        SimpleNamespace(headline=_sentence(rng, 6), summary=" ".join(_sentence(rng, 12) for _ in range(3)),
+                        gist=_sentence(rng, 3), start=utterance_list[i].start,
+                        end=utterance_list[min(i + 49, len(utterance_list) - 1)].end)
+        for i in range(0, len(utterance_list), 50)
+    ]
+    topics = [SimpleNamespace(text=f"Business>{word.title()}", confidence=rng.random()) for word in VOCABULARY[:20]]
+
+    return SimpleNamespace(
+        id=f"fake-{seed}",
+        status=transcription.assemblyai().TranscriptStatus.completed,
+        error=None,
+        text=" ".join(u.text for u in utterance_list),
+        utterances=utterance_list,
+        chapters=chapters,
+        sentiment_analysis=sentiment,
+        topics=topics,
+        audio_duration=position // 1000
+    )
+
+def install_fakes():
+    """Point the shared Redis pool at fakeredis and stub LeMUR and the mail worker"""
+    import fakeredis
+
+    pool = auth.get_redis().connection_pool
+    pool.disconnect()
+    # Drop idle connections too, which may still point at an earlier fake server
+    pool.reset()
+    pool.connection_class = fakeredis.FakeConnection
+    pool.connection_kwargs['server'] = fakeredis.FakeServer()
+    transcription.assemblyai().LeMUR = FakeLeMUR
+    # Magic link emails stay queued in the fake outbox instead of reaching SMTP
+    mailer.start_worker = lambda: None
+
+def _summary(times: list) -> dict:
+    return {
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'mean_ms': round(statistics.fmean(times), 3),
+        'repeat': len(times)
+    }
+
+def measure(work, repeat: int, setup=None) -> dict:
+    """Run work repeat times after one warm-up run; setup runs untimed before each"""
+    times = []
+    for _ in range(repeat + 1):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        work()
+        times.append((time.perf_counter() - started) * 1000)
+    return _summary(times[1:])
+
+def app_imports(app_dir: str) -> tuple:
+    """Modules app.py imports on every run, and those it adds for signed-in users.
+
+    Streamlit is left out when it is not installed.
+    """
+    with open(os.path.join(app_dir, 'app.py'), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+
+    def modules(nodes):
+        names = []
+        for node in nodes:
+            if isinstance(node, ast.Import):
+                names.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                names.append(node.module)
+        return [name for name in names if importlib.util.find_spec(name.split('.')[0]) is not None
+                or os.path.exists(os.path.join(app_dir, name + '.py'))]
+
+    always = modules(tree.body)
+    signed_in = modules(node for branch in tree.body if isinstance(branch, ast.If) for node in branch.body)
+    return always, signed_in
+
+def import_time_ms(code: str, app_dir: str) -> float:
+    """Milliseconds code spends importing in a fresh interpreter, from python -X importtime"""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {app_dir!r}); {code}"],
+        cwd=app_dir, capture_output=True, text=True, check=True
+    )
+    total = 0
+    after_startup = False
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Interpreter startup ends with site; count only top-level imports after it
+        if name.strip() == 'site' and not name.startswith('  '):
+            after_startup = True
+        elif after_startup and not name.startswith('  '):
+            total += int(cumulative)
+    return total / 1000
+
+def _startup_benchmarks(repeat: int, app_dir: str) -> dict:
+    always, signed_in = app_imports(app_dir)
+    login = "; ".join(f"import {name}" for name in always)
+    app = "; ".join(f"import {name}" for name in always + signed_in)
+    redis = f"{login}; import auth; getattr(auth, 'get_redis', lambda: auth.redis_client)()"
+
+    results = {
+        'import_login_page': _summary([import_time_ms(login, app_dir) for _ in range(repeat)]),
+        'import_login_page_with_redis': _summary([import_time_ms(redis, app_dir) for _ in range(repeat)]),
+        'import_signed_in_app': _summary([import_time_ms(app, app_dir) for _ in range(repeat)])
+    }
+
+    # Streamlit runs app.py again on every interaction; its imports are then
+    # only sys.modules lookups. Timed in a fresh interpreter, 1000 reruns per sample
+    rerun = (
+        f"import sys, time; sys.path.insert(0, {app_dir!r}); {app}\n"
+        f"code = compile({app!r}, 'app.py', 'exec'); started = time.perf_counter()\n"
+        "for _ in range(1000): exec(code, {})\n"
+        "print((time.perf_counter() - started) * 1000)"
+    )
+    results['rerun_imports_x1000'] = _summary([
+        float(subprocess.run([sys.executable, '-c', rerun], cwd=app_dir, capture_output=True, text=True,
+                             check=True).stdout)
+        for _ in range(repeat)
+    ])
+    return results
+
+def _transcript_benchmarks(sizes: dict, repeat: int) -> dict:
+    transcript = fake_transcript(sizes['utterances'], sizes['words_per_utterance'])
+    texts = [u.text for u in transcript.utterances]
+    flush_lemur = lambda: [auth.get_redis().delete(key) for key in auth.get_redis().scan_iter("lemur:*")]
+
+    return {
+        'format_text': measure(lambda: [transcription.format_text(text) for text in texts], repeat),
+        'format_transcript': measure(lambda: transcription.format_transcript(transcript), repeat),
+        'get_audio_intelligence': measure(lambda: transcription.get_audio_intelligence(transcript), repeat,
+                                          setup=flush_lemur),
+        'get_audio_intelligence_cached': measure(lambda: transcription.get_audio_intelligence(transcript), repeat),
+        'lemur_cache_key': measure(
+            lambda: lemur_cache.cache_key(transcript.text, "Extract action items.", transcription.LEMUR_PARAMS),
+            repeat
+        )
+    }
+
+def _storage_benchmarks(sizes: dict, repeat: int, directory: str) -> dict:
+    transcript = fake_transcript(sizes['utterances'], sizes['words_per_utterance'])
+    audio = os.urandom(1024 * 1024) * sizes['audio_mb']
+    storage.DICTIONARY_DIR = os.path.join(directory, 'dictionaries')
+    os.makedirs(storage.DICTIONARY_DIR, exist_ok=True)
+
+    def clear():
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                os.unlink(path)
+
+    def save_transcript(compressed):
+        storage.TRANSCRIPT_COMPRESSION = compressed
+        storage.save_transcript(os.path.join(directory, 'meeting.txt'), transcription.iter_transcript(transcript))
+
+    compression = storage.TRANSCRIPT_COMPRESSION
+    try:
+        results = {
+            'save_stream': measure(lambda: storage.save_stream(io.BytesIO(audio), 'meeting.wav', directory),
+                                   repeat, setup=clear),
+            'save_transcript': measure(lambda: save_transcript(False), repeat, setup=clear),
+            'transcript_store_write': measure(
+                lambda: transcript_store.write(transcript, os.path.join(directory, 'meeting.sst')), repeat, setup=clear
+            )
+        }
+        if storage.zstandard is not None:
+            results['save_transcript_compressed'] = measure(lambda: save_transcript(True), repeat, setup=clear)
+    finally:
+        storage.TRANSCRIPT_COMPRESSION = compression
+    return results
+
+def _dedup_benchmarks(sizes: dict, repeat: int, directory: str) -> dict:
+    transcript = fake_transcript(sizes['utterances'], sizes['words_per_utterance'])
+    text = transcription.format_transcript(transcript)
+    signature = dedup.text_signature(text)
+    documents = sizes['documents']
+    index_path, local = dedup.INDEX_PATH, dedup._local
+    dedup.INDEX_PATH = os.path.join(directory, 'dedup.db')
+    dedup._local = threading.local()
+
+    # Signatures of unrelated transcripts are effectively random; one in
+    # fifty has a near-duplicate with a tenth of its minimums changed
+    rng = np.random.default_rng(0)
+    signatures = rng.integers(0, dedup.PRIME, (documents, dedup.NUM_PERM), dtype=np.uint64)
+    for i in range(0, documents - 1, 50):
+        signatures[i + 1] = signatures[i]
+        changed = rng.choice(dedup.NUM_PERM, dedup.NUM_PERM // 10, replace=False)
+        signatures[i + 1, changed] = rng.integers(0, dedup.PRIME, len(changed), dtype=np.uint64)
+    conn = dedup._connection()
+    with conn:
+        for i, row in enumerate(signatures):
+            dedup._add(conn, f"synthetic/{i:06d}.txt", i, row)
+        dedup._add(conn, "synthetic/meeting.txt", documents, signature)
+
+    transcript_path = storage.save_transcript(os.path.join(directory, 'meeting.txt'), [text])
+
+    def forget_meeting():
+        row = conn.execute("SELECT id FROM documents WHERE path = ?", (transcript_path,)).fetchone()
+        if row:
+            with conn:
+                dedup._remove(conn, row[0])
+
+    try:
+        return {
+            'signature': measure(lambda: dedup.text_signature(text), repeat),
+            f'find_duplicates_x100_in_{documents}': measure(
+                lambda: [dedup._matches(conn, signatures[i], dedup.DUPLICATE_THRESHOLD) for i in range(0, 5000, 50)],
+                repeat
+            ),
+            f'check_transcript_in_{documents}': measure(
+                lambda: dedup.check_transcript(transcript_path), repeat,
+                setup=forget_meeting
+            ),
+            f'link_duplicates_{documents}': measure(dedup.link_duplicates, repeat)
+        }
+    finally:
+        conn.close()
+        dedup.INDEX_PATH, dedup._local = index_path, local
+
+def _search_benchmarks(sizes: dict, repeat: int, directory: str) -> dict:
+    documents = sizes['documents']
+    owners = [f"user{i}@example.com" for i in range(100)]
+    index_path, local = search.INDEX_PATH, search._local
+    search.INDEX_PATH = os.path.join(directory, 'search.db')
+    search._local = threading.local()
+
+    # Short synthetic transcripts of four speaker blocks each, spread over
+    # a hundred users, loaded straight into the index
+    rng = random.Random(0)
+    conn = search._connection()
+    with conn:
+        for doc_id in range(1, documents + 1):
+            path = os.path.join(directory, f"synthetic_{doc_id:06d}.txt")
+            conn.execute("INSERT INTO documents (id, path, mtime) VALUES (?, ?, ?)", (doc_id, path, doc_id))
+            conn.executemany(
+                "INSERT INTO blocks (rowid, text, speaker) VALUES (?, ?, ?)",
+                [((doc_id << search.BLOCK_BITS) + number, " ".join(_sentence(rng, 12) for _ in range(3)),
+                  "AB"[number % 2]) for number in range(4)]
+            )
+            conn.execute("INSERT INTO owners (owner, path) VALUES (?, ?)", (owners[doc_id % len(owners)], path))
+
+    transcript = fake_transcript(sizes['utterances'], sizes['words_per_utterance'])
+    transcript_path = storage.save_transcript(os.path.join(directory, 'meeting.txt'),
+                                              transcription.iter_transcript(transcript))
+    search.add_owner(transcript_path, owners[0])
+
+    try:
+        return {
+            'index_transcript': measure(lambda: search.index_transcript(transcript_path), repeat),
+            f'search_common_in_{documents}': measure(lambda: search.search("customer feedback", owners[1]), repeat),
+            f'search_rare_in_{documents}': measure(lambda: search.search("onboarding dashboard migration", owners[1]),
+                                                   repeat),
+            f'search_speaker_in_{documents}': measure(lambda: search.search("roadmap", owners[1], speaker='B'), repeat)
+        }
+    finally:
+        conn.close()
+        search.INDEX_PATH, search._local = index_path, local
+
+def _auth_benchmarks(sizes: dict, repeat: int) -> dict:
+    users = sizes['users']
+    emails = [f"user{i}@example.com" for i in range(users)]
+    admin = 'admin@example.com'
+    os.environ['ADMIN_EMAIL'] = admin
+    created = datetime(2024, 1, 1)
+
+    def reset_users():
+        auth.get_redis().flushall()
+
+    def create_users():
+        for email in emails:
+            auth.create_user(email, email.split('@')[0])
+
+    def seed_users():
+        # Bulk-load the users directly so every auth benchmark starts from the same state
+        reset_users()
+        pipe = auth.get_redis().pipeline(transaction=False)
+        for i, email in enumerate(emails):
+            created_at = (created + timedelta(seconds=i)).isoformat()
+            pipe.hset(f"user:{email}", mapping={
+                'email': email, 'name': email.split('@')[0], 'status': 'pending',
+                'created_at': created_at, 'approved_at': '', 'last_login': ''
+            })
+            pipe.zadd(auth._status_key('pending'), {email: auth._created_score(created_at)})
+        pipe.execute()
+
+    def magic_links():
+        for email in emails[:1000]:
+            assert auth.verify_magic_link(auth.generate_magic_link(email)) == email
+
+    def approve_page():
+        for user in auth.list_pending_users(limit=50):
+            auth.approve_user(user['email'], admin)
+
+    seed_users()
+    results = {
+        'create_user': measure(create_users, repeat, setup=reset_users),
+        'get_user': measure(lambda: [auth.get_user(email) for email in emails[:1000]], repeat),
+        'update_last_login': measure(lambda: [auth.update_last_login(email) for email in emails[:1000]], repeat),
+        'magic_link_round_trip': measure(magic_links, repeat),
+        'list_pending_users_page': measure(lambda: auth.list_pending_users(offset=users // 2, limit=50), repeat),
+        'count_users': measure(lambda: auth.count_users('pending'), repeat),
+        'approve_user_page': measure(approve_page, repeat, setup=seed_users),
+        'backfill_user_indexes': measure(auth.backfill_user_indexes, repeat, setup=seed_users)
+    }
+    reset_users()
+    return results
+
+def run(scale: str = 'medium', repeat: int = 5, startup_only: bool = False, app_dir: str = None) -> dict:
+    """Run every benchmark at a scale and return the results with their context"""
+    app_dir = os.path.abspath(app_dir or os.path.dirname(os.path.abspath(__file__)))
+    sizes = SCALES[scale]
+    results = {}
+    groups = [('startup', lambda: _startup_benchmarks(repeat, app_dir))]
+    if not startup_only:
+        install_fakes()
+        groups += [
+            ('transcript', lambda: _transcript_benchmarks(sizes, repeat)),
+            ('storage', lambda: _storage_benchmarks(sizes, repeat, directory)),
+            ('dedup', lambda: _dedup_benchmarks(sizes, repeat, directory)),
+            ('search', lambda: _search_benchmarks(sizes, repeat, directory)),
+            ('auth', lambda: _auth_benchmarks(sizes, repeat))
+        ]
+    with tempfile.TemporaryDirectory() as directory:
+        for group, benchmarks in groups:
+            for name, result in benchmarks().items():
+                results[f"{group}.{name}"] = result
+                print(f"{group + '.' + name:<42} {result['min_ms']:10.2f} ms min {result['median_ms']:10.2f} ms median",
+                      file=sys.stderr)
+
+    return {
+        'meta': {
+            'scale': scale,
+            'sizes': sizes,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'metrics_enabled': metrics.METRICS_ENABLED,
+            'created_at': datetime.now().isoformat(timespec='seconds')
+        },
+        'results': results
+    }
+
+def compare(current: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """Print each benchmark against the baseline; returns the names that regressed"""
+    if current['meta']['scale'] != baseline['meta']['scale']:
+        print(f"Warning: baseline was run at the {baseline['meta']['scale']} scale, "
+              f"this run at {current['meta']['scale']}")
+
+    regressions = []
+    print(f"{'benchmark':<42} {'baseline':>11} {'current':>11} {'change':>8}")
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<42} {'-':>11} {result['min_ms']:9.2f}ms {'new':>8}")
+            continue
+        change = result['min_ms'] / before['min_ms'] - 1 if before['min_ms'] else 0.0
+        regressed = change > threshold and result['min_ms'] - before['min_ms'] > NOISE_FLOOR_MS
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<42} {before['min_ms']:9.2f}ms {result['min_ms']:9.2f}ms {change:+7.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks against fake services")
+    parser.add_argument('--scale', choices=SCALES, default='medium')
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument('--save', nargs='?', const=BASELINE_PATH, help="write the results as a JSON baseline")
+    parser.add_argument('--compare', nargs='?', const=BASELINE_PATH, help="compare against a JSON baseline")
+    parser.add_argument('--startup-only', action='store_true', help="only time imports on cold start and rerun")
+    parser.add_argument('--app-dir', help="time the imports of another checkout of the app")
+    args = parser.parse_args(argv)
+
+    current = run(args.scale, args.repeat, args.startup_only, args.app_dir)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {args.save}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed by more than {REGRESSION_THRESHOLD:.0%}")
+            return 1
+    elif not args.save:
+        print(json.dumps(current, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
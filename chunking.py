@@ -0,0 +1,277 @@
+import logging
+import os
+import string
+import tempfile
+import threading
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import metrics
+import preprocessing
+import storage
+import transcription
+
+logger = logging.getLogger(__name__)
+
+# Recordings longer than this many seconds are split and transcribed in parallel
+LONG_AUDIO_THRESHOLD = float(os.getenv('LONG_AUDIO_THRESHOLD', 1800))
+
+# Chunks are cut near every CHUNK_SECONDS at the quietest point within
+# CUT_SEARCH_SECONDS of the target, and overlap their neighbours on each side
+CHUNK_SECONDS = float(os.getenv('LONG_AUDIO_CHUNK_SECONDS', 600))
+CHUNK_OVERLAP_SECONDS = float(os.getenv('LONG_AUDIO_CHUNK_OVERLAP_SECONDS', 10))
+CUT_SEARCH_SECONDS = 30
+
+# A pause is the quietest stretch of this many milliseconds
+PAUSE_MS = 300
+
+CHUNK_WORKERS = int(os.getenv('LONG_AUDIO_WORKERS', 4))
+CHUNK_RETRIES = int(os.getenv('LONG_AUDIO_CHUNK_RETRIES', 2))
+CHUNK_RETRY_DELAY = 5
+
+Chunk = namedtuple('Chunk', 'index start end own_start own_end')
+Word = namedtuple('Word', 'text start end confidence')
+Utterance = namedtuple('Utterance', 'speaker text start end confidence words')
+Chapter = namedtuple('Chapter', 'headline summary gist start end')
+SentimentResult = namedtuple('SentimentResult', 'text sentiment confidence speaker start end')
+Topic = namedtuple('Topic', 'text confidence')
+StitchedTranscript = namedtuple('StitchedTranscript', 'id utterances chapters sentiment_analysis topics text')
+
+def is_long(audio_path: str) -> bool:
+    """Check whether a recording should be transcribed in chunks"""
+    try:
+        return preprocessing.probe_duration(audio_path) > LONG_AUDIO_THRESHOLD
+    except Exception:
+        # Without a known length the file is sent as one job
+        logger.debug("Could not read the length of %s", audio_path, exc_info=True)
+        return False
+
+def find_pause(samples: np.ndarray) -> int:
+    """Return the sample offset in the middle of the quietest PAUSE_MS stretch"""
+    frame = preprocessing.SAMPLE_RATE * preprocessing.VAD_FRAME_MS // 1000
+    energy = preprocessing.frame_energy_db(samples)
+    if not len(energy):
+        return len(samples) // 2
+
+    # Average over a pause-sized window so one quiet frame inside a word does not win
+    window = max(1, min(len(energy), PAUSE_MS // preprocessing.VAD_FRAME_MS))
+    smoothed = np.convolve(energy, np.ones(window) / window, mode='valid')
+    return int((np.argmin(smoothed) + window / 2) * frame)
+
+def plan_cuts(audio_path: str, duration_ms: int) -> list:
+    """Pick cut points in milliseconds, each at a pause near a multiple of CHUNK_SECONDS"""
+    cuts = []
+    target = CHUNK_SECONDS
+    while target * 1000 < duration_ms - CHUNK_SECONDS * 500:
+        # Only the audio around each target is decoded
+        window_start = max(0.0, target - CUT_SEARCH_SECONDS)
+        samples = preprocessing.decode(audio_path, window_start, 2 * CUT_SEARCH_SECONDS)
+        cuts.append(int(window_start * 1000 + find_pause(samples) * 1000 // preprocessing.SAMPLE_RATE))
+        target += CHUNK_SECONDS
+    return cuts
+
+def plan_chunks(cuts: list, duration_ms: int, overlap_ms: int) -> list:
+    """Turn cut points into overlapping chunks.
+
+    Each chunk owns the audio between its two cuts, which is where its
+    utterances are kept when stitching, and extends overlap_ms past each
+    cut so words at the boundary are heard in full.
+    """
+    bounds = [0] + list(cuts) + [duration_ms]
+    return [
+        Chunk(
+            index=i,
+            start=max(0, own_start - overlap_ms),
+            end=min(duration_ms, own_end + overlap_ms),
+            own_start=own_start,
+            own_end=own_end
+        )
+        for i, (own_start, own_end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+def _owns(chunk: Chunk, start: int, end: int) -> bool:
+    middle = (start + end) / 2
+    return chunk.own_start <= middle < chunk.own_end
+
+def _speaker_label(n: int) -> str:
+    return string.ascii_uppercase[n] if n < len(string.ascii_uppercase) else str(n + 1)
+
+def reconcile_speakers(previous: list, current: list, local_labels: set, used_labels: set) -> dict:
+    """Map one chunk's speaker labels onto the labels used so far.
+
+    previous holds the already-labelled utterances of the chunk before, and
+    current this chunk's utterances, both in global time. Speakers are paired
+    by how long their utterances overlap in the audio both chunks heard.
+    A speaker with no overlap keeps their letter if it is still free, since
+    AssemblyAI tends to letter speakers in order of appearance; otherwise
+    they are taken to be an earlier speaker who has not been matched yet,
+    and only get a new label when there is none.
+    """
+    overlap = defaultdict(int)
+    for before in previous:
+        for after in current:
+            shared = min(before.end, after.end) - max(before.start, after.start)
+            if shared > 0:
+                overlap[(before.speaker, after.speaker)] += shared
+
+    mapping = {}
+    taken = set()
+    for (global_label, local_label), _ in sorted(overlap.items(), key=lambda item: -item[1]):
+        if local_label not in mapping and global_label not in taken:
+            mapping[local_label] = global_label
+            taken.add(global_label)
+
+    for local_label in sorted(local_labels - set(mapping)):
+        returning = sorted(used_labels - taken)
+        if local_label not in taken:
+            mapping[local_label] = local_label
+        elif returning:
+            mapping[local_label] = returning[0]
+        else:
+            n = 0
+            while _speaker_label(n) in taken or _speaker_label(n) in used_labels:
+                n += 1
+            mapping[local_label] = _speaker_label(n)
+        taken.add(mapping[local_label])
+    return mapping
+
+def _shift_utterances(transcript, chunk: Chunk) -> list:
+    return [
+        Utterance(u.speaker, u.text, u.start + chunk.start, u.end + chunk.start, u.confidence, [
+            Word(w.text, w.start + chunk.start, w.end + chunk.start, w.confidence)
+            for w in getattr(u, 'words', None) or []
+        ])
+        for u in transcript.utterances or []
+    ]
+
+def _edge_distance(chunk: Chunk, utterance: Utterance) -> int:
+    return min(utterance.start - chunk.start, chunk.end - utterance.end)
+
+def stitch(results: list) -> StitchedTranscript:
+    """Stitch (chunk, transcript) pairs, in chunk order, into one transcript.
+
+    Times are shifted onto the full recording's timeline and speaker labels
+    are reconciled across chunks. Each chunk keeps the utterances centred in
+    the audio it owns; when two chunks still produced the same utterance
+    around a cut, the copy heard further from its chunk's edge wins.
+    """
+    kept = []  # (utterance, edge distance)
+    chapters = []
+    sentiment = []
+    topics = {}
+    used_labels = set()
+    previous_chunk, previous = None, []
+
+    for chunk, transcript in results:
+        utterances = _shift_utterances(transcript, chunk)
+
+        # Only utterances in the audio both chunks heard say who is who
+        overlap_end = previous_chunk.end if previous_chunk else chunk.start
+        mapping = reconcile_speakers(
+            [u for u in previous if u.end > chunk.start],
+            [u for u in utterances if u.start < overlap_end],
+            {u.speaker for u in utterances},
+            used_labels
+        )
+        utterances = [u._replace(speaker=mapping[u.speaker]) for u in utterances]
+        used_labels.update(mapping.values())
+        previous_chunk, previous = chunk, utterances
+
+        for utterance in utterances:
+            if not _owns(chunk, utterance.start, utterance.end):
+                continue
+            distance = _edge_distance(chunk, utterance)
+            last = kept[-1][0] if kept else None
+            if last and min(last.end, utterance.end) - max(last.start, utterance.start) > min(
+                last.end - last.start, utterance.end - utterance.start
+            ) / 2:
+                # Mostly the same stretch of audio as the last kept utterance: a duplicate
+                if distance > kept[-1][1]:
+                    kept[-1] = (utterance, distance)
+                continue
+            kept.append((utterance, distance))
+
+        for chapter in transcript.chapters or []:
+            start, end = chapter.start + chunk.start, chapter.end + chunk.start
+            if _owns(chunk, start, end):
+                chapters.append(Chapter(chapter.headline, chapter.summary, chapter.gist, start, end))
+
+        for result in transcript.sentiment_analysis or []:
+            start, end = result.start + chunk.start, result.end + chunk.start
+            if _owns(chunk, start, end):
+                speaker = getattr(result, 'speaker', None)
+                speaker = mapping.get(speaker, speaker)
+                sentiment.append(SentimentResult(result.text, result.sentiment, result.confidence, speaker, start, end))
+
+        for topic in getattr(transcript, 'topics', None) or []:
+            topics[topic.text] = max(topic.confidence, topics.get(topic.text, 0))
+
+    utterances = [utterance for utterance, _ in kept]
+    return StitchedTranscript(
+        id=",".join(transcript.id for _, transcript in results),
+        utterances=utterances,
+        chapters=chapters,
+        sentiment_analysis=sentiment,
+        topics=[Topic(text, confidence) for text, confidence in topics.items()],
+        text=" ".join(utterance.text for utterance in utterances)
+    )
+
+def transcribe_chunk(audio_path: str, chunk: Chunk, config, cancelled: threading.Event = None):
+    """Transcribe one chunk, retrying it on its own if it fails.
+
+    Setting cancelled stops it before its next attempt.
+    """
+    cancelled = cancelled or threading.Event()
+    for attempt in range(CHUNK_RETRIES + 1):
+        if cancelled.is_set():
+            raise RuntimeError(f"Chunk {chunk.index} cancelled")
+        chunk_path = None
+        try:
+            samples = preprocessing.decode(audio_path, chunk.start / 1000, (chunk.end - chunk.start) / 1000)
+            fd, chunk_base = tempfile.mkstemp(prefix=f"chunk{chunk.index}_", dir=storage.TEMP_DIR)
+            os.close(fd)
+            os.unlink(chunk_base)
+            chunk_path = preprocessing.encode(samples, chunk_base)
+
+            transcript = transcription.get_transcriber().submit(chunk_path, config=config)
+            return transcription.wait_for_transcript(transcript, lambda stage, percent: None)
+        except Exception as e:
+            if attempt == CHUNK_RETRIES or cancelled.is_set():
+                raise
+            logger.warning("Chunk %d of %s failed (%s), retrying", chunk.index, audio_path, e)
+            cancelled.wait(CHUNK_RETRY_DELAY * 2 ** attempt)
+        finally:
+            if chunk_path and os.path.exists(chunk_path):
+                os.unlink(chunk_path)
+
+def transcribe_long_audio(audio_path: str, config, progress=None) -> StitchedTranscript:
+    """Split a long recording at pauses, transcribe the chunks concurrently and stitch them.
+
+    The first chunk to run out of retries fails the whole call at once.
+    """
+    report = progress or (lambda stage, percent: None)
+    duration_ms = int(preprocessing.probe_duration(audio_path) * 1000)
+
+    report('splitting long audio', 10)
+    chunks = plan_chunks(plan_cuts(audio_path, duration_ms), duration_ms, int(CHUNK_OVERLAP_SECONDS * 1000))
+    logger.info("Transcribing %s in %d chunks", audio_path, len(chunks))
+
+    transcripts = {}
+    cancelled = threading.Event()
+    # Not a with block: leaving one waits for the chunks still in flight
+    executor = ThreadPoolExecutor(max_workers=CHUNK_WORKERS, thread_name_prefix='chunk')
+    try:
+        profiled_chunk = metrics.profiled(transcribe_chunk)
+        futures = {executor.submit(profiled_chunk, audio_path, chunk, config, cancelled): chunk for chunk in chunks}
+        for done, future in enumerate(as_completed(futures), 1):
+            transcripts[futures[future].index] = future.result()
+            report(f"transcribed {done} of {len(chunks)} chunks", 20 + 45 * done // len(chunks))
+    except BaseException:
+        # A chunk ran out of retries; the others would be wasted work. Chunks
+        # already submitted finish in the background, but are not retried
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    return stitch([(chunk, transcripts[chunk.index]) for chunk in chunks])
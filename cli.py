@@ -0,0 +1,161 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import storage
+import transcription
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILENAME = '.speechscribe-checkpoint.json'
+
+def find_audio_files(source: str) -> list:
+    """List audio files in a directory, or the paths listed in a manifest file.
+
+    A manifest has one path per line; blank lines and lines starting with #
+    are skipped, and relative paths are resolved against the manifest.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name)
+            for name in os.listdir(source)
+            if os.path.splitext(name)[1].lstrip('.').lower() in storage.SUPPORTED_FORMATS
+        )
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths.append(os.path.join(base_dir, line))
+    return paths
+
+def load_checkpoint(path: str) -> dict:
+    """Load the per-file results of an earlier run"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_checkpoint(path: str, checkpoint: dict):
+    """Write the checkpoint atomically so an interrupted run never corrupts it"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temp_path, path)
+
+def is_done(entry: dict, audio_path: str) -> bool:
+    """Check whether a checkpoint entry covers the file as it is now"""
+    if not entry or entry.get('status') != 'completed':
+        return False
+    stat = os.stat(audio_path)
+    return entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime
+
+def transcribe_file(audio_path: str) -> dict:
+    """Transcribe one file and return its checkpoint entry"""
+    stat = os.stat(audio_path)
+    result = transcription.transcribe_audio(
+        audio_path,
+        os.path.basename(audio_path),
+        storage.hash_file(audio_path)
+    )
+    return {
+        'status': 'completed',
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'transcript_path': result['transcript_path'],
+        'cached': result['cached']
+    }
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+def run_batch(source: str, workers: int = 4, checkpoint_path: str = None, retry_failed: bool = False) -> dict:
+    """Transcribe every file in a directory or manifest with bounded concurrency.
+
+    Progress is checkpointed after each file, so a rerun skips files that are
+    already done. Returns counts of completed, skipped and failed files.
+    """
+    if checkpoint_path is None:
+        base_dir = source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source))
+        checkpoint_path = os.path.join(base_dir, CHECKPOINT_FILENAME)
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    checkpoint_lock = threading.Lock()
+
+    todo = []
+    skipped = 0
+    missing = 0
+    for audio_path in find_audio_files(source):
+        entry = checkpoint.get(audio_path)
+        try:
+            done = is_done(entry, audio_path)
+        except FileNotFoundError:
+            # A manifest can list files that are gone; fail them without stopping the run
+            print(f"{audio_path} FAILED: file not found")
+            checkpoint[audio_path] = {'status': 'failed', 'error': "File not found"}
+            missing += 1
+            continue
+        if done or (entry and entry.get('status') == 'failed' and not retry_failed):
+            skipped += 1
+        else:
+            todo.append(audio_path)
+    if missing:
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    print(f"{len(todo)} files to transcribe, {skipped} skipped, {missing} missing, {workers} workers")
+    counts = {'completed': 0, 'failed': missing, 'skipped': skipped}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(transcribe_file, audio_path): audio_path for audio_path in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            audio_path = futures[future]
+            try:
+                entry = future.result()
+                counts['completed'] += 1
+                outcome = f"-> {storage.display_name(entry['transcript_path'])}" + (" (cached)" if entry['cached'] else "")
+            except Exception as e:
+                logger.debug("Error transcribing %s", audio_path, exc_info=True)
+                entry = {'status': 'failed', 'error': str(e)}
+                counts['failed'] += 1
+                outcome = f"FAILED: {e}"
+
+            with checkpoint_lock:
+                checkpoint[audio_path] = entry
+                save_checkpoint(checkpoint_path, checkpoint)
+
+            elapsed = time.monotonic() - started
+            rate = done / elapsed if elapsed else 0.0
+            eta = (len(todo) - done) / rate if rate else 0.0
+            print(
+                f"[{done}/{len(todo)}] {os.path.basename(audio_path)} {outcome} "
+                f"| {rate * 60:.1f} files/min, ETA {format_duration(eta)}"
+            )
+
+    print(f"Done: {counts['completed']} completed, {counts['failed']} failed, {counts['skipped']} skipped "
+          f"in {format_duration(time.monotonic() - started)}")
+    return counts
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Transcribe a directory or manifest of audio files without the UI")
+    parser.add_argument('source', help="directory of audio files, or a manifest with one path per line")
+    parser.add_argument('-w', '--workers', type=int, default=4, help="files transcribed at the same time (default: 4)")
+    parser.add_argument('--checkpoint', help=f"checkpoint file (default: {CHECKPOINT_FILENAME} next to the source)")
+    parser.add_argument('--retry-failed', action='store_true', help="retry files that failed in an earlier run")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    counts = run_batch(args.source, args.workers, args.checkpoint, args.retry_failed)
+    return 1 if counts['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import zlib
+import numpy as np
+import storage
+from storage import STORAGE_DIR, TRANSCRIPT_DIR
+
+logger = logging.getLogger(__name__)
+
+# Near-duplicate transcripts (the same recording transcribed more than once)
+# are found with MinHash signatures over word shingles. Signatures are split
+# into bands; two transcripts become candidates when any band matches, which
+# is one indexed lookup per band regardless of how many transcripts there are.
+INDEX_DIR = os.path.join(STORAGE_DIR, 'index')
+INDEX_PATH = os.path.join(INDEX_DIR, 'dedup.db')
+
+# Transcripts whose estimated word-shingle Jaccard similarity is at least this are duplicates
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', 0.8))
+
+# 20 bands of 6 rows: pairs at the threshold become candidates 99.8% of the
+# time, pairs at 0.5 similarity 27% of the time and at 0.3 under 2%.
+# Stored signatures depend on these; delete the index after changing them.
+SHINGLE_WORDS = 5
+BANDS = 20
+ROWS = 6
+NUM_PERM = BANDS * ROWS
+
+# Shingle hashes are 32-bit; the permutations are (a * h + b) mod a prime above 2**32
+PRIME = (1 << 32) + 15
+_rng = np.random.default_rng(20241209)
+_A = _rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+HASH_BATCH = 8192
+
+SPEAKER_PATTERN = re.compile(r'^Speaker .+:$', re.M)
+TERM_PATTERN = re.compile(r'\w+')
+
+os.makedirs(INDEX_DIR, exist_ok=True)
+
+_local = threading.local()
+
+def _connection() -> sqlite3.Connection:
+    """Return this thread's connection to the index, creating the schema on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(INDEX_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                mtime REAL NOT NULL,
+                signature BLOB NOT NULL,
+                canonical_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS documents_canonical ON documents (canonical_id);
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL,
+                hash INTEGER NOT NULL,
+                doc_id INTEGER NOT NULL,
+                PRIMARY KEY (band, hash, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS bands_doc ON bands (doc_id);
+        """)
+        _local.conn = conn
+    return conn
+
+def text_signature(text: str):
+    """MinHash signature of a transcript's words, or None if it has none.
+
+    Speaker labels, case and punctuation are ignored; two runs over the same
+    recording often differ in exactly those.
+    """
+    words = TERM_PATTERN.findall(SPEAKER_PATTERN.sub('', text).lower())
+    if not words:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+
+    signature = np.full(NUM_PERM, PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), HASH_BATCH):
+        batch = hashes[start:start + HASH_BATCH, None]
+        np.minimum(signature, ((batch * _A + _B) % PRIME).min(axis=0), out=signature)
+    return signature
+
+def transcript_signature(path: str):
+    return text_signature(storage.read_transcript(path))
+
+def similarity(a, b) -> float:
+    """Estimated Jaccard similarity of the transcripts behind two signatures"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+def _band_keys(signature) -> list:
+    return [
+        (band, int.from_bytes(
+            hashlib.blake2b(signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).digest(),
+            'big', signed=True
+        ))
+        for band in range(BANDS)
+    ]
+
+def _signature(blob: bytes):
+    return np.frombuffer(blob, dtype=np.uint64)
+
+def _add(conn: sqlite3.Connection, path: str, mtime: float, signature) -> int:
+    """Add or refresh one document's signature and bands; returns its id"""
+    row = conn.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+    if row:
+        doc_id = row[0]
+        conn.execute("DELETE FROM bands WHERE doc_id = ?", (doc_id,))
+        conn.execute("UPDATE documents SET mtime = ?, signature = ? WHERE id = ?",
+                     (mtime, signature.tobytes(), doc_id))
+    else:
+        doc_id = conn.execute(
+            "INSERT INTO documents (path, mtime, signature) VALUES (?, ?, ?)",
+            (path, mtime, signature.tobytes())
+        ).lastrowid
+    conn.executemany("INSERT OR IGNORE INTO bands (band, hash, doc_id) VALUES (?, ?, ?)",
+                     [(band, value, doc_id) for band, value in _band_keys(signature)])
+    return doc_id
+
+def _remove(conn: sqlite3.Connection, doc_id: int):
+    conn.execute("DELETE FROM bands WHERE doc_id = ?", (doc_id,))
+    conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+    # Its duplicates stand on their own until the next bulk pass regroups them
+    conn.execute("UPDATE documents SET canonical_id = NULL WHERE canonical_id = ?", (doc_id,))
+
+def _matches(conn: sqlite3.Connection, signature, threshold: float, exclude: int = None) -> list:
+    """(doc id, path, canonical id, similarity) of indexed documents at or above threshold, best first"""
+    keys = _band_keys(signature)
+    rows = conn.execute(
+        "SELECT id, path, canonical_id, signature FROM documents WHERE id IN "
+        "(SELECT doc_id FROM bands WHERE " + " OR ".join(["(band = ? AND hash = ?)"] * len(keys)) + ")",
+        [value for key in keys for value in key]
+    )
+    matches = []
+    for doc_id, path, canonical_id, blob in rows:
+        score = similarity(signature, _signature(blob))
+        if doc_id != exclude and score >= threshold:
+            matches.append((doc_id, path, canonical_id, score))
+    matches.sort(key=lambda match: -match[3])
+    return matches
+
+def find_duplicates(text: str, threshold: float = None) -> list:
+    """Saved transcripts that are near-duplicates of text, most similar first"""
+    signature = text_signature(text)
+    if signature is None:
+        return []
+    return [
+        {'path': path, 'similarity': score}
+        for _, path, _, score in _matches(_connection(), signature, threshold or DUPLICATE_THRESHOLD)
+    ]
+
+def check_transcript(transcript_path: str) -> str:
+    """Index a newly saved transcript and link it to the copy it duplicates.
+
+    Returns the canonical transcript's path, or None if it is not a duplicate.
+    """
+    signature = transcript_signature(transcript_path)
+    if signature is None:
+        return None
+    conn = _connection()
+    with conn:
+        doc_id = _add(conn, transcript_path, os.path.getmtime(transcript_path), signature)
+        matches = _matches(conn, signature, DUPLICATE_THRESHOLD, exclude=doc_id)
+        if not matches:
+            conn.execute("UPDATE documents SET canonical_id = NULL WHERE id = ?", (doc_id,))
+            return None
+
+        # Link to the group of the closest match, whose canonical copy may not be a candidate itself
+        match_id, match_path, canonical_id, _ = matches[0]
+        if canonical_id is None:
+            canonical_id, canonical_path = match_id, match_path
+        else:
+            canonical_path = conn.execute("SELECT path FROM documents WHERE id = ?", (canonical_id,)).fetchone()[0]
+        conn.execute("UPDATE documents SET canonical_id = ? WHERE id = ?", (canonical_id, doc_id))
+    return canonical_path
+
+def canonical_paths(paths: list) -> dict:
+    """Map each of paths that is a known duplicate to its canonical transcript's path"""
+    if not paths:
+        return {}
+    rows = _connection().execute(
+        "SELECT d.path, c.path FROM documents d JOIN documents c ON c.id = d.canonical_id "
+        f"WHERE d.path IN ({', '.join('?' * len(paths))})",
+        list(paths)
+    )
+    return dict(rows)
+
+def duplicates_of(transcript_path: str) -> list:
+    """Paths of the transcripts linked to this canonical transcript"""
+    return [path for path, in _connection().execute(
+        "SELECT d.path FROM documents d JOIN documents c ON c.id = d.canonical_id WHERE c.path = ? ORDER BY d.path",
+        (transcript_path,)
+    )]
+
+def sync_index(directory: str = TRANSCRIPT_DIR) -> int:
+    """Sign new or changed transcript files and forget deleted ones.
+
+    Returns the number of files (re)signed.
+    """
+    conn = _connection()
+    known = {path: (doc_id, mtime) for doc_id, path, mtime in conn.execute("SELECT id, path, mtime FROM documents")}
+    updated = 0
+    seen = set()
+    for entry in os.scandir(directory):
+        if not storage.is_transcript(entry.name) or not entry.is_file():
+            continue
+        seen.add(entry.path)
+        mtime = entry.stat().st_mtime
+        if entry.path in known and known[entry.path][1] == mtime:
+            continue
+        signature = transcript_signature(entry.path)
+        with conn:
+            if signature is not None:
+                _add(conn, entry.path, mtime, signature)
+            elif entry.path in known:
+                _remove(conn, known[entry.path][0])
+        updated += 1
+
+    with conn:
+        for path in known.keys() - seen:
+            if os.path.dirname(path) == directory:
+                _remove(conn, known[path][0])
+    return updated
+
+def link_duplicates(threshold: float = None) -> list:
+    """Group the indexed transcripts with their near-duplicates and link each group to one canonical copy.
+
+    The canonical copy is the oldest transcript in its group. Returns the
+    groups with more than one transcript as lists of paths, canonical first.
+    """
+    threshold = threshold or DUPLICATE_THRESHOLD
+    conn = _connection()
+    documents = {doc_id: (path, mtime) for doc_id, path, mtime in conn.execute(
+        "SELECT id, path, mtime FROM documents"
+    )}
+
+    # Union every candidate pair (a shared band bucket) that is similar enough
+    parent = {doc_id: doc_id for doc_id in documents}
+
+    def find(doc_id):
+        while parent[doc_id] != doc_id:
+            parent[doc_id] = parent[parent[doc_id]]
+            doc_id = parent[doc_id]
+        return doc_id
+
+    signatures = {}
+
+    def signature_of(doc_id):
+        if doc_id not in signatures:
+            blob, = conn.execute("SELECT signature FROM documents WHERE id = ?", (doc_id,)).fetchone()
+            signatures[doc_id] = _signature(blob)
+        return signatures[doc_id]
+
+    # Band buckets holding more than one document, read in primary key order
+    buckets = conn.execute(
+        "SELECT group_concat(doc_id) FROM bands GROUP BY band, hash HAVING COUNT(*) > 1"
+    ).fetchall()
+    for bucket, in buckets:
+        doc_ids = [int(doc_id) for doc_id in bucket.split(',')]
+        for i, a in enumerate(doc_ids):
+            for b in doc_ids[i + 1:]:
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b and similarity(signature_of(a), signature_of(b)) >= threshold:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    members = {}
+    for doc_id in documents:
+        members.setdefault(find(doc_id), []).append(doc_id)
+
+    groups = []
+    links = []
+    for group in members.values():
+        group.sort(key=lambda doc_id: (documents[doc_id][1], documents[doc_id][0]))
+        canonical = group[0]
+        links += [(None if doc_id == canonical else canonical, doc_id) for doc_id in group]
+        if len(group) > 1:
+            groups.append([documents[doc_id][0] for doc_id in group])
+
+    with conn:
+        conn.executemany("UPDATE documents SET canonical_id = ? WHERE id = ?", links)
+    return groups
+
+def dedupe(directory: str = TRANSCRIPT_DIR, threshold: float = None) -> dict:
+    """Bulk pass: bring the index up to date with the directory and link every group of near-duplicates.
+
+    Search shows one hit per group afterwards. Returns the number of
+    transcripts, groups and duplicates, and the bytes the duplicates take up.
+    """
+    sync_index(directory)
+    groups = link_duplicates(threshold)
+    transcripts, = _connection().execute("SELECT COUNT(*) FROM documents").fetchone()
+    return {
+        'transcripts': transcripts,
+        'groups': len(groups),
+        'duplicates': sum(len(group) - 1 for group in groups),
+        'duplicate_bytes': sum(os.path.getsize(path) for group in groups for path in group[1:] if os.path.exists(path))
+    }
+
+if __name__ == "__main__":
+    # Link every saved transcript to its near-duplicates: python dedup.py
+    logging.basicConfig(level=logging.INFO)
+    result = dedupe()
+    print(
+        f"{result['transcripts']} transcripts, {result['duplicates']} duplicates in {result['groups']} groups "
+        f"({result['duplicate_bytes'] / 1024 ** 2:,.1f} MB)"
+    )
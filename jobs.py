@@ -0,0 +1,384 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from auth import get_redis
+import metrics
+import results
+import search
+import storage
+import transcription
+import webhooks
+
+logger = logging.getLogger(__name__)
+
+# Number of transcriptions one process works on at the same time
+JOB_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', 4))
+
+# Finished jobs are kept around so users can come back to their results
+JOB_TTL = int(os.getenv('TRANSCRIPTION_JOB_TTL', 7 * 24 * 3600))
+
+# Intelligence sections not saved this many seconds after the transcript
+# are shown as failed; the worker extracting them has probably stopped
+INTELLIGENCE_DEADLINE = float(os.getenv(
+    'INTELLIGENCE_DEADLINE', max(transcription.INTELLIGENCE_TIMEOUTS.values()) + 60
+))
+
+# Uploaded audio is saved on the disk of the replica that received it, so
+# each job is queued for the host it was uploaded to, in QUEUE_KEY:<host>,
+# and only that host's workers take it. Hosts must keep their name (and
+# disk) across restarts for jobs queued before one to run. Finished
+# transcripts only need Redis and are taken by any host.
+QUEUE_KEY = "jobs:queue"
+WORKER_HOST = os.getenv('TRANSCRIPTION_WORKER_HOST', socket.gethostname())
+
+# Workers move the item they are handling into their process's processing
+# list instead of popping it, and each process refreshes a heartbeat every
+# WORKER_HEARTBEAT seconds. The items of a process not heard from for
+# WORKER_TIMEOUT seconds are reaped by the others: queued jobs and finished
+# transcripts go back on their queue, jobs it was transcribing are failed.
+WORKER_HEARTBEAT = int(os.getenv('TRANSCRIPTION_WORKER_HEARTBEAT', 15))
+WORKER_TIMEOUT = int(os.getenv('TRANSCRIPTION_WORKER_TIMEOUT', 120))
+WORKERS_KEY = "jobs:workers"
+
+# Longest a blocked worker waits on the job queue before checking for
+# finished transcripts again
+QUEUE_POLL_INTERVAL = 1
+
+PROCESS_ID = f"{WORKER_HOST}:{uuid.uuid4().hex[:12]}:{os.getpid()}"
+
+_workers = []
+_workers_lock = threading.Lock()
+_heartbeat = None
+_reaped_at = None
+_reap_lock = threading.Lock()
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+def _queue_key(host: str = WORKER_HOST) -> str:
+    return f"{QUEUE_KEY}:{host}"
+
+def _processing_key(process_id: str = PROCESS_ID) -> str:
+    return f"jobs:processing:{process_id}"
+
+def _update_job(job_id: str, **fields):
+    fields['updated_at'] = datetime.now().isoformat()
+    get_redis().hset(_job_key(job_id), mapping=fields)
+
+def submit_job(audio_path: str, original_filename: str, audio_hash: str, owner: str,
+               profile: bool = False) -> str:
+    """Queue an audio file for transcription and return the job id.
+
+    With profile set, the worker profiles the transcription and saves the
+    report under storage/profiles.
+    """
+    job_id = uuid.uuid4().hex
+    now = datetime.now().isoformat()
+    job = {
+        'id': job_id,
+        'owner': owner,
+        'filename': original_filename,
+        'audio_path': audio_path,
+        'audio_hash': audio_hash or '',
+        'host': WORKER_HOST,
+        'profile': '1' if profile else '0',
+        'status': 'queued',
+        'stage': 'waiting for a worker',
+        'progress': 0,
+        'created_at': now,
+        'updated_at': now
+    }
+
+    pipe = get_redis().pipeline()
+    pipe.hset(_job_key(job_id), mapping=job)
+    pipe.expire(_job_key(job_id), JOB_TTL)
+    pipe.lpush(f"user_jobs:{owner}", job_id)
+    pipe.ltrim(f"user_jobs:{owner}", 0, 49)
+    pipe.expire(f"user_jobs:{owner}", JOB_TTL)
+    pipe.rpush(_queue_key(), job_id)
+    pipe.execute()
+
+    start_workers()
+    return job_id
+
+def _describe_job(job: dict, result: dict) -> dict:
+    """Fill in a job hash with its result's intelligence sections"""
+    job['progress'] = int(job.get('progress', 0))
+    job['cached'] = job.get('cached') == '1'
+
+    # Intelligence sections arrive one by one after the transcript, in the shared result store
+    if result:
+        job['intelligence'] = result['intelligence']
+        job['intelligence_errors'] = result['intelligence_errors']
+    else:
+        # Jobs finished before the result store kept their sections on the job
+        job['intelligence'] = {}
+        job['intelligence_errors'] = {}
+        for name in transcription.INTELLIGENCE_TASKS:
+            if f"intelligence_{name}" in job:
+                job['intelligence'][name] = json.loads(job.pop(f"intelligence_{name}"))
+            if f"intelligence_error_{name}" in job:
+                job['intelligence_errors'][name] = job.pop(f"intelligence_error_{name}")
+    job['intelligence_pending'] = [] if job.get('intelligence_done') == '1' or job['status'] == 'failed' else [
+        name for name in transcription.INTELLIGENCE_TASKS if name not in job['intelligence']
+    ]
+    if job['intelligence_pending'] and job['status'] == 'completed' and \
+            (datetime.now() - datetime.fromisoformat(job['updated_at'])).total_seconds() > INTELLIGENCE_DEADLINE:
+        for name in job['intelligence_pending']:
+            job['intelligence_errors'][name] = "Not extracted in time; the worker may have stopped"
+        job['intelligence_pending'] = []
+    return job
+
+def get_job(job_id: str) -> dict:
+    """Get job state from Redis"""
+    job = get_redis().hgetall(_job_key(job_id))
+    if not job:
+        return None
+    result = results.get_result(job['owner'], job['result_id']) if job.get('result_id') else None
+    return _describe_job(job, result)
+
+def list_jobs(owner: str) -> list:
+    """List a user's most recent jobs, newest first"""
+    # Fetch every job in a single round trip, then all of their results together
+    pipe = get_redis().pipeline(transaction=False)
+    for job_id in get_redis().lrange(f"user_jobs:{owner}", 0, -1):
+        pipe.hgetall(_job_key(job_id))
+    jobs = [job for job in pipe.execute() if job]
+
+    found = iter(results.get_results(owner, [job['result_id'] for job in jobs if job.get('result_id')]))
+    return [_describe_job(job, next(found) if job.get('result_id') else None) for job in jobs]
+
+def _job_callbacks(job_id: str, owner: str) -> dict:
+    """Callbacks that record a transcription's progress on its job and its results in the shared store"""
+    result = {}
+
+    def progress(stage, percent):
+        _update_job(job_id, status='running', stage=stage, progress=percent)
+
+    def transcript_ready(transcript_path, cached):
+        result['id'] = results.save_transcript(owner, transcript_path)
+        try:
+            search.add_owner(transcript_path, owner)
+        except Exception:
+            logger.exception("Error recording %s as a transcript of %s", transcript_path, owner)
+        _update_job(
+            job_id,
+            status='completed',
+            stage='done',
+            progress=100,
+            transcript_path=transcript_path,
+            result_id=result['id'],
+            cached='1' if cached else '0'
+        )
+
+    def intelligence_ready(name, value, error):
+        results.save_intelligence(owner, result['id'], name, value, error)
+
+    return {'progress': progress, 'on_transcript': transcript_ready, 'on_intelligence': intelligence_ready}
+
+def _run(job_id: str, work):
+    """Run work for a job, marking the job done, or failed if it raises"""
+    try:
+        if not work().get('submitted'):
+            _update_job(job_id, intelligence_done='1')
+    except Exception as e:
+        logger.exception("Transcription job %s failed", job_id)
+        if get_redis().hget(_job_key(job_id), 'status') == 'completed':
+            # The transcript is saved; only the follow-up work failed
+            _update_job(job_id, intelligence_done='1')
+        else:
+            _update_job(job_id, status='failed', stage='failed', error=str(e))
+
+def run_job(job_id: str):
+    """Transcribe the audio for one job, recording progress in Redis.
+
+    With webhooks enabled the worker is free again once the file is
+    submitted; finish_job completes the job when AssemblyAI calls back.
+    """
+    job = get_redis().hgetall(_job_key(job_id))
+    if not job:
+        return
+
+    callbacks = _job_callbacks(job_id, job['owner'])
+    use_webhook = webhooks.enabled()
+
+    def transcribe():
+        if use_webhook:
+            webhooks.track(job_id)
+        try:
+            result = transcription.transcribe_audio(
+                job['audio_path'],
+                job['filename'],
+                job.get('audio_hash') or None,
+                profile=job.get('profile') == '1',
+                configure=(lambda config: webhooks.configure(config, job_id)) if use_webhook else None,
+                **callbacks
+            )
+        except BaseException:
+            if use_webhook:
+                webhooks.untrack(job_id)
+            raise
+
+        if result.get('submitted'):
+            webhooks.submitted(job_id, result['transcript_id'])
+            _update_job(job_id, transcript_id=result['transcript_id'], offset_map=json.dumps(result['offset_map']))
+        elif use_webhook:
+            # Served from cache or transcribed in chunks; no callback is coming
+            webhooks.untrack(job_id)
+        return result
+
+    callbacks['progress']('starting', 5)
+    try:
+        _run(job_id, transcribe)
+    finally:
+        # The uploaded audio is only needed until it is submitted
+        if job['audio_path'] and os.path.exists(job['audio_path']):
+            os.unlink(job['audio_path'])
+
+def finish_job(job_id: str, transcript_id: str, status: str):
+    """Save and analyse a job's transcript once AssemblyAI reports it finished"""
+    webhooks.untrack(job_id)
+    job = get_redis().hgetall(_job_key(job_id))
+    if not job or job.get('status') in ('completed', 'failed'):
+        return
+
+    def resume():
+        if not transcript_id:
+            raise RuntimeError("The audio was never submitted to AssemblyAI")
+        return transcription.resume_transcription(
+            transcript_id,
+            job['filename'],
+            job.get('audio_hash') or None,
+            json.loads(job.get('offset_map') or 'null'),
+            profile=job.get('profile') == '1',
+            **_job_callbacks(job_id, job['owner'])
+        )
+
+    _run(job_id, resume)
+
+def _next_item(processing: str, timeout: float):
+    """Move the next finished transcript or, failing that, job queued on this host into processing"""
+    deadline = time.monotonic() + timeout
+    while True:
+        item = get_redis().lmove(webhooks.COMPLETIONS_KEY, processing, 'LEFT', 'RIGHT')
+        if item:
+            return webhooks.COMPLETIONS_KEY, item
+        # A blocking move only watches one list, so wait on the job queue a
+        # little at a time and look for finished transcripts in between
+        remaining = deadline - time.monotonic()
+        item = get_redis().blmove(_queue_key(), processing, max(min(remaining, QUEUE_POLL_INTERVAL), 0.01),
+                                  'LEFT', 'RIGHT')
+        if item:
+            return _queue_key(), item
+        if time.monotonic() >= deadline:
+            return None
+
+def work_once(timeout: float = 5) -> bool:
+    """Handle one finished transcript or, failing that, one job queued on this host.
+
+    Returns False if nothing arrived within the timeout.
+    """
+    processing = _processing_key()
+    item = _next_item(processing, timeout)
+    if not item:
+        return False
+    key, value = item
+    try:
+        if key == webhooks.COMPLETIONS_KEY:
+            finish_job(**json.loads(value))
+        else:
+            run_job(value)
+    finally:
+        get_redis().lrem(processing, 1, value)
+    return True
+
+def reap_workers(now: float = None) -> int:
+    """Recover the items of worker processes that stopped sending heartbeats; returns how many"""
+    now = now or time.time()
+    reaped = 0
+    for process_id in get_redis().zrangebyscore(WORKERS_KEY, '-inf', now - WORKER_TIMEOUT):
+        # Only one live process gets to reap each dead one
+        if process_id == PROCESS_ID or not get_redis().zrem(WORKERS_KEY, process_id):
+            continue
+        processing = _processing_key(process_id)
+        while True:
+            value = get_redis().lindex(processing, 0)
+            if value is None:
+                break
+            if value.startswith('{'):
+                get_redis().lmove(processing, webhooks.COMPLETIONS_KEY, 'LEFT', 'RIGHT')
+            elif get_redis().hget(_job_key(value), 'status') == 'queued':
+                host = get_redis().hget(_job_key(value), 'host') or WORKER_HOST
+                get_redis().lmove(processing, _queue_key(host), 'LEFT', 'RIGHT')
+            else:
+                get_redis().lpop(processing)
+                # The transcription was cut off part way; the audio may already
+                # be gone, so the user has to submit it again
+                if get_redis().hget(_job_key(value), 'status') == 'running':
+                    _update_job(value, status='failed', stage='failed', intelligence_done='1',
+                                error="The transcription worker stopped; please try again")
+            reaped += 1
+        logger.warning("Reaped worker process %s", process_id)
+    return reaped
+
+def maybe_reap_workers():
+    """Run reap_workers if this process has not done so in the last WORKER_HEARTBEAT seconds"""
+    global _reaped_at
+    with _reap_lock:
+        if _reaped_at is not None and time.monotonic() - _reaped_at < WORKER_HEARTBEAT:
+            return
+        _reaped_at = time.monotonic()
+    try:
+        reaped = reap_workers()
+        if reaped:
+            logger.info("Recovered %d jobs from stopped workers", reaped)
+    except Exception:
+        logger.exception("Error reaping stopped workers")
+
+def _heartbeat_loop():
+    while True:
+        try:
+            get_redis().zadd(WORKERS_KEY, {PROCESS_ID: time.time()})
+        except Exception:
+            logger.exception("Worker heartbeat error")
+        time.sleep(WORKER_HEARTBEAT)
+
+def _worker_loop():
+    while True:
+        try:
+            if not work_once():
+                # Idle workers keep the audio directory within its retention limits,
+                # look for transcripts whose webhook never arrived and recover
+                # the work of stopped workers
+                storage.maybe_run_maintenance()
+                webhooks.maybe_poll_missed()
+                maybe_reap_workers()
+        except Exception:
+            logger.exception("Transcription worker error")
+
+def start_workers(count: int = None):
+    """Start the worker pool, and the webhook receiver if enabled, for this process if not running yet"""
+    global _heartbeat
+    webhooks.start_receiver()
+    with _workers_lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_heartbeat_loop, name="transcription-heartbeat", daemon=True)
+            _heartbeat.start()
+        missing = (count or JOB_WORKERS) - len(_workers)
+        for _ in range(missing):
+            worker = threading.Thread(target=_worker_loop, name="transcription-worker", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+if __name__ == "__main__":
+    # Run a dedicated worker process: python jobs.py
+    logging.basicConfig(level=logging.INFO)
+    metrics.start_server()
+    start_workers()
+    for worker in _workers:
+        worker.join()
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from auth import get_redis, script
+
+# Cached answers expire after the TTL; beyond the cap the least recently
+# used answers are dropped
+LEMUR_CACHE_TTL = int(os.getenv('LEMUR_CACHE_TTL', 7 * 24 * 3600))
+LEMUR_CACHE_MAX_ENTRIES = int(os.getenv('LEMUR_CACHE_MAX_ENTRIES', 10000))
+
+# How long another process may hold a query before we stop waiting for it
+LEMUR_LOCK_TIMEOUT = int(os.getenv('LEMUR_LOCK_TIMEOUT', 120))
+
+LRU_KEY = "lemur:lru"
+STATS_KEY = "lemur:stats"
+
+# Release a query lock only if we still hold it; after LEMUR_LOCK_TIMEOUT it
+# may have expired and been taken by another process
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalise a prompt so trivially different spellings share a cache entry"""
+    return re.sub(r'\s+', ' ', prompt).strip().lower()
+
+def cache_key(transcript_text: str, prompt: str, params: dict) -> str:
+    """Build the cache key from the transcript content, prompt and model params"""
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(transcript_text.encode('utf-8')).digest())
+    digest.update(normalize_prompt(prompt).encode('utf-8'))
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return f"lemur:{digest.hexdigest()}"
+
+def _lookup(key: str) -> str:
+    response = get_redis().get(key)
+    if response is not None:
+        # A hit renews the answer's TTL along with its LRU score, so the two
+        # expire together
+        pipe = get_redis().pipeline()
+        pipe.expire(key, LEMUR_CACHE_TTL)
+        pipe.zadd(LRU_KEY, {key: time.time()})
+        pipe.execute()
+    return response
+
+def _store(key: str, response: str):
+    pipe = get_redis().pipeline()
+    pipe.setex(key, LEMUR_CACHE_TTL, response)
+    pipe.zadd(LRU_KEY, {key: time.time()})
+    pipe.zremrangebyscore(LRU_KEY, 0, time.time() - LEMUR_CACHE_TTL)  # already expired
+    pipe.zcard(LRU_KEY)
+    size = pipe.execute()[-1]
+
+    # Trim the least recently used answers over the cap
+    if size > LEMUR_CACHE_MAX_ENTRIES:
+        evicted = get_redis().zpopmin(LRU_KEY, size - LEMUR_CACHE_MAX_ENTRIES)
+        if evicted:
+            get_redis().delete(*[member for member, _ in evicted])
+            get_redis().hincrby(STATS_KEY, 'evictions', len(evicted))
+
+def _compute(key: str, compute) -> str:
+    """Run compute once across processes, or wait for the process already running it.
+
+    Only a call that runs compute counts as a miss; an answer another
+    process wrote in the meantime counts as coalesced.
+    """
+    lock_key = f"{key}:lock"
+    token = uuid.uuid4().hex
+    deadline = time.time() + LEMUR_LOCK_TIMEOUT
+    while not get_redis().set(lock_key, token, nx=True, ex=LEMUR_LOCK_TIMEOUT):
+        time.sleep(0.5)
+        response = get_redis().get(key)
+        if response is not None:
+            get_redis().hincrby(STATS_KEY, 'coalesced', 1)
+            return response
+        if time.time() > deadline:
+            break
+
+    try:
+        # The previous holder may have finished between our lookup and the lock
+        response = get_redis().get(key)
+        if response is not None:
+            get_redis().hincrby(STATS_KEY, 'coalesced', 1)
+            return response
+
+        get_redis().hincrby(STATS_KEY, 'misses', 1)
+        response = compute()
+        if response is not None:
+            _store(key, response)
+        return response
+    finally:
+        script(RELEASE_LOCK_SCRIPT)(keys=[lock_key], args=[token])
+
+def get_or_compute(transcript_text: str, prompt: str, params: dict, compute) -> str:
+    """Return a cached LeMUR response, or call compute() and cache its result.
+
+    Identical queries running at the same time share a single compute() call.
+    """
+    key = cache_key(transcript_text, prompt, params)
+    response = _lookup(key)
+    if response is not None:
+        get_redis().hincrby(STATS_KEY, 'hits', 1)
+        return response
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[key] = future
+
+    if not owner:
+        get_redis().hincrby(STATS_KEY, 'coalesced', 1)
+        return future.result()
+
+    try:
+        response = _compute(key, compute)
+        future.set_result(response)
+        return response
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+
+def get_stats() -> dict:
+    """Return cache counters shared by all processes"""
+    stats = {name: int(value) for name, value in get_redis().hgetall(STATS_KEY).items()}
+    for name in ('hits', 'misses', 'coalesced', 'evictions'):
+        stats.setdefault(name, 0)
+    lookups = stats['hits'] + stats['misses'] + stats['coalesced']
+    stats['hit_rate'] = (stats['hits'] + stats['coalesced']) / lookups if lookups else 0.0
+    stats['entries'] = get_redis().zcard(LRU_KEY)
+    return stats
@@ -0,0 +1,108 @@
+import os
+import re
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+# Transcripts longer than this many characters are too long for one LeMUR
+# request; they are summarised a chunk at a time and the question is then
+# answered from the summaries
+LEMUR_CHUNK_CHARS = int(os.getenv('LEMUR_CHUNK_CHARS', 100000))
+
+# LeMUR requests in flight at once for chunk summaries, across the process
+LEMUR_CONCURRENCY = int(os.getenv('LEMUR_CONCURRENCY', 4))
+
+# Summaries still too long after this many rounds go to the final step as they are
+MAX_SUMMARY_ROUNDS = 3
+
+# The chunk prompt does not mention the question, so every question about a
+# transcript shares the same (cached) chunk summaries
+SUMMARY_PROMPT = (
+    "This is one part of a longer meeting transcript. Write detailed notes on it: "
+    "who said what, decisions, figures, dates, action items with their owners, "
+    "and open questions. Keep the speaker labels."
+)
+ANSWER_PROMPT = (
+    "The transcript has been replaced by notes on each consecutive part of a longer "
+    "meeting, in order. Using these notes, answer: {query}"
+)
+
+SPEAKER_LABEL_PATTERN = re.compile(r'Speaker \S+:')
+
+_executor = ThreadPoolExecutor(max_workers=LEMUR_CONCURRENCY, thread_name_prefix='lemur')
+
+def _blocks(text: str, max_chars: int):
+    """Yield the speaker turns and chapters of a formatted transcript, none longer than max_chars.
+
+    A turn that is too long is split between utterances, repeating its
+    speaker label, and an utterance that is too long on its own between words.
+    """
+    for block in text.split("\n\n"):
+        block = block.strip("\n")
+        if not block:
+            continue
+        if len(block) <= max_chars:
+            yield block
+            continue
+
+        lines = block.split("\n")
+        label = lines.pop(0) if SPEAKER_LABEL_PATTERN.fullmatch(lines[0]) else None
+        prefix = f"{label}\n" if label else ""
+        width = max_chars - len(prefix)
+        part = []
+        size = 0
+        for line in lines:
+            for piece in textwrap.wrap(line, width, break_on_hyphens=False) if len(line) > width else [line]:
+                if part and size + 1 + len(piece) > width:
+                    yield prefix + "\n".join(part)
+                    part = []
+                    size = 0
+                size += len(piece) + (1 if part else 0)
+                part.append(piece)
+        if part:
+            yield prefix + "\n".join(part)
+
+def split_transcript(text: str, max_chars: int = None) -> list:
+    """Split a formatted transcript into chunks of at most max_chars characters.
+
+    Chunks break between speaker turns and chapters, as laid out by
+    format_transcript, and only inside a turn that does not fit in a chunk.
+    """
+    max_chars = max_chars or LEMUR_CHUNK_CHARS
+    chunks = []
+    current = []
+    size = 0
+    for block in _blocks(text, max_chars):
+        if current and size + 2 + len(block) > max_chars:
+            chunks.append("\n\n".join(current))
+            current = []
+            size = 0
+        size += len(block) + (2 if current else 0)
+        current.append(block)
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def summarize_chunks(text: str, ask, max_chars: int = None) -> str:
+    """Summarise each chunk of a transcript concurrently and return the summaries in order"""
+    chunks = split_transcript(text, max_chars)
+    with metrics.span('lemur_summaries'):
+        summaries = list(_executor.map(lambda chunk: ask(chunk, SUMMARY_PROMPT), chunks))
+    return "\n\n".join(
+        f"Part {i} of {len(chunks)}:\n{summary}" for i, summary in enumerate(summaries, 1)
+    )
+
+def analyze(transcript_text: str, query: str, ask, max_chars: int = None) -> str:
+    """Answer a question about a transcript too long for a single LeMUR request.
+
+    ask(text, prompt) runs one LeMUR request through the LeMUR cache, so
+    chunk summaries are computed once per transcript; a follow-up question
+    only runs the final request over the summaries.
+    """
+    max_chars = max_chars or LEMUR_CHUNK_CHARS
+    notes = transcript_text
+    for _ in range(MAX_SUMMARY_ROUNDS):
+        if len(notes) <= max_chars:
+            break
+        notes = summarize_chunks(notes, ask, max_chars)
+    return ask(notes, ANSWER_PROMPT.format(query=query))
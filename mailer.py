@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+import auth
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_KEY = "mail:outbox"
+RETRY_KEY = "mail:retry"
+DEAD_KEY = "mail:dead"
+STATS_KEY = "mail:stats"
+
+# Messages sent per wake-up over the same SMTP connection
+MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', 20))
+
+# Failed sends are retried with exponential backoff, then moved to the dead list
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', 5))
+MAIL_RETRY_BASE = float(os.getenv('MAIL_RETRY_BASE', 5))
+
+# An idle connection is closed rather than risk the relay dropping it mid-send
+SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', 60))
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', 30))
+
+# The sender moves the messages it is working on into its process's
+# processing list instead of popping them, and refreshes a heartbeat every
+# MAIL_WORKER_HEARTBEAT seconds. Messages of a sender not heard from for
+# MAIL_WORKER_TIMEOUT seconds go back on the outbox, so a crash mid-batch
+# sends a message twice at worst rather than never.
+MAIL_WORKER_HEARTBEAT = int(os.getenv('MAIL_WORKER_HEARTBEAT', 15))
+MAIL_WORKER_TIMEOUT = int(os.getenv('MAIL_WORKER_TIMEOUT', 120))
+WORKERS_KEY = "mail:workers"
+
+PROCESS_ID = f"{uuid.uuid4().hex[:12]}:{os.getpid()}"
+
+_smtp = None
+_smtp_used_at = 0.0
+_worker = None
+_worker_lock = threading.Lock()
+_heartbeat_at = None
+
+def _processing_key(process_id: str = PROCESS_ID) -> str:
+    return f"mail:processing:{process_id}"
+
+def enqueue(to: str, subject: str, html: str):
+    """Queue an HTML email for the background sender"""
+    message = {
+        'to': to,
+        'subject': subject,
+        'html': html,
+        'attempts': 0,
+        'queued_at': datetime.now().isoformat()
+    }
+    auth.get_redis().rpush(OUTBOX_KEY, json.dumps(message))
+    start_worker()
+
+# smtplib and email.mime are imported where they are used: only the mail
+# worker needs them, not every page that queues a message
+
+def _build_message(message: dict) -> 'MIMEMultipart':
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    sender_email = os.getenv('SMTP_FROM_EMAIL')
+    sender_name = os.getenv('SMTP_FROM_NAME')
+
+    msg = MIMEMultipart()
+    msg['From'] = f"{sender_name} <{sender_email}>"
+    msg['To'] = message['to']
+    msg['Subject'] = message['subject']
+    msg.attach(MIMEText(message['html'], 'html'))
+    return msg
+
+def _close_smtp():
+    import smtplib
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        _smtp = None
+
+def _get_smtp() -> 'smtplib.SMTP':
+    """Return the open SMTP connection, reconnecting if it is stale or unhealthy"""
+    import smtplib
+    global _smtp, _smtp_used_at
+    if _smtp is not None:
+        try:
+            if time.monotonic() - _smtp_used_at > SMTP_IDLE_TIMEOUT or _smtp.noop()[0] != 250:
+                _close_smtp()
+        except (smtplib.SMTPException, OSError):
+            _smtp = None
+
+    if _smtp is None:
+        server = smtplib.SMTP(os.getenv('SMTP_SERVER'), int(os.getenv('SMTP_PORT')), timeout=SMTP_TIMEOUT)
+        if os.getenv('SMTP_STARTTLS', 'true').lower() != 'false':
+            server.starttls()
+        if os.getenv('SMTP_USERNAME'):
+            server.login(os.getenv('SMTP_USERNAME'), os.getenv('SMTP_PASSWORD'))
+        _smtp = server
+
+    _smtp_used_at = time.monotonic()
+    return _smtp
+
+def _schedule_retry(message: dict, error: Exception):
+    message['attempts'] += 1
+    message['last_error'] = str(error)
+    if message['attempts'] >= MAIL_MAX_ATTEMPTS:
+        logger.error("Giving up on email to %s: %s", message['to'], error)
+        auth.get_redis().rpush(DEAD_KEY, json.dumps(message))
+        auth.get_redis().hincrby(STATS_KEY, 'dead', 1)
+        return
+
+    delay = MAIL_RETRY_BASE * 2 ** (message['attempts'] - 1)
+    auth.get_redis().zadd(RETRY_KEY, {json.dumps(message): time.time() + delay})
+    auth.get_redis().hincrby(STATS_KEY, 'retried', 1)
+
+def _promote_due_retries():
+    """Move retries whose backoff has elapsed back onto the outbox"""
+    for raw in auth.get_redis().zrangebyscore(RETRY_KEY, '-inf', time.time(), start=0, num=MAIL_BATCH_SIZE):
+        # Only the worker that removes the entry requeues it
+        if auth.get_redis().zrem(RETRY_KEY, raw):
+            auth.get_redis().rpush(OUTBOX_KEY, raw)
+
+def send_batch(messages: list) -> int:
+    """Send queued messages over one SMTP connection; returns how many were sent.
+
+    A message that fails for any reason, a missing SMTP setting included,
+    is scheduled for a retry without affecting the others.
+    """
+    sent = 0
+    for message in messages:
+        try:
+            _get_smtp().send_message(_build_message(message))
+            sent += 1
+        except Exception as e:
+            logger.warning("Error sending email to %s: %s", message['to'], e)
+            _close_smtp()
+            _schedule_retry(message, e)
+
+    if sent:
+        auth.get_redis().hincrby(STATS_KEY, 'sent', sent)
+    return sent
+
+def reap_workers(now: float = None) -> int:
+    """Put the messages of senders that stopped sending heartbeats back on the outbox; returns how many"""
+    now = now or time.time()
+    reaped = 0
+    for process_id in auth.get_redis().zrangebyscore(WORKERS_KEY, '-inf', now - MAIL_WORKER_TIMEOUT):
+        # Only one live process gets to reap each dead one
+        if process_id == PROCESS_ID or not auth.get_redis().zrem(WORKERS_KEY, process_id):
+            continue
+        while auth.get_redis().lmove(_processing_key(process_id), OUTBOX_KEY, 'LEFT', 'RIGHT'):
+            reaped += 1
+        logger.warning("Reaped mail sender %s", process_id)
+    return reaped
+
+def _maybe_heartbeat():
+    """Refresh this sender's heartbeat and reap stopped ones, at most every MAIL_WORKER_HEARTBEAT seconds"""
+    global _heartbeat_at
+    if _heartbeat_at is not None and time.monotonic() - _heartbeat_at < MAIL_WORKER_HEARTBEAT:
+        return
+    _heartbeat_at = time.monotonic()
+    auth.get_redis().zadd(WORKERS_KEY, {PROCESS_ID: time.time()})
+    reaped = reap_workers()
+    if reaped:
+        logger.info("Requeued %d emails from stopped mail senders", reaped)
+
+def work_once(timeout: float = 1) -> int:
+    """Send the next batch from the outbox; returns how many messages it held.
+
+    Each message is removed from the processing list once it was sent or
+    rescheduled.
+    """
+    processing = _processing_key()
+    first = auth.get_redis().blmove(OUTBOX_KEY, processing, timeout, 'LEFT', 'RIGHT')
+    if first is None:
+        return 0
+    pipe = auth.get_redis().pipeline(transaction=False)
+    for _ in range(MAIL_BATCH_SIZE - 1):
+        pipe.lmove(OUTBOX_KEY, processing, 'LEFT', 'RIGHT')
+    batch = [first] + [raw for raw in pipe.execute() if raw is not None]
+
+    for raw in batch:
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            logger.error("Dropping unreadable email %r", raw[:200])
+        else:
+            send_batch([message])
+        auth.get_redis().lrem(processing, 1, raw)
+    return len(batch)
+
+def _worker_loop():
+    while True:
+        try:
+            # Retries are promoted on every wake-up, whether or not anything new was queued
+            _maybe_heartbeat()
+            _promote_due_retries()
+            if not work_once() and _smtp is not None and time.monotonic() - _smtp_used_at > SMTP_IDLE_TIMEOUT:
+                _close_smtp()
+        except Exception:
+            logger.exception("Mail worker error")
+            time.sleep(1)
+
+def start_worker():
+    """Start this process's mail sender if it is not running yet"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name="mail-worker", daemon=True)
+            _worker.start()
+
+def get_stats() -> dict:
+    """Return outbox depth and delivery counters"""
+    pipe = auth.get_redis().pipeline(transaction=False)
+    pipe.llen(OUTBOX_KEY)
+    pipe.zcard(RETRY_KEY)
+    pipe.llen(DEAD_KEY)
+    pipe.hgetall(STATS_KEY)
+    queued, retrying, dead, counters = pipe.execute()
+    return {
+        'queued': queued,
+        'retrying': retrying,
+        'dead': dead,
+        'sent': int(counters.get('sent', 0)),
+        'retried': int(counters.get('retried', 0))
+    }
+
+if __name__ == "__main__":
+    # Run a dedicated mail sender process: python mailer.py
+    logging.basicConfig(level=logging.INFO)
+    start_worker()
+    _worker.join()
@@ -0,0 +1,339 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Stage timings are recorded unless disabled; when disabled span() hands back
+# a shared no-op context manager, so instrumented code pays one flag check
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+
+# Serve /metrics (Prometheus text) and /metrics.json on this port when set
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# Histogram bucket bounds in seconds, and how many recent samples back the percentiles
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+RESERVOIR_SIZE = 1024
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage', 'profiles')
+
+_NOOP = contextlib.nullcontext()
+
+class Histogram:
+    """Bucketed latency histogram plus a window of recent samples for percentiles"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float, error: bool = False):
+        with self.lock:
+            self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            self.errors += error
+            self.recent.append(seconds)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            recent = sorted(self.recent)
+            snapshot = {'count': self.count, 'sum': self.sum, 'errors': self.errors, 'buckets': list(self.buckets)}
+        for name, quantile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            snapshot[name] = recent[min(len(recent) - 1, int(quantile * len(recent)))] if recent else 0.0
+        snapshot['max'] = recent[-1] if recent else 0.0
+        return snapshot
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+def _histogram(stage: str, labels: dict) -> Histogram:
+    key = (stage, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    return histogram
+
+def observe(stage: str, seconds: float, error: bool = False, **labels):
+    """Record a duration measured elsewhere"""
+    if METRICS_ENABLED:
+        _histogram(stage, labels).observe(seconds, error)
+
+class _Span:
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, exc_type is not None)
+        return False
+
+def span(stage: str, **labels):
+    """Time a block of code as one stage: with metrics.span('upload'): ..."""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Span(_histogram(stage, labels))
+
+class TimedIterator:
+    """Wraps an iterator and adds up the time spent producing its items"""
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+def get_metrics() -> dict:
+    """Every stage's count, total, error count, percentiles and buckets"""
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {
+        stage + ''.join(f",{name}={value}" for name, value in labels): histogram.snapshot()
+        for (stage, labels), histogram in sorted(items)
+    }
+
+def export_json() -> str:
+    return json.dumps(get_metrics(), indent=2)
+
+def _label_text(labels: tuple, **extra) -> str:
+    pairs = list(labels) + list(extra.items())
+    return ','.join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                    for name, value in pairs)
+
+def export_prometheus() -> str:
+    """Stage histograms in the Prometheus text exposition format"""
+    lines = [
+        "# HELP speechscribe_stage_seconds Time spent in each stage of a request",
+        "# TYPE speechscribe_stage_seconds histogram"
+    ]
+    errors = [
+        "# HELP speechscribe_stage_errors_total Stage executions that raised",
+        "# TYPE speechscribe_stage_errors_total counter"
+    ]
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    for (stage, labels), histogram in items:
+        snapshot = histogram.snapshot()
+        labels = (('stage', stage),) + labels
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), snapshot['buckets']):
+            cumulative += count
+            lines.append(f"speechscribe_stage_seconds_bucket{{{_label_text(labels, le=bound)}}} {cumulative}")
+        lines.append(f"speechscribe_stage_seconds_sum{{{_label_text(labels)}}} {snapshot['sum']}")
+        lines.append(f"speechscribe_stage_seconds_count{{{_label_text(labels)}}} {snapshot['count']}")
+        errors.append(f"speechscribe_stage_errors_total{{{_label_text(labels)}}} {snapshot['errors']}")
+    return "\n".join(lines + errors) + "\n"
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
+
+class _ThreadProfiles:
+    """Reports from the executor threads working for one profile() block"""
+
+    def __init__(self, start):
+        self.start = start
+        self.owner = threading.get_ident()
+        self.reports = []
+        self.lock = threading.Lock()
+
+    def add(self, report):
+        with self.lock:
+            self.reports.append(report)
+
+    def collected(self) -> list:
+        with self.lock:
+            return list(self.reports)
+
+_profiles = contextvars.ContextVar('profiles', default=None)
+
+def profiled(fn):
+    """Wrap fn, about to be submitted to an executor, so the profile() block
+    around the submission also profiles it on the worker thread.
+
+    Without a profile() block this returns fn unchanged.
+    """
+    profiles = _profiles.get()
+    if profiles is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if threading.get_ident() == profiles.owner:
+            return fn(*args, **kwargs)
+        stop = profiles.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiles.add(stop())
+    return wrapper
+
+def _start_pyinstrument(pyinstrument):
+    profiler = pyinstrument.Profiler()
+    profiler.start()
+    return lambda: profiler.stop()
+
+def _start_cprofile():
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    def stop():
+        profiler.disable()
+        return profiler
+    return stop
+
+@contextlib.contextmanager
+def profile(name: str, enabled: bool = True):
+    """Profile a block when enabled, writing the report under storage/profiles.
+
+    Uses pyinstrument (an HTML report) when it is installed, otherwise
+    cProfile (a .prof file for pstats or snakeviz). The report covers the
+    calling thread plus work submitted to executors through profiled() that
+    finished before the block did.
+    """
+    if not enabled:
+        yield None
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{name}")
+    try:
+        import pyinstrument
+    except ImportError:
+        pyinstrument = None
+
+    if pyinstrument:
+        profiles = _ThreadProfiles(lambda: _start_pyinstrument(pyinstrument))
+        report = f"{base}.html"
+    else:
+        profiles = _ThreadProfiles(_start_cprofile)
+        report = f"{base}.prof"
+    stop = profiles.start()
+    token = _profiles.set(profiles)
+    try:
+        yield report
+    finally:
+        _profiles.reset(token)
+        main = stop()
+        if pyinstrument:
+            from pyinstrument.renderers import HTMLRenderer
+            from pyinstrument.session import Session
+            session = functools.reduce(Session.combine, profiles.collected(), main)
+            with open(report, 'w', encoding='utf-8') as f:
+                f.write(HTMLRenderer().render(session))
+        else:
+            import pstats
+            stats = pstats.Stats(main)
+            for profiler in profiles.collected():
+                stats.add(profiler)
+            stats.dump_stats(report)
+
+_server = None
+_server_lock = threading.Lock()
+
+def _handler_class():
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = export_prometheus(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = export_json(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug("Metrics request: " + format, *args)
+
+    return MetricsHandler
+
+def start_server(port: int = None):
+    """Serve this process's metrics over HTTP if METRICS_PORT (or port) is set"""
+    global _server
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            from http.server import ThreadingHTTPServer
+            try:
+                _server = ThreadingHTTPServer(('0.0.0.0', port), _handler_class())
+            except OSError as e:
+                # Another process on this host is already serving its metrics there
+                logger.warning("Could not serve metrics on port %d: %s", port, e)
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
+
+def benchmark(iterations: int = 1000000):
+    """Time an empty block bare, inside a disabled span and inside an enabled span"""
+    global METRICS_ENABLED
+    enabled = METRICS_ENABLED
+
+    def bare():
+        for _ in range(iterations):
+            pass
+
+    def spanned():
+        for _ in range(iterations):
+            with span('benchmark'):
+                pass
+
+    def timed(work):
+        started = time.perf_counter()
+        work()
+        return (time.perf_counter() - started) / iterations * 1e9
+
+    try:
+        baseline = timed(bare)
+        METRICS_ENABLED = False
+        disabled = timed(spanned) - baseline
+        METRICS_ENABLED = True
+        enabled_cost = timed(spanned) - baseline
+    finally:
+        METRICS_ENABLED = enabled
+        with _histograms_lock:
+            _histograms.pop(('benchmark', ()), None)
+    print(f"span overhead: {disabled:.0f} ns disabled, {enabled_cost:.0f} ns enabled")
+
+if __name__ == "__main__":
+    # python metrics.py benchmark, or print this process's (empty) metrics for a format check
+    import sys
+    if sys.argv[1:] == ['benchmark']:
+        benchmark()
+    else:
+        print(export_json() if sys.argv[1:] == ['json'] else export_prometheus())
@@ -0,0 +1,210 @@
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import time
+import wave
+from bisect import bisect_right
+import numpy as np
+import realtime
+
+logger = logging.getLogger(__name__)
+
+# Preprocess uploads before they are sent to AssemblyAI (off unless enabled)
+PREPROCESS_AUDIO = os.getenv('PREPROCESS_AUDIO', 'false').lower() == 'true'
+
+# Speech is transcribed from 16 kHz mono, so nothing above that is worth uploading
+SAMPLE_RATE = realtime.SAMPLE_RATE
+
+# Energy VAD: 30 ms frames quieter than the threshold count as silence, and
+# speech keeps some padding so word onsets are not clipped
+VAD_FRAME_MS = 30
+VAD_THRESHOLD_DB = float(os.getenv('PREPROCESS_VAD_THRESHOLD_DB', -45))
+VAD_PADDING_MS = int(os.getenv('PREPROCESS_VAD_PADDING_MS', 300))
+
+# ffmpeg's decoded output is read from its pipe this many bytes at a time
+DECODE_CHUNK_BYTES = 1024 * 1024
+
+# Opus at a voice bitrate when ffmpeg is available, otherwise 16 kHz PCM16 WAV
+OPUS_BITRATE = os.getenv('PREPROCESS_OPUS_BITRATE', '24k')
+
+def has_ffmpeg() -> bool:
+    return shutil.which('ffmpeg') is not None
+
+def probe_duration(path: str) -> float:
+    """Length of an audio file in seconds"""
+    if has_ffmpeg() and shutil.which('ffprobe'):
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+            capture_output=True, check=True, text=True
+        )
+        return float(result.stdout.strip())
+
+    try:
+        with wave.open(path, 'rb') as wav:
+            return wav.getnframes() / wav.getframerate()
+    except (wave.Error, EOFError):
+        raise RuntimeError("Reading the length of non-WAV audio needs ffmpeg")
+
+def read_pcm(stream, expected_samples: int = 0) -> np.ndarray:
+    """Read PCM16 samples from a pipe in chunks straight into one array.
+
+    The array is sized for expected_samples and only grows, by half each
+    time, if the stream turns out longer.
+    """
+    samples = np.empty(max(expected_samples, SAMPLE_RATE), dtype=np.int16)
+    filled = 0
+    while True:
+        if filled == samples.nbytes:
+            samples = np.concatenate([samples, np.empty(len(samples) // 2, dtype=np.int16)])
+        count = stream.readinto(memoryview(samples).cast('B')[filled:filled + DECODE_CHUNK_BYTES])
+        if not count:
+            break
+        filled += count
+    return samples[:filled // 2]
+
+def decode(path: str, start: float = 0.0, duration: float = None) -> np.ndarray:
+    """Decode an audio file, or the window of it from start for duration seconds,
+    to 16 kHz mono PCM16 samples.
+
+    Any format ffmpeg reads is supported when it is installed; without it
+    only WAV files can be decoded.
+    """
+    if has_ffmpeg():
+        window = (['-ss', str(start)] if start else []) + ['-i', path] + (['-t', str(duration)] if duration else [])
+        command = ['ffmpeg', '-nostdin', '-v', 'error', *window,
+                   '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-']
+        if duration is None:
+            try:
+                duration = max(probe_duration(path) - start, 0)
+            except Exception:
+                duration = 0
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+            samples = read_pcm(proc.stdout, int(duration * SAMPLE_RATE))
+            errors = proc.stderr.read()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, command, stderr=errors)
+        return samples
+
+    try:
+        with wave.open(path, 'rb') as wav:
+            sample_rate = wav.getframerate()
+            wav.setpos(min(int(start * sample_rate), wav.getnframes()))
+            count = int(duration * sample_rate) if duration else wav.getnframes()
+            frames = realtime.pcm_to_float(wav.readframes(count), wav.getsampwidth(), wav.getnchannels())
+    except (wave.Error, EOFError):
+        raise RuntimeError("Decoding non-WAV audio needs ffmpeg")
+    samples = realtime.Resampler(sample_rate, SAMPLE_RATE).process(realtime.downmix(frames))
+    return realtime.float_to_int16(samples)
+
+def frame_energy_db(samples: np.ndarray, frame_ms: int = VAD_FRAME_MS) -> np.ndarray:
+    """RMS level of each frame in dBFS"""
+    frame = SAMPLE_RATE * frame_ms // 1000
+    count = len(samples) // frame
+    frames = samples[:count * frame].astype(np.float32).reshape(count, frame) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+def detect_speech(samples: np.ndarray) -> tuple:
+    """Return the (start, end) sample range from the first to the last voiced frame.
+
+    Audio with no frame above the threshold is kept whole rather than
+    trimmed to nothing.
+    """
+    frame = SAMPLE_RATE * VAD_FRAME_MS // 1000
+    voiced = np.flatnonzero(frame_energy_db(samples) > VAD_THRESHOLD_DB)
+    if not len(voiced):
+        return 0, len(samples)
+
+    padding = SAMPLE_RATE * VAD_PADDING_MS // 1000
+    start = max(0, voiced[0] * frame - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame + padding)
+    return int(start), int(end)
+
+def to_original_ms(offset_map: list, ms: int) -> int:
+    """Map a time in the processed audio back to the original file.
+
+    offset_map is a sorted list of [processed_ms, original_ms] pairs, each
+    starting a stretch of audio that was kept unchanged.
+    """
+    if not offset_map:
+        return ms
+    index = max(0, bisect_right(offset_map, [ms, float('inf')]) - 1)
+    processed_start, original_start = offset_map[index]
+    return original_start + ms - processed_start
+
+def encode(samples: np.ndarray, output_base: str) -> str:
+    """Write samples as Opus (with ffmpeg) or 16 kHz WAV; returns the file path"""
+    if has_ffmpeg():
+        output_path = f"{output_base}.ogg"
+        subprocess.run(
+            ['ffmpeg', '-nostdin', '-v', 'error', '-y',
+             '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), '-i', '-',
+             '-c:a', 'libopus', '-b:a', OPUS_BITRATE, '-application', 'voip', output_path],
+            input=samples.tobytes(), capture_output=True, check=True
+        )
+        return output_path
+
+    output_path = f"{output_base}.wav"
+    with wave.open(output_path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples.tobytes())
+    return output_path
+
+def preprocess(audio_path: str) -> dict:
+    """Shrink an audio file for upload: 16 kHz mono, silence trimmed, re-encoded.
+
+    Returns the processed file path, its offset map back to the original
+    timeline, and the sizes before and after.
+    """
+    samples = decode(audio_path)
+    start, end = detect_speech(samples)
+    processed_path = encode(samples[start:end], f"{audio_path}.speech")
+    return {
+        'path': processed_path,
+        'offset_map': [[0, start * 1000 // SAMPLE_RATE]],
+        'duration_ms': len(samples) * 1000 // SAMPLE_RATE,
+        'trimmed_ms': (len(samples) - (end - start)) * 1000 // SAMPLE_RATE,
+        'original_bytes': os.path.getsize(audio_path),
+        'processed_bytes': os.path.getsize(processed_path)
+    }
+
+def benchmark(paths: list, transcribe: bool = False):
+    """Print bytes saved and latency for each file, optionally end to end"""
+    import transcription
+
+    total_original = total_processed = 0
+    for path in paths:
+        started = time.monotonic()
+        result = preprocess(path)
+        elapsed = time.monotonic() - started
+        os.unlink(result['path'])
+        total_original += result['original_bytes']
+        total_processed += result['processed_bytes']
+        print(
+            f"{os.path.basename(path)}: {result['original_bytes']:,} -> {result['processed_bytes']:,} bytes "
+            f"({1 - result['processed_bytes'] / result['original_bytes']:.0%} saved), "
+            f"{result['trimmed_ms'] / 1000:.1f}s of silence trimmed, preprocessing {elapsed:.2f}s"
+        )
+
+        if transcribe:
+            # No audio hash, so neither run is served from the transcript cache
+            for enabled in (False, True):
+                started = time.monotonic()
+                transcription.transcribe_audio(path, os.path.basename(path), preprocess=enabled)
+                print(f"  end to end {'with' if enabled else 'without'} preprocessing: {time.monotonic() - started:.1f}s")
+
+    if total_original:
+        print(f"Total: {total_original:,} -> {total_processed:,} bytes ({1 - total_processed / total_original:.0%} saved)")
+
+if __name__ == "__main__":
+    # Benchmark on sample files: python preprocessing.py sample.wav [--transcribe]
+    parser = argparse.ArgumentParser(description="Report upload savings from audio preprocessing")
+    parser.add_argument('paths', nargs='+', help="audio files to preprocess")
+    parser.add_argument('--transcribe', action='store_true', help="also time full transcriptions with and without it")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    benchmark(args.paths, args.transcribe)
@@ -0,0 +1,375 @@
+import logging
+import os
+import sys
+import threading
+import time
+import wave
+from bisect import bisect_left
+from collections import deque
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# AssemblyAI real-time expects 16 kHz mono PCM16, sent in ~100 ms chunks
+SAMPLE_RATE = 16000
+CHUNK_MS = 100
+CHUNK_SAMPLES = SAMPLE_RATE * CHUNK_MS // 1000
+
+# Audio buffered between capture and the websocket before backpressure kicks in
+RING_SECONDS = 10
+
+# Capture times kept for latency lookups; older audio that never got a
+# transcript is forgotten, as the ring buffer forgets dropped audio
+LATENCY_HISTORY_SECONDS = 60
+
+# Latency statistics cover this many most recent transcripts
+LATENCY_SAMPLES = 1000
+
+# A session the service drops is reopened this many times before the
+# pipeline gives up
+REALTIME_RECONNECTS = int(os.getenv('REALTIME_RECONNECTS', 3))
+
+# MicrophoneSource records the input device of the machine running the app,
+# so the web UI only offers it when the app runs on the user's own machine
+MICROPHONE_ENABLED = os.getenv('REALTIME_MICROPHONE', 'false').lower() == 'true'
+
+WORD_BOOST = ["SpeechScribe", "transcript"]
+
+class RingBuffer:
+    """Single-producer, single-consumer ring buffer of int16 samples.
+
+    The producer only advances the write counter and the consumer only the
+    read counter, so the two threads never need a lock.
+    """
+
+    def __init__(self, capacity: int):
+        self._data = np.zeros(capacity, dtype=np.int16)
+        self._capacity = capacity
+        self._written = 0
+        self._read = 0
+
+    def available(self) -> int:
+        return self._written - self._read
+
+    def free(self) -> int:
+        return self._capacity - self.available()
+
+    def write(self, samples: np.ndarray) -> int:
+        """Copy in as many samples as fit; returns how many were written"""
+        count = min(len(samples), self.free())
+        start = self._written % self._capacity
+        first = min(count, self._capacity - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[:count - first] = samples[first:count]
+        self._written += count
+        return count
+
+    def read(self, count: int) -> np.ndarray:
+        """Copy out up to count samples"""
+        count = min(count, self.available())
+        start = self._read % self._capacity
+        first = min(count, self._capacity - start)
+        samples = np.concatenate((self._data[start:start + first], self._data[:count - first]))
+        self._read += count
+        return samples
+
+class Resampler:
+    """Streaming linear resampler that stays continuous across chunk boundaries"""
+
+    def __init__(self, source_rate: int, target_rate: int = SAMPLE_RATE):
+        self._step = source_rate / target_rate
+        self._position = 0.0
+        self._tail = None
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if self._step == 1.0:
+            return samples
+        if self._tail is not None:
+            samples = np.concatenate(([self._tail], samples))
+        if len(samples) < 2:
+            self._tail = samples[-1] if len(samples) else self._tail
+            return samples[:0]
+
+        positions = np.arange(self._position, len(samples) - 1, self._step)
+        resampled = np.interp(positions, np.arange(len(samples)), samples)
+
+        # Carry the fractional position and last sample into the next chunk,
+        # where the last sample becomes index 0
+        if len(positions):
+            self._position = positions[-1] + self._step - (len(samples) - 1)
+        else:
+            self._position -= len(samples) - 1
+        self._tail = samples[-1]
+        return resampled
+
+def downmix(frames: np.ndarray) -> np.ndarray:
+    """Average float frames of shape (samples, channels) into mono samples"""
+    if frames.ndim == 2:
+        frames = frames.mean(axis=1)
+    return frames
+
+def float_to_int16(samples: np.ndarray) -> np.ndarray:
+    """Convert float samples in [-1, 1] to PCM16"""
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+def pcm_to_float(raw: bytes, width: int, channels: int) -> np.ndarray:
+    """Convert WAV PCM bytes to float32 frames of shape (samples, channels)"""
+    dtypes = {1: np.uint8, 2: np.int16, 4: np.int32}
+    if width not in dtypes:
+        raise ValueError(f"Unsupported WAV sample width: {width * 8} bits")
+    samples = np.frombuffer(raw, dtype=dtypes[width]).astype(np.float32)
+    if width == 1:
+        samples -= 128.0
+    return (samples / float(2 ** (8 * width - 1))).reshape(-1, channels)
+
+class FileSource:
+    """Replays a WAV file at real-time speed, as if it were being recorded"""
+
+    drops_when_full = False
+
+    def __init__(self, path: str, block_ms: int = 20, speed: float = 1.0):
+        self.path = path
+        self.block_ms = block_ms
+        self.speed = speed
+        with wave.open(path, 'rb') as wav:
+            self.sample_rate = wav.getframerate()
+            self.channels = wav.getnchannels()
+
+    def frames(self, stop: threading.Event):
+        """Yield float32 blocks of shape (samples, channels) paced to the clock"""
+        block = max(1, self.sample_rate * self.block_ms // 1000)
+        started = time.monotonic()
+        played = 0
+        with wave.open(self.path, 'rb') as wav:
+            width = wav.getsampwidth()
+            while not stop.is_set():
+                raw = wav.readframes(block)
+                if not raw:
+                    return
+                frames = pcm_to_float(raw, width, self.channels)
+                yield frames
+
+                # Sleep until the wall clock catches up with the audio played so far
+                played += len(frames)
+                ahead = played / self.sample_rate / self.speed - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+class MicrophoneSource:
+    """Captures the default input device (needs the optional sounddevice package).
+
+    This is the input device of the machine running the code: use it from
+    the command line or a locally run app, not a hosted one.
+    """
+
+    drops_when_full = True
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, channels: int = 1, block_ms: int = 20):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_ms = block_ms
+
+    def frames(self, stop: threading.Event):
+        try:
+            import sounddevice
+        except ImportError:
+            raise RuntimeError("Microphone capture needs the sounddevice package")
+
+        block = self.sample_rate * self.block_ms // 1000
+        with sounddevice.InputStream(samplerate=self.sample_rate, channels=self.channels,
+                                     dtype='float32', blocksize=block) as stream:
+            while not stop.is_set():
+                frames, _ = stream.read(block)
+                yield frames
+
+class RealtimePipeline:
+    """Streams a capture source to AssemblyAI real-time and merges the transcripts.
+
+    A capture thread downmixes and resamples audio into a ring buffer; a
+    sender thread drains it in CHUNK_MS chunks. When the buffer is full a
+    file source waits and a microphone source drops audio (counted in
+    overruns). Final transcripts are kept in order, and the latest partial
+    is shown after them. If the service drops the session, the sender opens
+    a new one and carries on from the audio still buffered.
+    """
+
+    def __init__(self, source, transcriber_factory=None):
+        # Imported here: transcription imports this module (through preprocessing)
+        import transcription
+        aai = transcription.assemblyai()
+        self._final_type = aai.RealtimeFinalTranscript
+
+        self.source = source
+        self.ring = RingBuffer(SAMPLE_RATE * RING_SECONDS)
+        self.resampler = Resampler(source.sample_rate, SAMPLE_RATE)
+        self.finals = []
+        self.partial = ''
+        self.errors = []
+        self.overruns = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.reconnects = 0
+        # (samples captured so far, monotonic time) per captured block, for latency lookups;
+        # appended by the capture thread and trimmed from the SDK's reader thread
+        self._captured = deque(maxlen=LATENCY_HISTORY_SECONDS * 1000 // getattr(source, 'block_ms', 20))
+        self._captured_lock = threading.Lock()
+        self._capture_done = threading.Event()
+        self._stop = threading.Event()
+        self._dropped = threading.Event()
+        self._threads = []
+        # Samples streamed in all sessions, and before the current one began:
+        # the service times each session's transcripts from its own start
+        self._sent = 0
+        self._session_start = 0
+        self._session = 0
+        self._factory = transcriber_factory or aai.RealtimeTranscriber
+        self.transcriber = self._new_transcriber()
+
+    def _new_transcriber(self):
+        session = self._session
+        return self._factory(
+            sample_rate=SAMPLE_RATE,
+            word_boost=WORD_BOOST,
+            on_data=self._on_data,
+            on_error=self._on_error,
+            on_close=lambda: self._on_close(session)
+        )
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.finals + ([self.partial] if self.partial else []))
+
+    @property
+    def running(self) -> bool:
+        """False once a finite source has been captured and fully sent"""
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        self.transcriber.connect()
+        for target in (self._capture, self._send):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def wait(self):
+        """Block until a finite source has been captured and fully sent"""
+        for thread in self._threads:
+            thread.join()
+
+    def stop(self, drain: bool = False):
+        """Stop capturing and close the session; with drain, send everything buffered first"""
+        if drain:
+            self.wait()
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self.transcriber.close()
+
+    def _capture(self):
+        captured = 0
+        try:
+            for frames in self.source.frames(self._stop):
+                samples = float_to_int16(self.resampler.process(downmix(frames)))
+                with self._captured_lock:
+                    self._captured.append((captured + len(samples), time.monotonic()))
+                captured += len(samples)
+
+                written = self.ring.write(samples)
+                while written < len(samples) and not self._stop.is_set():
+                    if self.source.drops_when_full:
+                        self.overruns += len(samples) - written
+                        break
+                    time.sleep(CHUNK_MS / 4000)
+                    written += self.ring.write(samples[written:])
+        except Exception as e:
+            logger.exception("Audio capture failed")
+            self.errors.append(str(e))
+        finally:
+            self._capture_done.set()
+
+    def _send(self):
+        while not self._stop.is_set():
+            if self._dropped.is_set() and not self._reconnect():
+                self._stop.set()
+                return
+            available = self.ring.available()
+            if available >= CHUNK_SAMPLES or (self._capture_done.is_set() and available):
+                chunk = self.ring.read(CHUNK_SAMPLES)
+                self.transcriber.stream(chunk.tobytes())
+                self._sent += len(chunk)
+            elif self._capture_done.is_set():
+                return
+            else:
+                time.sleep(CHUNK_MS / 4000)
+
+    def _reconnect(self) -> bool:
+        """Open a new session after the service dropped the last one; False once out of retries"""
+        self._dropped.clear()
+        if self.reconnects >= REALTIME_RECONNECTS:
+            logger.error("Real-time session dropped %d times, giving up", self.reconnects + 1)
+            self.errors.append("The real-time session kept dropping")
+            return False
+        self.reconnects += 1
+        logger.warning("Real-time session dropped, reconnecting (%d of %d)", self.reconnects, REALTIME_RECONNECTS)
+        self._session += 1
+        self._session_start = self._sent
+        self.transcriber = self._new_transcriber()
+        self.transcriber.connect()
+        return True
+
+    def _on_data(self, transcript):
+        if not transcript.text:
+            return
+        if isinstance(transcript, self._final_type):
+            self.finals.append(transcript.text)
+            self.partial = ''
+        else:
+            self.partial = transcript.text
+
+        # Capture-to-text latency: when was the last sample of this text recorded?
+        sample = self._session_start + transcript.audio_end * SAMPLE_RATE // 1000
+        with self._captured_lock:
+            index = bisect_left(self._captured, (sample,))
+            if index < len(self._captured):
+                self.latencies.append(time.monotonic() - self._captured[index][1])
+                # Transcripts only move forward, so earlier capture times are no longer needed
+                for _ in range(index):
+                    self._captured.popleft()
+
+    def _on_error(self, error):
+        logger.error("Real-time transcription error: %s", error)
+        self.errors.append(str(error))
+
+    def _on_close(self, session: int):
+        # The SDK closes a session itself when the connection drops; only
+        # the current session closing before stop() needs a new one
+        if session == self._session and not self._stop.is_set():
+            self._dropped.set()
+
+    def latency_stats(self) -> dict:
+        """Capture-to-text latency percentiles in seconds"""
+        if not self.latencies:
+            return {}
+        latencies = np.array(self.latencies)
+        return {
+            'count': len(latencies),
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'max': float(latencies.max())
+        }
+
+if __name__ == "__main__":
+    # Transcribe this machine's microphone, or replay a WAV file, in the terminal:
+    # python realtime.py [recording.wav]
+    pipeline = RealtimePipeline(FileSource(sys.argv[1]) if sys.argv[1:] else MicrophoneSource())
+    pipeline.start()
+    shown = ''
+    try:
+        while pipeline.running:
+            if pipeline.text != shown:
+                shown = pipeline.text
+                print(f"\r{shown[-120:]}", end='', flush=True)
+            time.sleep(0.2)
+        pipeline.stop(drain=True)
+    except KeyboardInterrupt:
+        pipeline.stop()
+    print(f"\n{pipeline.text}")
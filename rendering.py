@@ -0,0 +1,228 @@
+import html
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import storage
+import transcript_store
+import transcription
+
+# Rows shown per page of the results view and the sentiment list
+TRANSCRIPT_PAGE_SIZE = int(os.getenv('TRANSCRIPT_PAGE_SIZE', 200))
+SENTIMENT_PAGE_SIZE = int(os.getenv('SENTIMENT_PAGE_SIZE', 50))
+
+# Rendered pages kept in memory, least recently used dropped first
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', 256))
+
+SENTIMENT_ICONS = {
+    'POSITIVE': '🟢',
+    'NEGATIVE': '🔴',
+    'NEUTRAL': '⚪'
+}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cached(key, render):
+    """Return the cached value for key, rendering and storing it on a miss"""
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    value = render()
+    with _cache_lock:
+        _cache[key] = value
+        while len(_cache) > RENDER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+def page_count(total: int, page_size: int) -> int:
+    return max(1, -(-total // page_size))
+
+def _line_offsets(transcript_path: str) -> np.ndarray:
+    """Byte offset of the start of every line, plus the end of the file"""
+    chunks = []
+    position = 0
+    with storage.open_transcript(transcript_path, 'rb') as f:
+        while True:
+            data = f.read(storage.CHUNK_SIZE)
+            if not data:
+                break
+            chunks.append(np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')) + position + 1)
+            position += len(data)
+
+    offsets = np.concatenate([[0]] + chunks)
+    if offsets[-1] != position:
+        offsets = np.append(offsets, position)
+    return offsets
+
+def _source(transcript_path: str) -> tuple:
+    """How a transcript is paged: ('store', path, utterances) or ('text', path, line offsets).
+
+    Transcripts with a structured store are paged by utterance; older ones
+    by line of the rendered text.
+    """
+    store_path = transcript_store.store_path_for(transcript_path)
+    if os.path.exists(store_path):
+        def count():
+            with transcript_store.TranscriptStore(store_path) as store:
+                return store.utterance_count
+        key = ('source', store_path, os.stat(store_path).st_mtime_ns)
+        return 'store', store_path, _cached(key, count)
+
+    transcript_path = storage.resolve_transcript(transcript_path)
+    key = ('source', transcript_path, os.stat(transcript_path).st_mtime_ns)
+    return 'text', transcript_path, _cached(key, lambda: _line_offsets(transcript_path))
+
+def _render_store_page(store_path: str, page: int, page_size: int, pages: int) -> str:
+    parts = []
+    with transcript_store.TranscriptStore(store_path) as store:
+        utterances = store.utterances_at((page - 1) * page_size, page_size)
+        current_speaker = None
+        for utterance in utterances:
+            if utterance.speaker != current_speaker:
+                # Every page starts with a speaker label so it reads on its own
+                parts.append(f"{'<br>' if parts else ''}<b>Speaker {html.escape(str(utterance.speaker))}:</b>")
+                current_speaker = utterance.speaker
+            parts.append(html.escape(transcription.format_text(utterance.text)))
+
+        if page == pages and store.chapters:
+            parts.append("<br><b>Chapter Summary:</b>")
+            for i, chapter in enumerate(store.chapters, 1):
+                parts.append(f"<br>Chapter {i}: {html.escape(transcription.format_text(chapter.headline))}")
+                parts.append(html.escape(transcription.format_text(chapter.summary)))
+    return '<br>'.join(parts)
+
+def _render_text_page(transcript_path: str, offsets: np.ndarray, page: int, page_size: int) -> str:
+    first = (page - 1) * page_size
+    last = min(first + page_size, len(offsets) - 1)
+    with storage.open_transcript(transcript_path, 'rb') as f:
+        if f.seekable():
+            f.seek(int(offsets[first]))
+        else:
+            # Compressed transcripts can only be read forwards
+            skip = int(offsets[first])
+            while skip:
+                skip -= len(f.read(min(skip, storage.CHUNK_SIZE)))
+        data = f.read(int(offsets[last] - offsets[first]))
+    return '<br>'.join(html.escape(line) for line in data.decode('utf-8').split('\n')[:last - first])
+
+def render_transcript_page(transcript_path: str, page: int, page_size: int = TRANSCRIPT_PAGE_SIZE) -> tuple:
+    """Render one page of a transcript as HTML; returns (html, page, pages).
+
+    Only the rows on the page are read from disk, and rendered pages are
+    cached until the transcript file changes.
+    """
+    kind, path, source = _source(transcript_path)
+    total = source if kind == 'store' else len(source) - 1
+    pages = page_count(total, page_size)
+    page = min(max(1, page), pages)
+
+    key = ('page', path, os.stat(path).st_mtime_ns, page, page_size)
+    if kind == 'store':
+        return _cached(key, lambda: _render_store_page(path, page, page_size, pages)), page, pages
+    return _cached(key, lambda: _render_text_page(path, source, page, page_size)), page, pages
+
+def render_text_page(key: str, load_text, page: int, page_size: int = TRANSCRIPT_PAGE_SIZE) -> tuple:
+    """Render one page of transcript text fetched by load_text(), e.g. from the shared result store.
+
+    key identifies the text for the render cache, which keeps its line count
+    and the rendered pages but never the text, so load_text is only called
+    for a page not rendered yet. Returns (html, page, pages).
+    """
+    loaded = []
+
+    def text():
+        if not loaded:
+            loaded.append(load_text())
+        return loaded[0]
+
+    pages = page_count(_cached(('line_count', key), lambda: text().count('\n') + 1), page_size)
+    page = min(max(1, page), pages)
+
+    def render():
+        lines = text().split('\n')[(page - 1) * page_size:page * page_size]
+        return '<br>'.join(html.escape(line) for line in lines)
+
+    return _cached(('text_page', key, page, page_size), render), page, pages
+
+def render_sentiment_page(transcript_path: str, sentiment: list, page: int,
+                          page_size: int = SENTIMENT_PAGE_SIZE) -> tuple:
+    """Render one page of sentiment results as a single HTML block; returns (html, page, pages)"""
+    pages = page_count(len(sentiment), page_size)
+    page = min(max(1, page), pages)
+
+    def render():
+        rows = sentiment[(page - 1) * page_size:page * page_size]
+        return '<br>'.join(
+            f"{SENTIMENT_ICONS.get(row['sentiment'], '⚪')} {html.escape(row['text'])}" for row in rows
+        )
+
+    # Sentiment for a transcript only ever goes from missing to complete
+    key = ('sentiment', transcript_path, len(sentiment), page, page_size)
+    return _cached(key, render), page, pages
+
+def benchmark(utterance_count: int = 10000):
+    """Time rendering a synthetic transcript whole versus one page at a time"""
+    from types import SimpleNamespace
+
+    words = "we should ship the new release next week after the review".split()
+    utterances = [
+        SimpleNamespace(
+            speaker='AB'[i // 3 % 2],
+            text=" ".join(words[(i + j) % len(words)] for j in range(12)) + ".",
+            start=i * 4000, end=i * 4000 + 3500, confidence=0.9, words=[]
+        )
+        for i in range(utterance_count)
+    ]
+    transcript = SimpleNamespace(utterances=utterances, chapters=[], sentiment_analysis=[])
+    sentiment = [{'text': u.text, 'sentiment': 'POSITIVE', 'confidence': 0.9} for u in utterances]
+
+    def timed(label, work, repeat=5):
+        work()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            result = work()
+        elapsed = (time.perf_counter() - started) / repeat
+        print(f"{label:<42} {elapsed * 1000:9.2f} ms  {len(result):>10,} bytes of HTML")
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_path = os.path.join(directory, 'meeting.txt')
+        transcription.write_transcript(transcription.iter_transcript(transcript), text_path)
+        legacy_path = os.path.join(directory, 'legacy.txt')
+        transcription.write_transcript(transcription.iter_transcript(transcript), legacy_path)
+        transcript_store.write(transcript, transcript_store.store_path_for(text_path))
+        print(f"{utterance_count:,} utterances, {os.path.getsize(text_path):,} bytes of text")
+
+        def whole_transcript():
+            with open(text_path, 'r', encoding='utf-8') as f:
+                return '<br>'.join(line.rstrip('\n') for line in f)
+
+        def cold(path, page):
+            _cache.clear()
+            return render_transcript_page(path, page)[0]
+
+        def uncached_page(path, page):
+            # Keep the line index, drop only the rendered pages
+            with _cache_lock:
+                for key in [key for key in _cache if key[0] == 'page']:
+                    del _cache[key]
+            return render_transcript_page(path, page)[0]
+
+        timed("whole transcript (previous view)", whole_transcript)
+        timed("first page, cold (structured store)", lambda: cold(text_path, 1))
+        timed("last page, cold (structured store)", lambda: cold(text_path, 10 ** 9))
+        timed("first page, cold (text line index)", lambda: cold(legacy_path, 1))
+        timed("middle page, line index cached", lambda: uncached_page(legacy_path, 25))
+        timed("first page, cached", lambda: render_transcript_page(text_path, 1)[0])
+        timed("sentiment page, cold", lambda: (_cache.clear(), render_sentiment_page(text_path, sentiment, 1)[0])[1])
+        timed("sentiment page, cached", lambda: render_sentiment_page(text_path, sentiment, 1)[0])
+        print(f"Sentiment: {len(sentiment):,} st.write elements before, 1 markdown element per page now")
+
+if __name__ == "__main__":
+    # Render-time benchmark: python rendering.py [utterances]
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
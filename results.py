@@ -0,0 +1,130 @@
+import base64
+import json
+import os
+import uuid
+import zlib
+from datetime import datetime
+from auth import HSET_IF_EXISTS_SCRIPT, get_redis, script
+import storage
+
+# Finished transcripts and their audio intelligence, shared by every app
+# replica through Redis so a user's results follow them to whichever node
+# serves the next request. Sessions only keep the result id.
+RESULT_TTL = int(os.getenv('RESULT_TTL', 7 * 24 * 3600))
+
+# Results listed per user, newest first
+USER_RESULTS_LIMIT = int(os.getenv('USER_RESULTS_LIMIT', 50))
+
+# Payloads are compressed (zstd when available) and base64-encoded, as the
+# shared client decodes every reply as text
+ZSTD_PREFIX = 'zstd:'
+ZLIB_PREFIX = 'zlib:'
+
+def _result_key(owner: str, result_id: str) -> str:
+    return f"result:{owner}:{result_id}"
+
+def _user_results_key(owner: str) -> str:
+    return f"user_results:{owner}"
+
+def _pack(data: bytes) -> str:
+    if storage.zstandard is not None:
+        compressed = storage.zstandard.ZstdCompressor(level=storage.COMPRESSION_LEVEL).compress(data)
+        return ZSTD_PREFIX + base64.b64encode(compressed).decode('ascii')
+    return ZLIB_PREFIX + base64.b64encode(zlib.compress(data, 9)).decode('ascii')
+
+def _unpack(value: str) -> bytes:
+    if value.startswith(ZSTD_PREFIX):
+        if storage.zstandard is None:
+            raise RuntimeError("Reading this result needs the zstandard package")
+        return storage.zstandard.ZstdDecompressor().decompress(base64.b64decode(value[len(ZSTD_PREFIX):]))
+    return zlib.decompress(base64.b64decode(value[len(ZLIB_PREFIX):]))
+
+def save_transcript(owner: str, transcript_path: str) -> str:
+    """Publish a saved transcript to the shared store and return its result id"""
+    result_id = uuid.uuid4().hex
+    text = storage.read_transcript_bytes(transcript_path)
+    key = _result_key(owner, result_id)
+
+    pipe = get_redis().pipeline()
+    pipe.hset(key, mapping={
+        'id': result_id,
+        'filename': storage.display_name(transcript_path),
+        'text': _pack(text),
+        'text_bytes': len(text),
+        'created_at': datetime.now().isoformat()
+    })
+    pipe.expire(key, RESULT_TTL)
+    pipe.lpush(_user_results_key(owner), result_id)
+    pipe.ltrim(_user_results_key(owner), 0, USER_RESULTS_LIMIT - 1)
+    pipe.expire(_user_results_key(owner), RESULT_TTL)
+    pipe.execute()
+    return result_id
+
+def save_intelligence(owner: str, result_id: str, name: str, value, error=None):
+    """Add one audio intelligence section to a result"""
+    fields = {f"intelligence_{name}": _pack(json.dumps(value).encode('utf-8'))}
+    if error is not None:
+        fields[f"intelligence_error_{name}"] = str(error)
+    # Only update results that still exist; an expired one is not brought back half empty
+    script(HSET_IF_EXISTS_SCRIPT)(keys=[_result_key(owner, result_id)],
+                                  args=[item for pair in fields.items() for item in pair])
+
+def get_transcript(owner: str, result_id: str) -> str:
+    """The transcript text of one of a user's results, or None if it expired"""
+    value = get_redis().hget(_result_key(owner, result_id), 'text')
+    return _unpack(value).decode('utf-8') if value is not None else None
+
+def _parse_result(result: dict) -> dict:
+    result['text_bytes'] = int(result.get('text_bytes', 0))
+    if 'text' in result:
+        result['text'] = _unpack(result['text']).decode('utf-8')
+    intelligence = {}
+    errors = {}
+    for field in [field for field in result if field.startswith('intelligence_')]:
+        value = result.pop(field)
+        if field.startswith('intelligence_error_'):
+            errors[field[len('intelligence_error_'):]] = value
+        else:
+            intelligence[field[len('intelligence_'):]] = json.loads(_unpack(value))
+    result['intelligence'] = intelligence
+    result['intelligence_errors'] = errors
+    return result
+
+def get_results(owner: str, result_ids: list) -> list:
+    """Several of a user's results without their text, None for each that expired.
+
+    Two round trips however many there are: the field names, then every
+    field but the text.
+    """
+    pipe = get_redis().pipeline(transaction=False)
+    for result_id in result_ids:
+        pipe.hkeys(_result_key(owner, result_id))
+    fields = [[field for field in names if field != 'text'] for names in pipe.execute()]
+
+    pipe = get_redis().pipeline(transaction=False)
+    for result_id, names in zip(result_ids, fields):
+        if names:
+            pipe.hmget(_result_key(owner, result_id), names)
+    values = iter(pipe.execute())
+
+    results = []
+    for names in fields:
+        # A result that expired between the two round trips comes back all None
+        result = {name: value for name, value in zip(names, next(values)) if value is not None} if names else {}
+        results.append(_parse_result(result) if result else None)
+    return results
+
+def get_result(owner: str, result_id: str, text: bool = False) -> dict:
+    """One of a user's results with its intelligence sections, or None if it expired.
+
+    The transcript text is only fetched and decompressed with text set.
+    """
+    if not text:
+        return get_results(owner, [result_id])[0]
+    result = get_redis().hgetall(_result_key(owner, result_id))
+    return _parse_result(result) if result else None
+
+def list_results(owner: str) -> list:
+    """A user's results that have not expired, newest first, without their text"""
+    result_ids = get_redis().lrange(_user_results_key(owner), 0, -1)
+    return [result for result in get_results(owner, result_ids) if result]
@@ -0,0 +1,221 @@
+import os
+import re
+import sqlite3
+import threading
+import dedup
+import storage
+from storage import STORAGE_DIR, TRANSCRIPT_DIR
+
+# The index is an SQLite FTS5 database: an on-disk inverted index with BM25
+# ranking and snippets. Pages are memory-mapped and read on demand, so
+# opening it at startup costs nothing regardless of its size.
+INDEX_DIR = os.path.join(STORAGE_DIR, 'index')
+INDEX_PATH = os.path.join(INDEX_DIR, 'search.db')
+INDEX_MMAP_SIZE = int(os.getenv('SEARCH_INDEX_MMAP_SIZE', 256 * 1024 * 1024))
+
+SPEAKER_PATTERN = re.compile(r'^Speaker (.+):$')
+CHAPTERS_HEADING = "Chapter Summary:"
+TERM_PATTERN = re.compile(r'\w+')
+
+# Block rowids are doc_id << BLOCK_BITS | block number, so a document's
+# blocks form one rowid range that can be deleted without a table scan
+BLOCK_BITS = 20
+
+os.makedirs(INDEX_DIR, exist_ok=True)
+
+_local = threading.local()
+_synced = False
+_sync_lock = threading.Lock()
+
+def _connection() -> sqlite3.Connection:
+    """Return this thread's connection to the index, creating the schema on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(INDEX_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA mmap_size={INDEX_MMAP_SIZE}")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS blocks USING fts5(
+                text,
+                speaker UNINDEXED,
+                tokenize = 'unicode61'
+            );
+            CREATE TABLE IF NOT EXISTS owners (
+                owner TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (owner, path)
+            ) WITHOUT ROWID;
+        """)
+        _local.conn = conn
+    return conn
+
+def parse_blocks(lines):
+    """Split transcript lines into (speaker, text) blocks.
+
+    Text under a "Speaker X:" label belongs to that speaker; the chapter
+    summary is indexed with an empty speaker.
+    """
+    speaker = ''
+    block = []
+    for line in lines:
+        line = line.rstrip('\n')
+        match = SPEAKER_PATTERN.match(line)
+        if match or line == CHAPTERS_HEADING:
+            if block:
+                yield speaker, "\n".join(block)
+            speaker = match.group(1) if match else ''
+            block = []
+        elif line:
+            block.append(line)
+    if block:
+        yield speaker, "\n".join(block)
+
+def _delete_blocks(conn: sqlite3.Connection, doc_id: int):
+    conn.execute(
+        "DELETE FROM blocks WHERE rowid BETWEEN ? AND ?",
+        (doc_id << BLOCK_BITS, ((doc_id + 1) << BLOCK_BITS) - 1)
+    )
+
+def index_transcript(transcript_path: str):
+    """Add or refresh one transcript file in the index"""
+    conn = _connection()
+    mtime = os.path.getmtime(transcript_path)
+    with storage.open_transcript(transcript_path) as f:
+        blocks = list(parse_blocks(f))
+
+    with conn:
+        row = conn.execute("SELECT id FROM documents WHERE path = ?", (transcript_path,)).fetchone()
+        if row:
+            doc_id = row[0]
+            _delete_blocks(conn, doc_id)
+            conn.execute("UPDATE documents SET mtime = ? WHERE id = ?", (mtime, doc_id))
+        else:
+            doc_id = conn.execute(
+                "INSERT INTO documents (path, mtime) VALUES (?, ?)", (transcript_path, mtime)
+            ).lastrowid
+        conn.executemany(
+            "INSERT INTO blocks (rowid, text, speaker) VALUES (?, ?, ?)",
+            [((doc_id << BLOCK_BITS) + number, text, speaker)
+             for number, (speaker, text) in enumerate(blocks)]
+        )
+
+def _owned_path(transcript_path: str) -> str:
+    # Owners are recorded against the plain .txt path, so they carry over
+    # when a transcript is compressed
+    if transcript_path.endswith(storage.COMPRESSED_SUFFIX):
+        return transcript_path[:-len(storage.COMPRESSED_SUFFIX)]
+    return transcript_path
+
+def add_owner(transcript_path: str, owner: str):
+    """Let a user find a transcript; one file can be shared by several users through the transcript cache"""
+    with _connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO owners (owner, path) VALUES (?, ?)", (owner, _owned_path(transcript_path)))
+
+def is_owner(transcript_path: str, owner: str) -> bool:
+    """Whether a transcript was recorded as one of owner's"""
+    return _connection().execute(
+        "SELECT 1 FROM owners WHERE owner = ? AND path = ?", (owner, _owned_path(transcript_path))
+    ).fetchone() is not None
+
+def remove_transcript(transcript_path: str):
+    """Drop a transcript file from the index"""
+    conn = _connection()
+    with conn:
+        row = conn.execute("SELECT id FROM documents WHERE path = ?", (transcript_path,)).fetchone()
+        if row:
+            _delete_blocks(conn, row[0])
+            conn.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+
+def sync_index(directory: str = TRANSCRIPT_DIR) -> int:
+    """Index new or changed transcript files and forget deleted ones.
+
+    Returns the number of files (re)indexed.
+    """
+    conn = _connection()
+    known = dict(conn.execute("SELECT path, mtime FROM documents"))
+    updated = 0
+    seen = set()
+    for entry in os.scandir(directory):
+        if not storage.is_transcript(entry.name) or not entry.is_file():
+            continue
+        seen.add(entry.path)
+        if known.get(entry.path) != entry.stat().st_mtime:
+            index_transcript(entry.path)
+            updated += 1
+
+    for path in known.keys() - seen:
+        if os.path.dirname(path) == directory:
+            remove_transcript(path)
+    return updated
+
+def _ensure_synced():
+    """Catch up with files written while the index was not being maintained"""
+    global _synced
+    if _synced:
+        return
+    with _sync_lock:
+        if not _synced:
+            sync_index()
+            _synced = True
+
+def search(query: str, owner: str, speaker: str = None, limit: int = 20) -> list:
+    """Search one user's transcripts, best BM25 match first.
+
+    Only transcripts recorded for owner with add_owner are searched.
+    Returns one hit per transcript with the matching speaker and a snippet;
+    near-duplicates of a transcript are counted in its hit's 'duplicates'
+    rather than listed.
+    """
+    terms = TERM_PATTERN.findall(query)
+    if not terms:
+        return []
+    _ensure_synced()
+
+    # Quote every term so user input is never parsed as FTS syntax
+    match = " ".join(f'"{term}"' for term in terms)
+    sql = """
+        SELECT documents.path, blocks.speaker,
+               snippet(blocks, 0, '**', '**', '…', 16), bm25(blocks)
+        FROM blocks JOIN documents ON documents.id = blocks.rowid >> ?
+        WHERE blocks MATCH ? AND documents.id IN (
+            SELECT documents.id FROM owners JOIN documents ON documents.path IN (owners.path, owners.path || ?)
+            WHERE owners.owner = ?
+        )
+    """
+    params = [BLOCK_BITS, match, storage.COMPRESSED_SUFFIX, owner]
+    if speaker:
+        sql += " AND blocks.speaker = ?"
+        params.append(speaker)
+    sql += " ORDER BY bm25(blocks) LIMIT ?"
+    params.append(limit * 5)
+
+    rows = _connection().execute(sql, params).fetchall()
+
+    # One hit per transcript, and near-duplicate transcripts count as one
+    canonical = dedup.canonical_paths({path for path, *_ in rows})
+    hits = []
+    groups = {}
+    seen = set()
+    for path, block_speaker, snippet, score in rows:
+        if path in seen:
+            continue
+        seen.add(path)
+        group = canonical.get(path, path)
+        if group in groups:
+            groups[group]['duplicates'] += 1
+        elif len(hits) < limit:
+            groups[group] = {
+                'path': path,
+                'filename': storage.display_name(path),
+                'speaker': block_speaker,
+                'snippet': snippet,
+                'score': -score,
+                'duplicates': 0
+            }
+            hits.append(groups[group])
+    return hits
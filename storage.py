@@ -0,0 +1,474 @@
+import functools
+import hashlib
+import io
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Configure local storage
+STORAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage')
+AUDIO_DIR = os.path.join(STORAGE_DIR, 'audio')
+TRANSCRIPT_DIR = os.path.join(STORAGE_DIR, 'transcripts')
+DICTIONARY_DIR = os.path.join(STORAGE_DIR, 'dictionaries')
+
+# Scratch files, such as the chunks of a long recording, never go next to
+# the source audio, which may be read-only
+TEMP_DIR = os.getenv('STORAGE_TEMP_DIR', os.path.join(STORAGE_DIR, 'tmp'))
+
+# Old audio is moved here (point it at cheaper storage) or deleted
+ARCHIVE_DIR = os.getenv('STORAGE_ARCHIVE_DIR', os.path.join(STORAGE_DIR, 'archive', 'audio'))
+
+# Audio formats accepted for transcription
+SUPPORTED_FORMATS = ["mp3", "wav", "m4a", "ogg", "wma", "aac"]
+
+# Uploads are copied in fixed-size chunks so memory use does not grow with file size
+CHUNK_SIZE = 1024 * 1024
+
+# Transcripts are stored zstd-compressed with a dictionary trained on our
+# speaker-block format, when the zstandard package is installed
+TRANSCRIPT_COMPRESSION = os.getenv('TRANSCRIPT_COMPRESSION', 'true').lower() != 'false'
+COMPRESSION_LEVEL = int(os.getenv('TRANSCRIPT_COMPRESSION_LEVEL', 9))
+COMPRESSED_SUFFIX = '.zst'
+DICTIONARY_SIZE = 64 * 1024
+DICTIONARY_SAMPLE_BYTES = 64 * 1024 * 1024
+
+# Uncompressed sizes of transcripts whose frame header does not record one,
+# remembered for this many file versions so the stats page does not decompress
+# them on every render
+CONTENT_SIZE_CACHE = 4096
+
+# Audio retention: files past the max age, then the oldest files while the
+# directory is over the size limit, are archived (or deleted). Files younger
+# than the min age may still belong to a running job and are never touched
+AUDIO_MAX_AGE = int(os.getenv('AUDIO_MAX_AGE', 30 * 24 * 3600))
+AUDIO_MAX_BYTES = int(os.getenv('AUDIO_MAX_BYTES', 10 * 1024 ** 3))
+AUDIO_MIN_AGE = int(os.getenv('AUDIO_MIN_AGE', 3600))
+AUDIO_RETENTION_ACTION = os.getenv('AUDIO_RETENTION_ACTION', 'archive')
+ARCHIVE_MAX_BYTES = int(os.getenv('AUDIO_ARCHIVE_MAX_BYTES', 50 * 1024 ** 3))
+RETENTION_INTERVAL = int(os.getenv('STORAGE_RETENTION_INTERVAL', 3600))
+
+# Transcripts split into samples at blank lines, i.e. per speaker block
+SAMPLE_SEPARATOR = re.compile(r'\n\n+')
+
+# Create storage directories if they don't exist
+os.makedirs(AUDIO_DIR, exist_ok=True)
+os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+os.makedirs(DICTIONARY_DIR, exist_ok=True)
+os.makedirs(TEMP_DIR, exist_ok=True)
+
+_dictionaries = {}
+_dictionary_lock = threading.Lock()
+_retention_lock = threading.Lock()
+_retention_ran_at = None
+
+def sniff_format(header: bytes) -> str:
+    """Guess the audio container from the first bytes of a file"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[4:8] == b'ftyp':
+        return 'm4a'
+    if header[:4] == b'OggS':
+        return 'ogg'
+    if header[:4] == b'fLaC':
+        return 'flac'
+    if header[:4] == b'\x30\x26\xb2\x75':
+        return 'wma'
+    if header[:3] == b'ID3':
+        return 'mp3'
+    if len(header) >= 2 and header[0] == 0xFF:
+        # ADTS AAC frames have layer bits 00, MPEG audio frames do not
+        if header[1] & 0xF6 == 0xF0:
+            return 'aac'
+        if header[1] & 0xE0 == 0xE0:
+            return 'mp3'
+    return 'unknown'
+
+def unique_filename(filename: str) -> str:
+    """Prefix a filename with a timestamp and random suffix so saves never collide"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{timestamp}_{uuid.uuid4().hex[:8]}_{os.path.basename(filename)}"
+
+def save_stream(file_obj, filename: str, directory: str = AUDIO_DIR) -> dict:
+    """Copy a file object to storage in one pass.
+
+    The data is read in chunks into a reused buffer, hashed and counted on the
+    way through, and written to a temp file that is renamed into place once
+    complete. Returns the path, sha256, size and sniffed format.
+    """
+    if hasattr(file_obj, 'seek'):
+        file_obj.seek(0)
+
+    digest = hashlib.sha256()
+    size = 0
+    header = b''
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                if hasattr(file_obj, 'readinto'):
+                    count = file_obj.readinto(view)
+                    chunk = view[:count]
+                else:
+                    data = file_obj.read(CHUNK_SIZE)
+                    count = len(data)
+                    chunk = memoryview(data)
+                if not count:
+                    break
+
+                if len(header) < 16:
+                    header += bytes(chunk[:16 - len(header)])
+                digest.update(chunk)
+                f.write(chunk)
+                size += count
+
+        file_path = os.path.join(directory, unique_filename(filename))
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    return {
+        'path': file_path,
+        'sha256': digest.hexdigest(),
+        'size': size,
+        'format': sniff_format(header)
+    }
+
+def hash_file(path: str) -> str:
+    """Return the sha256 of a file on disk, read in chunks"""
+    digest = hashlib.sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        while True:
+            count = f.readinto(view)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+def compression_enabled() -> bool:
+    return TRANSCRIPT_COMPRESSION and zstandard is not None
+
+def _dictionary_path(dict_id: int) -> str:
+    return os.path.join(DICTIONARY_DIR, f"{dict_id}.dict")
+
+def _load_dictionary(dict_id: int):
+    with _dictionary_lock:
+        if dict_id not in _dictionaries:
+            with open(_dictionary_path(dict_id), 'rb') as f:
+                _dictionaries[dict_id] = zstandard.ZstdCompressionDict(f.read())
+        return _dictionaries[dict_id]
+
+def current_dictionary():
+    """The dictionary new transcripts are compressed with, or None before one is trained"""
+    try:
+        with open(os.path.join(DICTIONARY_DIR, 'current'), 'r') as f:
+            return _load_dictionary(int(f.read().strip()))
+    except (OSError, ValueError):
+        return None
+
+def train_dictionary(paths: list = None) -> int:
+    """Train a compression dictionary on existing transcripts and make it current.
+
+    Each speaker block is one sample. Returns the new dictionary id, or None
+    if there is not enough text to train on yet.
+    """
+    if paths is None:
+        paths = sorted(
+            (entry.path for entry in os.scandir(TRANSCRIPT_DIR) if is_transcript(entry.name)),
+            key=os.path.getmtime, reverse=True
+        )
+
+    samples = []
+    total = 0
+    for path in paths:
+        for block in SAMPLE_SEPARATOR.split(read_transcript(path)):
+            if block:
+                samples.append(block.encode('utf-8'))
+                total += len(samples[-1])
+        if total >= DICTIONARY_SAMPLE_BYTES:
+            break
+
+    try:
+        dictionary = zstandard.train_dictionary(DICTIONARY_SIZE, samples, level=COMPRESSION_LEVEL)
+    except zstandard.ZstdError as e:
+        logger.info("Not enough transcript text to train a dictionary yet: %s", e)
+        return None
+
+    dict_id = dictionary.dict_id()
+    _atomic_write(_dictionary_path(dict_id), dictionary.as_bytes())
+    _atomic_write(os.path.join(DICTIONARY_DIR, 'current'), str(dict_id).encode('ascii'))
+    return dict_id
+
+def _atomic_write(path: str, data: bytes):
+    temp_path = f"{path}.part"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def is_transcript(name: str) -> bool:
+    return name.endswith('.txt') or name.endswith('.txt' + COMPRESSED_SUFFIX)
+
+def display_name(path: str) -> str:
+    """File name of a transcript as users see it, without the compression suffix"""
+    name = os.path.basename(path)
+    return name[:-len(COMPRESSED_SUFFIX)] if name.endswith(COMPRESSED_SUFFIX) else name
+
+def resolve_transcript(path: str) -> str:
+    """Find a transcript on disk even if it was compressed (or restored) since path was saved"""
+    if os.path.exists(path):
+        return path
+    alternative = path[:-len(COMPRESSED_SUFFIX)] if path.endswith(COMPRESSED_SUFFIX) else path + COMPRESSED_SUFFIX
+    return alternative if os.path.exists(alternative) else path
+
+def save_transcript(path: str, pieces, size: int = None) -> str:
+    """Write transcript text pieces atomically, compressed when enabled.
+
+    path is the plain .txt path; returns the path actually written, which
+    has the compression suffix added when the transcript is compressed.
+    Callers that already hold the whole text can pass its UTF-8 size, which
+    is recorded in the zstd frame header so the stats need not decompress it.
+    """
+    if compression_enabled():
+        path += COMPRESSED_SUFFIX
+    temp_path = f"{path}.part"
+    try:
+        if compression_enabled():
+            compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=current_dictionary())
+            with open(temp_path, 'wb') as f, \
+                    compressor.stream_writer(f, size=-1 if size is None else size, closefd=False) as writer:
+                for piece in pieces:
+                    writer.write(piece.encode('utf-8'))
+        else:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.writelines(pieces)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return path
+
+def open_transcript(path: str, mode: str = 'r'):
+    """Open a transcript for reading, decompressing it transparently.
+
+    Text mode ('r') yields str, 'rb' yields the original UTF-8 bytes.
+    """
+    path = resolve_transcript(path)
+    if not path.endswith(COMPRESSED_SUFFIX):
+        return open(path, 'rb') if 'b' in mode else open(path, 'r', encoding='utf-8')
+
+    if zstandard is None:
+        raise RuntimeError("Reading compressed transcripts needs the zstandard package")
+    raw = open(path, 'rb')
+    try:
+        dict_id = zstandard.get_frame_parameters(raw.read(18)).dict_id
+        raw.seek(0)
+        decompressor = zstandard.ZstdDecompressor(dict_data=_load_dictionary(dict_id) if dict_id else None)
+        stream = io.BufferedReader(decompressor.stream_reader(raw, closefd=True))
+    except BaseException:
+        raw.close()
+        raise
+    return stream if 'b' in mode else io.TextIOWrapper(stream, encoding='utf-8')
+
+def read_transcript(path: str) -> str:
+    with open_transcript(path) as f:
+        return f.read()
+
+def read_transcript_bytes(path: str) -> bytes:
+    """The transcript as plain UTF-8 bytes, e.g. for downloads"""
+    with open_transcript(path, 'rb') as f:
+        return f.read()
+
+@functools.lru_cache(maxsize=CONTENT_SIZE_CACHE)
+def _decompressed_size(path: str, mtime_ns: int, size: int) -> int:
+    """Uncompressed size of one version of a transcript, counted by decompressing it"""
+    count = 0
+    with open_transcript(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            count += len(chunk)
+    return count
+
+def _content_size(path: str) -> int:
+    """Uncompressed size of a transcript, from the zstd frame header when it has one"""
+    if not path.endswith(COMPRESSED_SUFFIX):
+        return os.path.getsize(path)
+    with open(path, 'rb') as f:
+        size = zstandard.get_frame_parameters(f.read(18)).content_size
+    if size != zstandard.CONTENTSIZE_UNKNOWN:
+        return size
+
+    # Transcripts streamed as they were formatted, so their size was not known up front
+    stat = os.stat(path)
+    return _decompressed_size(path, stat.st_mtime_ns, stat.st_size)
+
+def migrate_transcripts(directory: str = TRANSCRIPT_DIR) -> dict:
+    """Compress existing plain .txt transcripts in place.
+
+    A dictionary is trained first if there is none. Each file is verified
+    after compression before the original is removed, and keeps its mtime.
+    Returns the number of files migrated and the bytes before and after.
+    """
+    if not compression_enabled():
+        raise RuntimeError("Transcript compression is disabled or the zstandard package is missing")
+    if current_dictionary() is None:
+        train_dictionary()
+
+    result = {'migrated': 0, 'bytes_before': 0, 'bytes_after': 0}
+    for entry in list(os.scandir(directory)):
+        if not entry.name.endswith('.txt') or not entry.is_file():
+            continue
+        with open(entry.path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        compressed_path = save_transcript(entry.path, [text], len(text.encode('utf-8')))
+        if read_transcript(compressed_path) != text:
+            os.unlink(compressed_path)
+            raise RuntimeError(f"Compressed copy of {entry.path} does not match the original")
+
+        stat = entry.stat()
+        os.utime(compressed_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.unlink(entry.path)
+        result['migrated'] += 1
+        result['bytes_before'] += stat.st_size
+        result['bytes_after'] += os.path.getsize(compressed_path)
+
+    # Point the search and duplicate indexes at the compressed files. The
+    # duplicate index re-signs them under their new paths, so link them again
+    import dedup
+    import search
+    search.sync_index(directory)
+    dedup.dedupe(directory)
+    return result
+
+def _remove_or_archive(path: str, action: str):
+    if action == 'archive':
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        shutil.move(path, os.path.join(ARCHIVE_DIR, os.path.basename(path)))
+    else:
+        os.unlink(path)
+
+def _files_by_age(directory: str) -> list:
+    """(mtime, size, path) of the finished files in a directory, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and not entry.name.endswith('.part'):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    return sorted(files)
+
+def apply_retention(now: float = None) -> dict:
+    """Archive or delete old audio by age and total size, then trim the archive"""
+    now = now or time.time()
+    result = {'archived': 0, 'deleted': 0, 'freed_bytes': 0}
+    action = 'archive' if AUDIO_RETENTION_ACTION == 'archive' else 'delete'
+
+    files = _files_by_age(AUDIO_DIR)
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        age = now - mtime
+        if age < AUDIO_MIN_AGE or (age <= AUDIO_MAX_AGE and total <= AUDIO_MAX_BYTES):
+            break
+        try:
+            _remove_or_archive(path, action)
+        except FileNotFoundError:
+            continue
+        total -= size
+        result['archived' if action == 'archive' else 'deleted'] += 1
+        result['freed_bytes'] += size
+
+    archived = _files_by_age(ARCHIVE_DIR)
+    total = sum(size for _, size, _ in archived)
+    for _, size, path in archived:
+        if total <= ARCHIVE_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        result['deleted'] += 1
+
+    if result['archived'] or result['deleted']:
+        logger.info("Audio retention: %s", result)
+    return result
+
+def maybe_run_maintenance():
+    """Apply audio retention, and train a first compression dictionary once there
+    is enough text, if this process has not done so for RETENTION_INTERVAL"""
+    global _retention_ran_at
+    if _retention_ran_at is not None and time.monotonic() - _retention_ran_at < RETENTION_INTERVAL:
+        return
+    if not _retention_lock.acquire(blocking=False):
+        return
+    try:
+        _retention_ran_at = time.monotonic()
+        apply_retention()
+        if compression_enabled() and current_dictionary() is None:
+            train_dictionary()
+    except Exception:
+        logger.exception("Error running storage maintenance")
+    finally:
+        _retention_lock.release()
+
+def get_storage_stats() -> dict:
+    """Disk usage per storage area and the transcripts' compression ratio"""
+    stats = {}
+    for name, directory in (('audio', AUDIO_DIR), ('archive', ARCHIVE_DIR), ('transcripts', TRANSCRIPT_DIR)):
+        files = _files_by_age(directory)
+        stats[name] = {'files': len(files), 'bytes': sum(size for _, size, _ in files)}
+
+    compressed = [path for _, _, path in _files_by_age(TRANSCRIPT_DIR) if path.endswith('.txt' + COMPRESSED_SUFFIX)]
+    stored = sum(os.path.getsize(path) for path in compressed)
+    original = sum(_content_size(path) for path in compressed)
+    stats['compression'] = {
+        'files': len(compressed),
+        'stored_bytes': stored,
+        'original_bytes': original,
+        'ratio': original / stored if stored else 0.0,
+        'dictionary': current_dictionary() is not None
+    }
+    return stats
+
+if __name__ == "__main__":
+    # Storage maintenance:
+    #   python storage.py train-dictionary   retrain the transcript compression dictionary
+    #   python storage.py migrate            compress existing .txt transcripts
+    #   python storage.py retention          archive or delete old audio now
+    #   python storage.py stats              print disk usage and compression ratio
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'train-dictionary':
+        print(f"Trained dictionary {train_dictionary()}")
+    elif command == 'migrate':
+        result = migrate_transcripts()
+        print(f"Compressed {result['migrated']} transcripts: "
+              f"{result['bytes_before']:,} -> {result['bytes_after']:,} bytes")
+    elif command == 'retention':
+        print(apply_retention())
+    else:
+        for name, values in get_storage_stats().items():
+            print(f"{name}: {values}")
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from storage import COMPRESSED_SUFFIX
+
+# Cached transcriptions live next to the rest of the local storage
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage', 'cache')
+
+# Eviction policy: entries older than max age are dropped, then the least
+# recently used entries until the cache fits in max bytes
+CACHE_MAX_BYTES = int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+CACHE_MAX_AGE = int(os.getenv('TRANSCRIPT_CACHE_MAX_AGE', 30 * 24 * 3600))
+
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+def cache_key(audio_hash: str, options: dict) -> str:
+    """Build a cache key from the audio hash and transcription options"""
+    encoded_options = json.dumps(options, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f"{audio_hash}:{encoded_options}".encode('utf-8')).hexdigest()
+
+def _entry_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+def _text_path(key: str, compressed: bool = False) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.txt" + (COMPRESSED_SUFFIX if compressed else ''))
+
+def _existing_text_path(key: str) -> str:
+    """The cached transcript copy, which keeps the original's compression"""
+    compressed_path = _text_path(key, compressed=True)
+    return compressed_path if os.path.exists(compressed_path) else _text_path(key)
+
+def _store_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.sst")
+
+def _remove(key: str):
+    for path in (_entry_path(key), _text_path(key), _text_path(key, compressed=True), _store_path(key)):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        _stats[name] += amount
+
+def get(key: str) -> dict:
+    """Return a cached transcription or None on a miss.
+
+    The entry's text_path points at the cache's own copy of the transcript,
+    and store_path at its structured transcript when one was cached.
+    """
+    path = _entry_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > CACHE_MAX_AGE:
+            _remove(key)
+            _count('evictions')
+            raise FileNotFoundError(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        if not os.path.exists(_existing_text_path(key)):
+            raise FileNotFoundError(_text_path(key))
+    except (OSError, ValueError):
+        _count('misses')
+        return None
+
+    # Touch the entry so eviction sees it as recently used
+    os.utime(path)
+    entry['text_path'] = _existing_text_path(key)
+    entry['store_path'] = _store_path(key) if os.path.exists(_store_path(key)) else None
+    _count('hits')
+    return entry
+
+def put(key: str, entry: dict, text_path: str, store_path: str = None):
+    """Store a finished transcription and apply the eviction policy.
+
+    The transcript file at text_path, and the structured transcript at
+    store_path if given, are copied into the cache in chunks.
+    """
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    copies = [(text_path, _text_path(key, compressed=text_path.endswith(COMPRESSED_SUFFIX)))]
+    if store_path and os.path.exists(store_path):
+        copies.append((store_path, _store_path(key)))
+    for source, destination in copies:
+        shutil.copyfile(source, destination + suffix)
+        os.replace(destination + suffix, destination)
+
+    temp_path = _entry_path(key) + suffix
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(entry, f)
+    os.replace(temp_path, _entry_path(key))
+    _count('stores')
+    evict()
+
+def evict():
+    """Drop expired entries, then least recently used ones over the size limit"""
+    now = time.time()
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith('.json'):
+            continue
+        key = name[:-len('.json')]
+        try:
+            stat = os.stat(_entry_path(key))
+            size = stat.st_size + os.path.getsize(_existing_text_path(key))
+            if os.path.exists(_store_path(key)):
+                size += os.path.getsize(_store_path(key))
+        except OSError:
+            size = 0
+            stat = None
+        entries.append((stat.st_mtime if stat else 0, size, key))
+
+    entries.sort()
+    total_size = sum(size for _, size, _ in entries)
+    evicted = 0
+    for mtime, size, key in entries:
+        if now - mtime <= CACHE_MAX_AGE and total_size <= CACHE_MAX_BYTES:
+            break
+        _remove(key)
+        total_size -= size
+        evicted += 1
+
+    if evicted:
+        _count('evictions', evicted)
+
+def get_stats() -> dict:
+    """Return hit/miss counters for this process"""
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
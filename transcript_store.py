@@ -0,0 +1,283 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from collections import namedtuple
+import numpy as np
+import preprocessing
+import storage
+import transcription
+
+# Structured transcripts are stored next to the rendered .txt with this suffix
+STORE_SUFFIX = '.sst'
+
+# File layout: magic, version and header length, then a JSON header that
+# lists each column's dtype, offset and count, then the 8-byte aligned columns
+MAGIC = b'SSTR'
+VERSION = 1
+PREAMBLE = struct.Struct('<4sIQ')
+ALIGNMENT = 8
+
+# Speaker columns use this for words and spans without a speaker
+NO_SPEAKER = 0xFFFF
+
+COLUMNS = {
+    'word_start': '<i4',
+    'word_end': '<i4',
+    'word_confidence': '<f4',
+    'word_speaker': '<u2',
+    'word_text': '<u4',
+    'utterance_start': '<i4',
+    'utterance_end': '<i4',
+    'utterance_confidence': '<f4',
+    'utterance_speaker': '<u2',
+    'utterance_text': '<u4',
+    'utterance_first_word': '<u4',
+    'sentiment_start': '<i4',
+    'sentiment_end': '<i4',
+    'sentiment_confidence': '<f4',
+    'sentiment_speaker': '<u2',
+    'sentiment_label': '<u2',
+    'sentiment_text': '<u4',
+    'string_offsets': '<u8',
+    'string_data': 'u1'
+}
+
+Word = namedtuple('Word', 'text start end confidence speaker')
+Utterance = namedtuple('Utterance', 'speaker text start end confidence')
+Chapter = namedtuple('Chapter', 'headline summary gist start end')
+SentimentSpan = namedtuple('SentimentSpan', 'text sentiment confidence speaker start end')
+
+def store_path_for(transcript_path: str) -> str:
+    """Path of the structured transcript that belongs to a rendered .txt (compressed or not)"""
+    if transcript_path.endswith(storage.COMPRESSED_SUFFIX):
+        transcript_path = transcript_path[:-len(storage.COMPRESSED_SUFFIX)]
+    return os.path.splitext(transcript_path)[0] + STORE_SUFFIX
+
+class _StringTable:
+    """Deduplicated strings, stored as one UTF-8 blob plus end offsets"""
+
+    def __init__(self):
+        self._ids = {}
+        self._encoded = []
+
+    def add(self, text: str) -> int:
+        text = text or ''
+        if text not in self._ids:
+            self._ids[text] = len(self._encoded)
+            self._encoded.append(text.encode('utf-8'))
+        return self._ids[text]
+
+    def columns(self) -> tuple:
+        lengths = np.fromiter((len(s) for s in self._encoded), dtype=np.uint64, count=len(self._encoded))
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.uint64)
+        return offsets, np.frombuffer(b"".join(self._encoded), dtype=np.uint8)
+
+def write(transcript, path: str, offset_map: list = None):
+    """Write a transcript's words, utterances, sentiment spans and chapters to path.
+
+    Times are mapped through offset_map, so they refer to the original audio
+    when it was preprocessed before upload.
+    """
+    to_original = lambda ms: preprocessing.to_original_ms(offset_map, ms)
+    strings = _StringTable()
+    speakers = []
+
+    def speaker_id(label):
+        if label is None:
+            return NO_SPEAKER
+        if label not in speakers:
+            speakers.append(label)
+        return speakers.index(label)
+
+    columns = {name: [] for name in COLUMNS if not name.startswith('string_')}
+    for utterance in transcript.utterances or []:
+        speaker = speaker_id(utterance.speaker)
+        columns['utterance_start'].append(to_original(utterance.start))
+        columns['utterance_end'].append(to_original(utterance.end))
+        columns['utterance_confidence'].append(utterance.confidence)
+        columns['utterance_speaker'].append(speaker)
+        columns['utterance_text'].append(strings.add(utterance.text))
+        columns['utterance_first_word'].append(len(columns['word_start']))
+        for word in getattr(utterance, 'words', None) or []:
+            columns['word_start'].append(to_original(word.start))
+            columns['word_end'].append(to_original(word.end))
+            columns['word_confidence'].append(word.confidence)
+            columns['word_speaker'].append(speaker)
+            columns['word_text'].append(strings.add(word.text))
+
+    sentiment_labels = []
+    for result in transcript.sentiment_analysis or []:
+        label = str(getattr(result.sentiment, 'value', result.sentiment))
+        if label not in sentiment_labels:
+            sentiment_labels.append(label)
+        columns['sentiment_start'].append(to_original(result.start))
+        columns['sentiment_end'].append(to_original(result.end))
+        columns['sentiment_confidence'].append(result.confidence)
+        columns['sentiment_speaker'].append(speaker_id(getattr(result, 'speaker', None)))
+        columns['sentiment_label'].append(sentiment_labels.index(label))
+        columns['sentiment_text'].append(strings.add(result.text))
+
+    arrays = {name: np.asarray(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+    arrays['string_offsets'], arrays['string_data'] = strings.columns()
+
+    header = {
+        'speakers': speakers,
+        'sentiment_labels': sentiment_labels,
+        'chapters': transcription.serialize_chapters(transcript.chapters, offset_map),
+        'columns': {}
+    }
+
+    # Column offsets depend on the header's length, which depends on the offsets;
+    # reserve room for the largest offsets first so one pass is enough
+    header_size = len(json.dumps(dict(header, columns={
+        name: {'dtype': COLUMNS[name], 'offset': 2 ** 63, 'count': len(array)} for name, array in arrays.items()
+    })).encode('utf-8'))
+    position = -(-(PREAMBLE.size + header_size) // ALIGNMENT) * ALIGNMENT
+    for name, array in arrays.items():
+        header['columns'][name] = {'dtype': COLUMNS[name], 'offset': position, 'count': len(array)}
+        position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    encoded_header = json.dumps(header).encode('utf-8').ljust(header_size)
+
+    temp_path = f"{path}.part"
+    with open(temp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(encoded_header)))
+        f.write(encoded_header)
+        for name, array in arrays.items():
+            f.seek(header['columns'][name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(position)
+    os.replace(temp_path, path)
+
+class TranscriptStore:
+    """Read-only view of a structured transcript.
+
+    The file is memory-mapped and every column is a zero-copy NumPy view,
+    so opening it is cheap and a query only touches the pages it reads.
+    Words are in time order, which lets time ranges be found by binary
+    search.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_size = PREAMBLE.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} structured transcript")
+        header = json.loads(self._mmap[PREAMBLE.size:PREAMBLE.size + header_size])
+
+        self.speakers = header['speakers']
+        self.sentiment_labels = header['sentiment_labels']
+        self.chapters = [Chapter(**chapter) for chapter in header['chapters']]
+        self.columns = {
+            name: np.frombuffer(self._mmap, dtype=column['dtype'], count=column['count'], offset=column['offset'])
+            for name, column in header['columns'].items()
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.columns = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A caller still holds a column view; the map closes when it is released
+            pass
+
+    def string(self, string_id: int) -> str:
+        offsets = self.columns['string_offsets']
+        start, end = int(offsets[string_id]), int(offsets[string_id + 1])
+        return self.columns['string_data'][start:end].tobytes().decode('utf-8')
+
+    def _speaker_label(self, speaker_id: int):
+        return None if speaker_id == NO_SPEAKER else self.speakers[speaker_id]
+
+    def _select(self, prefix: str, start_ms: int, end_ms: int, speaker) -> np.ndarray:
+        """Indices of rows starting in [start_ms, end_ms) for the speaker, if given"""
+        starts = self.columns[f"{prefix}_start"]
+        low = 0 if start_ms is None else np.searchsorted(starts, start_ms, side='left')
+        high = len(starts) if end_ms is None else np.searchsorted(starts, end_ms, side='left')
+        indices = np.arange(low, high)
+        if speaker is not None:
+            if speaker not in self.speakers:
+                return indices[:0]
+            indices = indices[self.columns[f"{prefix}_speaker"][low:high] == self.speakers.index(speaker)]
+        return indices
+
+    def words(self, start_ms: int = None, end_ms: int = None, speaker: str = None) -> list:
+        """Words starting in the time range, optionally for one speaker"""
+        columns = self.columns
+        return [
+            Word(
+                self.string(columns['word_text'][i]),
+                int(columns['word_start'][i]),
+                int(columns['word_end'][i]),
+                float(columns['word_confidence'][i]),
+                self._speaker_label(columns['word_speaker'][i])
+            )
+            for i in self._select('word', start_ms, end_ms, speaker)
+        ]
+
+    def _utterance_rows(self, indices) -> list:
+        columns = self.columns
+        return [
+            Utterance(
+                self._speaker_label(columns['utterance_speaker'][i]),
+                self.string(columns['utterance_text'][i]),
+                int(columns['utterance_start'][i]),
+                int(columns['utterance_end'][i]),
+                float(columns['utterance_confidence'][i])
+            )
+            for i in indices
+        ]
+
+    def utterances(self, start_ms: int = None, end_ms: int = None, speaker: str = None) -> list:
+        """Utterances starting in the time range, optionally for one speaker"""
+        return self._utterance_rows(self._select('utterance', start_ms, end_ms, speaker))
+
+    @property
+    def utterance_count(self) -> int:
+        return len(self.columns['utterance_start'])
+
+    def utterances_at(self, offset: int, limit: int) -> list:
+        """A page of utterances by position"""
+        return self._utterance_rows(range(offset, min(offset + limit, self.utterance_count)))
+
+    def sentiment(self, start_ms: int = None, end_ms: int = None, speaker: str = None) -> list:
+        """Sentiment spans starting in the time range, optionally for one speaker"""
+        columns = self.columns
+        return [
+            SentimentSpan(
+                self.string(columns['sentiment_text'][i]),
+                self.sentiment_labels[columns['sentiment_label'][i]],
+                float(columns['sentiment_confidence'][i]),
+                self._speaker_label(columns['sentiment_speaker'][i]),
+                int(columns['sentiment_start'][i]),
+                int(columns['sentiment_end'][i])
+            )
+            for i in self._select('sentiment', start_ms, end_ms, speaker)
+        ]
+
+def iter_text(store: TranscriptStore):
+    """Yield the rendered .txt format, piece by piece, from a structured transcript"""
+    transcript = namedtuple('StoredTranscript', 'utterances chapters')(store.utterances(), store.chapters)
+    return transcription.iter_transcript(transcript)
+
+def render_text(store_path: str, transcript_path: str = None) -> str:
+    """Regenerate the .txt transcript from its structured store; returns the .txt path"""
+    transcript_path = transcript_path or os.path.splitext(store_path)[0] + '.txt'
+    with TranscriptStore(store_path) as store:
+        transcription.write_transcript(iter_text(store), transcript_path)
+    return transcript_path
+
+if __name__ == "__main__":
+    # Regenerate text transcripts: python transcript_store.py storage/transcripts/*.sst
+    for store_path in sys.argv[1:]:
+        print(render_text(store_path))
@@ -0,0 +1,496 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from dotenv import load_dotenv
+import chunking
+import dedup
+import lemur_cache
+import lemur_chunks
+import metrics
+import preprocessing
+import search
+import transcript_cache
+import transcript_store
+import storage
+from storage import TRANSCRIPT_DIR
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables from .env.local
+load_dotenv('.env.local')
+
+# The AssemblyAI SDK is imported, and its clients built, on first use;
+# the login page and the other pages that never call it skip the cost
+_sdk_lock = threading.Lock()
+_transcriber = None
+_lemur = None
+
+# Transcription options, also part of the transcript cache key
+TRANSCRIPTION_OPTIONS = {
+    'punctuate': True,
+    'format_text': True,
+    'speaker_labels': True,
+    'auto_chapters': True,
+    'sentiment_analysis': True,
+    'topics': True
+}
+
+# LeMUR parameters, also part of the LeMUR cache key
+LEMUR_PARAMS = {
+    'format_text': True
+}
+
+# Seconds between AssemblyAI status checks while a transcript is processing
+POLL_INTERVAL = float(os.getenv('ASSEMBLYAI_POLL_INTERVAL', 3))
+
+# Audio intelligence sections run concurrently, each with its own timeout in seconds
+INTELLIGENCE_TIMEOUTS = {
+    'sentiment': 30,
+    'topics': 30,
+    'summary': 30,
+    'action_items': float(os.getenv('LEMUR_TIMEOUT', 120))
+}
+_intelligence_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('INTELLIGENCE_WORKERS', 8)),
+    thread_name_prefix='intelligence'
+)
+
+# Patterns used by format_text, compiled once at import
+SENTENCE_PATTERN = re.compile(r'([.!?]+)\s*')
+SPACE_BEFORE_PUNCTUATION_PATTERN = re.compile(r'\s+(?=[.,!?])')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+def assemblyai():
+    """The AssemblyAI SDK, configured with the API key from the environment"""
+    import assemblyai as aai
+    if not aai.settings.api_key:
+        aai.settings.api_key = os.getenv('ASSEMBLYAI_API_KEY')
+    return aai
+
+def get_transcriber():
+    """The process-wide AssemblyAI transcriber, shared by every thread"""
+    global _transcriber
+    if _transcriber is None:
+        with _sdk_lock:
+            if _transcriber is None:
+                _transcriber = assemblyai().Transcriber()
+    return _transcriber
+
+def get_lemur():
+    """The process-wide LeMUR client, shared by every thread"""
+    global _lemur
+    if _lemur is None:
+        with _sdk_lock:
+            if _lemur is None:
+                _lemur = assemblyai().LeMUR()
+    return _lemur
+
+def format_text(text):
+    """Format text with proper capitalization and punctuation"""
+    if not text:
+        return ""
+
+    # Split into sentences (handling multiple spaces and newlines); text after
+    # the last punctuation mark has no pair and is dropped
+    sentences = SENTENCE_PATTERN.split(text)
+
+    formatted_sentences = []
+    for sentence, punctuation in zip(sentences[::2], sentences[1::2]):
+        # Capitalize first letter of sentence
+        sentence = sentence.strip()
+        if sentence:
+            formatted_sentences.append(sentence[0].upper() + sentence[1:] + punctuation)
+
+    # Join sentences with proper spacing
+    formatted_text = " ".join(formatted_sentences)
+
+    # Fix common formatting issues. Collapsing whitespace also removes every
+    # newline, so no separate newline cleanup is needed
+    formatted_text = SPACE_BEFORE_PUNCTUATION_PATTERN.sub('', formatted_text)  # Remove spaces before punctuation
+    return WHITESPACE_PATTERN.sub(' ', formatted_text)  # Remove multiple spaces
+
+def iter_transcript(transcript):
+    """Yield the formatted transcript piece by piece.
+
+    Joined together the pieces are exactly format_transcript's output, so
+    callers can stream them to a file without building the whole document.
+    """
+    current_speaker = None
+    separator = ""
+
+    # Format utterances with speaker labels
+    for utterance in transcript.utterances or []:
+        if utterance.speaker != current_speaker:
+            yield f"{separator}\nSpeaker {utterance.speaker}:"
+            separator = "\n"
+            current_speaker = utterance.speaker
+        yield separator + format_text(utterance.text)
+        separator = "\n"
+
+    # Add chapters if available
+    if transcript.chapters:
+        yield f"{separator}\n\nChapter Summary:"
+        for i, chapter in enumerate(transcript.chapters, 1):
+            yield f"\n\nChapter {i}: {format_text(chapter.headline)}"
+            yield "\n" + format_text(chapter.summary)
+
+def format_transcript(transcript):
+    """Format transcript with speaker labels and proper formatting"""
+    return "".join(iter_transcript(transcript))
+
+def write_transcript(pieces, transcript_path):
+    """Stream transcript pieces to a file, renaming it into place when complete"""
+    temp_path = f"{transcript_path}.part"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.writelines(pieces)
+    os.replace(temp_path, transcript_path)
+
+def _ask_lemur(transcript_text: str, prompt: str) -> str:
+    """Run one LeMUR request, reusing the cached answer if it was asked before"""
+    def run_lemur():
+        with metrics.span('lemur'):
+            response = get_lemur().analyze(
+                transcript_text=transcript_text,
+                prompt=prompt,
+                **LEMUR_PARAMS
+            )
+            return response.response
+
+    return lemur_cache.get_or_compute(transcript_text, prompt, LEMUR_PARAMS, run_lemur)
+
+def analyze_with_lemur(transcript_text: str, query: str) -> str:
+    """Analyze transcript using LeMUR, reusing cached answers for repeat questions.
+
+    Transcripts longer than LEMUR_CHUNK_CHARS are summarised chunk by chunk
+    and the question is answered from the summaries.
+    """
+    if len(transcript_text) > lemur_chunks.LEMUR_CHUNK_CHARS:
+        return lemur_chunks.analyze(transcript_text, query, _ask_lemur)
+    return _ask_lemur(transcript_text, query)
+
+def empty_intelligence() -> dict:
+    """Return the intelligence dict with every section at its default"""
+    return {
+        'sentiment': [],
+        'topics': [],
+        'summary': '',
+        'action_items': ''
+    }
+
+def extract_sentiment(transcript) -> list:
+    """Get sentiment analysis"""
+    return [
+        {
+            'text': result.text,
+            'sentiment': result.sentiment,
+            'confidence': result.confidence
+        }
+        for result in transcript.sentiment_analysis or []
+    ]
+
+def extract_topics(transcript) -> list:
+    """Get topic detection"""
+    return [
+        {'topic': topic.text, 'confidence': topic.confidence}
+        for topic in transcript.topics or []
+    ]
+
+def extract_summary(transcript) -> str:
+    """Get auto chapters (summary)"""
+    return "\n".join([
+        f"• {chapter.headline}: {chapter.summary}"
+        for chapter in transcript.chapters or []
+    ])
+
+def extract_action_items(transcript) -> str:
+    """Get action items as LeMUR's text, or an empty string when there is nothing to ask about"""
+    if not transcript.text:
+        return ''
+    return analyze_with_lemur(
+        transcript.text,
+        "Extract action items and tasks mentioned in this transcript."
+    ) or ''
+
+INTELLIGENCE_TASKS = {
+    'sentiment': extract_sentiment,
+    'topics': extract_topics,
+    'summary': extract_summary,
+    'action_items': extract_action_items
+}
+
+def _run_intelligence_task(name, task, transcript):
+    with metrics.span('intelligence', task=name):
+        return task(transcript)
+
+def extract_intelligence(transcript, on_result=None) -> dict:
+    """Run every intelligence task concurrently and collect the results.
+
+    on_result(name, value, error) is called as each task finishes. A task
+    that fails or runs past its timeout keeps its default value without
+    affecting the others.
+    """
+    intelligence = empty_intelligence()
+    started = time.monotonic()
+    pending = {
+        name: _intelligence_executor.submit(metrics.profiled(_run_intelligence_task), name, task, transcript)
+        for name, task in INTELLIGENCE_TASKS.items()
+    }
+
+    while pending:
+        next_deadline = min(started + INTELLIGENCE_TIMEOUTS[name] for name in pending)
+        wait(pending.values(), timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+
+        now = time.monotonic()
+        for name, future in list(pending.items()):
+            if future.done():
+                error = future.exception()
+                if error is None:
+                    intelligence[name] = future.result()
+            elif now >= started + INTELLIGENCE_TIMEOUTS[name]:
+                future.cancel()
+                error = TimeoutError(f"{name} took longer than {INTELLIGENCE_TIMEOUTS[name]}s")
+            else:
+                continue
+
+            del pending[name]
+            if error is not None:
+                logger.error("Error extracting %s: %s", name, error)
+            if on_result:
+                on_result(name, intelligence[name], error)
+
+    return intelligence
+
+def get_audio_intelligence(transcript) -> dict:
+    """Extract audio intelligence features"""
+    return extract_intelligence(transcript)
+
+def serialize_chapters(chapters, offset_map=None) -> list:
+    """Convert transcript chapters to plain dicts, with times on the original audio's timeline"""
+    return [
+        {
+            'headline': chapter.headline,
+            'summary': chapter.summary,
+            'gist': chapter.gist,
+            'start': preprocessing.to_original_ms(offset_map, chapter.start),
+            'end': preprocessing.to_original_ms(offset_map, chapter.end)
+        }
+        for chapter in chapters or []
+    ]
+
+def wait_for_transcript(transcript, progress):
+    """Poll AssemblyAI until the transcript is done, reporting its status"""
+    aai = assemblyai()
+    # Time spent queued and processing at AssemblyAI, recorded as the status changes
+    status, since = transcript.status, time.perf_counter()
+    while True:
+        if transcript.status != status:
+            metrics.observe(f"assemblyai_{getattr(status, 'value', status)}", time.perf_counter() - since)
+            status, since = transcript.status, time.perf_counter()
+
+        if transcript.status == aai.TranscriptStatus.completed:
+            return transcript
+        if transcript.status == aai.TranscriptStatus.error:
+            raise RuntimeError(f"Transcription failed: {transcript.error}")
+
+        if transcript.status == aai.TranscriptStatus.queued:
+            progress('queued at AssemblyAI', 20)
+        else:
+            progress('processing at AssemblyAI', 40)
+
+        time.sleep(POLL_INTERVAL)
+        transcript = aai.Transcript.get_by_id(transcript.id)
+
+def upload_audio(audio_path, config, preprocess):
+    """Submit audio to AssemblyAI, preprocessed first if enabled.
+
+    Returns the submitted transcript and the offset map back to the original
+    file's timeline. If preprocessing fails the original file is sent.
+    """
+    transcriber = get_transcriber()
+    if not preprocess:
+        with metrics.span('upload'):
+            return transcriber.submit(audio_path, config=config), None
+
+    try:
+        with metrics.span('preprocess'):
+            processed = preprocessing.preprocess(audio_path)
+    except Exception:
+        logger.exception("Error preprocessing %s, uploading it unchanged", audio_path)
+        with metrics.span('upload'):
+            return transcriber.submit(audio_path, config=config), None
+
+    logger.info(
+        "Preprocessed %s: %d -> %d bytes, %d ms of silence trimmed",
+        audio_path, processed['original_bytes'], processed['processed_bytes'], processed['trimmed_ms']
+    )
+    try:
+        with metrics.span('upload'):
+            return transcriber.submit(processed['path'], config=config), processed['offset_map']
+    finally:
+        os.unlink(processed['path'])
+
+def transcribe_audio(audio_path, original_filename, audio_hash=None, progress=None,
+                     on_transcript=None, on_intelligence=None, preprocess=None, profile=False,
+                     configure=None):
+    """Transcribe an audio file and save the formatted transcript.
+
+    progress is called with (stage, percent) as the work advances. Once the
+    transcript is saved, on_transcript(path, cached) is called before audio
+    intelligence is extracted; on_intelligence(name, value, error) is called
+    as each intelligence section completes. preprocess defaults to the
+    PREPROCESS_AUDIO setting. With profile set, the calling thread and its
+    chunk and intelligence workers are profiled and the report saved under
+    storage/profiles. Errors are raised to the caller. The result's
+    duplicate_of is the saved transcript this one nearly duplicates, if any
+    (see dedup).
+
+    configure(config) may adjust the AssemblyAI config before submitting.
+    If it sets a webhook, the call returns once the file is submitted, with
+    {'submitted': True, 'transcript_id', 'offset_map'}; pass those to
+    resume_transcription when the webhook arrives. Cached and long
+    (chunked) audio still completes in the call.
+    """
+    name = os.path.splitext(os.path.basename(original_filename))[0]
+    with metrics.profile(f"transcribe_{name}", profile), metrics.span('transcribe'):
+        return _transcribe_audio(audio_path, original_filename, audio_hash, progress,
+                                 on_transcript, on_intelligence, preprocess, configure)
+
+def resume_transcription(transcript_id, original_filename, audio_hash=None, offset_map=None, progress=None,
+                         on_transcript=None, on_intelligence=None, preprocess=None, profile=False):
+    """Finish a transcription submitted with a webhook: fetch it, then save it and extract intelligence"""
+    name = os.path.splitext(os.path.basename(original_filename))[0]
+    with metrics.profile(f"resume_{name}", profile), metrics.span('transcribe_resume'):
+        with metrics.span('assemblyai_fetch'):
+            transcript = assemblyai().Transcript.get_by_id(transcript_id)
+        if transcript.status == assemblyai().TranscriptStatus.error:
+            raise RuntimeError(f"Transcription failed: {transcript.error}")
+        return _transcribe_audio(None, original_filename, audio_hash, progress, on_transcript,
+                                 on_intelligence, preprocess, None, transcript, offset_map)
+
+def _transcribe_audio(audio_path, original_filename, audio_hash, progress, on_transcript,
+                      on_intelligence, preprocess, configure, transcript=None, offset_map=None):
+    report = progress or (lambda stage, percent: None)
+    if preprocess is None:
+        preprocess = preprocessing.PREPROCESS_AUDIO
+
+    # Identical audio with identical options is served from the cache
+    options = dict(TRANSCRIPTION_OPTIONS, preprocess=True) if preprocess else TRANSCRIPTION_OPTIONS
+    cache_key = transcript_cache.cache_key(audio_hash, options) if audio_hash else None
+    with metrics.span('transcript_cache'):
+        cached = transcript_cache.get(cache_key) if cache_key and transcript is None else None
+
+    # Save transcripts under a new name per run
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    transcript_filename = f"{timestamp}_{os.path.splitext(original_filename)[0]}.txt"
+    new_transcript_path = os.path.join(TRANSCRIPT_DIR, transcript_filename)
+
+    if cached:
+        report('found in cache', 90)
+        chapters = cached['chapters']
+
+        # Reuse the saved transcript if it is still there, otherwise restore the cached copy
+        transcript_path = cached.get('transcript_path')
+        if transcript_path:
+            transcript_path = storage.resolve_transcript(transcript_path)
+        if not transcript_path or not os.path.exists(transcript_path):
+            compressed = cached['text_path'].endswith(storage.COMPRESSED_SUFFIX)
+            transcript_path = new_transcript_path + (storage.COMPRESSED_SUFFIX if compressed else '')
+            shutil.copyfile(cached['text_path'], transcript_path)
+            if cached.get('store_path'):
+                shutil.copyfile(cached['store_path'], transcript_store.store_path_for(transcript_path))
+    else:
+        config = assemblyai().TranscriptionConfig(**TRANSCRIPTION_OPTIONS)
+        if transcript is not None:
+            # Already finished at AssemblyAI; resuming after its webhook
+            pass
+        elif chunking.is_long(audio_path):
+            # Long recordings are transcribed as chunks in parallel and stitched back together
+            with metrics.span('chunked_transcription'):
+                transcript = chunking.transcribe_long_audio(audio_path, config, report)
+        else:
+            # Submit the file with our options
+            report('preprocessing' if preprocess else 'uploading', 10)
+            if configure:
+                configure(config)
+            transcript, offset_map = upload_audio(audio_path, config, preprocess)
+            if config.webhook_url:
+                # AssemblyAI calls back when it is done; nothing to wait for here
+                report('processing at AssemblyAI', 40)
+                return {'submitted': True, 'transcript_id': transcript.id, 'offset_map': offset_map}
+            transcript = wait_for_transcript(transcript, report)
+
+        # Stream the formatted transcript straight to local (compressed) storage
+        # Formatting and writing are interleaved, so the formatter's share is timed separately
+        report('formatting', 70)
+        pieces = metrics.TimedIterator(iter_transcript(transcript))
+        started = time.perf_counter()
+        transcript_path = storage.save_transcript(new_transcript_path, pieces)
+        metrics.observe('format_transcript', pieces.elapsed)
+        metrics.observe('transcript_write', time.perf_counter() - started - pieces.elapsed)
+        chapters = serialize_chapters(transcript.chapters, offset_map)
+
+        # Keep word timings, confidences and sentiment spans for later use
+        try:
+            with metrics.span('store_write'):
+                transcript_store.write(transcript, transcript_store.store_path_for(transcript_path), offset_map)
+        except Exception:
+            logger.exception("Error writing structured transcript for %s", transcript_path)
+
+    # Make the new transcript searchable right away
+    try:
+        with metrics.span('search_index'):
+            search.index_transcript(transcript_path)
+    except Exception:
+        logger.exception("Error indexing transcript %s", transcript_path)
+
+    # Note when the same recording was transcribed before
+    duplicate_of = None
+    try:
+        with metrics.span('dedup_check'):
+            duplicate_of = dedup.check_transcript(transcript_path)
+        if duplicate_of:
+            logger.info("Transcript %s is a near-duplicate of %s", transcript_path, duplicate_of)
+    except Exception:
+        logger.exception("Error checking transcript %s for duplicates", transcript_path)
+
+    # The transcript is usable before audio intelligence is ready
+    if on_transcript:
+        on_transcript(transcript_path, bool(cached))
+
+    if cached:
+        intelligence = cached['intelligence']
+        if on_intelligence:
+            for name, value in intelligence.items():
+                on_intelligence(name, value, None)
+    else:
+        failed = []
+
+        def collect(name, value, error):
+            if error is not None:
+                failed.append(name)
+            if on_intelligence:
+                on_intelligence(name, value, error)
+
+        with metrics.span('audio_intelligence'):
+            intelligence = extract_intelligence(transcript, collect)
+
+        # Only complete results are worth serving again
+        if cache_key and not failed:
+            transcript_cache.put(cache_key, {
+                'chapters': chapters,
+                'intelligence': intelligence,
+                'transcript_path': transcript_path
+            }, transcript_path, transcript_store.store_path_for(transcript_path))
+
+    return {
+        'transcript_path': transcript_path,
+        'chapters': chapters,
+        'intelligence': intelligence,
+        'cached': bool(cached),
+        'duplicate_of': duplicate_of
+    }
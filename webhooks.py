@@ -0,0 +1,186 @@
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+from auth import get_redis
+import transcription
+
+logger = logging.getLogger(__name__)
+
+# Public URL AssemblyAI calls when a transcript finishes; it must reach the
+# receiver below (directly or through a proxy). Jobs wait on AssemblyAI by
+# polling, holding a worker thread, when it is unset.
+WEBHOOK_URL = os.getenv('ASSEMBLYAI_WEBHOOK_URL', '')
+WEBHOOK_PORT = int(os.getenv('ASSEMBLYAI_WEBHOOK_PORT', 8765))
+WEBHOOK_PATH = urlsplit(WEBHOOK_URL).path or '/assemblyai/webhook'
+
+# AssemblyAI sends this header back with every callback; requests without it are
+# refused. Webhooks stay off without a secret, as anyone could complete jobs.
+WEBHOOK_SECRET = os.getenv('ASSEMBLYAI_WEBHOOK_SECRET', '')
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    logger.warning("ASSEMBLYAI_WEBHOOK_URL is set without ASSEMBLYAI_WEBHOOK_SECRET; polling AssemblyAI instead")
+WEBHOOK_AUTH_HEADER = 'X-SpeechScribe-Webhook-Secret'
+
+# Fallback for missed callbacks: transcripts not heard from for WEBHOOK_GRACE
+# seconds are polled, at most every WEBHOOK_POLL_INTERVAL seconds per process.
+# A submission that never recorded a transcript id is failed after WEBHOOK_SUBMIT_TIMEOUT.
+WEBHOOK_POLL_INTERVAL = int(os.getenv('ASSEMBLYAI_WEBHOOK_POLL_INTERVAL', 300))
+WEBHOOK_GRACE = int(os.getenv('ASSEMBLYAI_WEBHOOK_GRACE', 600))
+WEBHOOK_SUBMIT_TIMEOUT = int(os.getenv('ASSEMBLYAI_WEBHOOK_SUBMIT_TIMEOUT', 3600))
+WEBHOOK_POLL_BATCH = int(os.getenv('ASSEMBLYAI_WEBHOOK_POLL_BATCH', 50))
+
+# Submitted jobs scored by when they were last heard from, the transcript id
+# of each, and the finished transcripts waiting for a worker
+PENDING_KEY = "webhook:pending"
+TRANSCRIPTS_KEY = "webhook:transcripts"
+COMPLETIONS_KEY = "jobs:completions"
+
+_polled_at = None
+_poll_lock = threading.Lock()
+_receiver = None
+_receiver_lock = threading.Lock()
+
+def enabled() -> bool:
+    return bool(WEBHOOK_URL and WEBHOOK_SECRET)
+
+def webhook_url_for(job_id: str) -> str:
+    """The callback URL for one job; the job id comes back in the query string"""
+    return f"{WEBHOOK_URL}{'&' if '?' in WEBHOOK_URL else '?'}{urlencode({'job': job_id})}"
+
+def configure(config, job_id: str):
+    """Ask AssemblyAI to call our receiver, with the shared secret, when the transcript is done"""
+    config.set_webhook(webhook_url_for(job_id), WEBHOOK_AUTH_HEADER, WEBHOOK_SECRET)
+    return config
+
+def track(job_id: str):
+    """Start waiting for a job's callback; call before submitting so no callback is missed"""
+    get_redis().zadd(PENDING_KEY, {job_id: time.time()})
+
+def submitted(job_id: str, transcript_id: str):
+    get_redis().hset(TRANSCRIPTS_KEY, job_id, transcript_id)
+
+def untrack(job_id: str):
+    pipe = get_redis().pipeline()
+    pipe.zrem(PENDING_KEY, job_id)
+    pipe.hdel(TRANSCRIPTS_KEY, job_id)
+    pipe.execute()
+
+def record_completion(job_id: str, transcript_id: str, status: str) -> bool:
+    """Queue a finished transcript for the workers.
+
+    The webhook and the fallback poller can both report a transcript; only
+    the first report for a job is queued. Returns whether this one was.
+    """
+    if not get_redis().zrem(PENDING_KEY, job_id):
+        return False
+    pipe = get_redis().pipeline()
+    pipe.hdel(TRANSCRIPTS_KEY, job_id)
+    pipe.rpush(COMPLETIONS_KEY, json.dumps({'job_id': job_id, 'transcript_id': transcript_id, 'status': status}))
+    pipe.execute()
+    return True
+
+def poll_missed(now: float = None) -> int:
+    """Check on transcripts whose callback is overdue; returns how many were found finished"""
+    now = now or time.time()
+    found = 0
+    # The scores come with the ids; a job another process just completed is
+    # gone from the set, and record_completion refuses it again
+    for job_id, heard_at in get_redis().zrangebyscore(PENDING_KEY, '-inf', now - WEBHOOK_GRACE,
+                                                      start=0, num=WEBHOOK_POLL_BATCH, withscores=True):
+        transcript_id = get_redis().hget(TRANSCRIPTS_KEY, job_id)
+        if not transcript_id:
+            # Still submitting, or the process submitting it died
+            if heard_at < now - WEBHOOK_SUBMIT_TIMEOUT:
+                found += record_completion(job_id, '', 'error')
+            continue
+
+        try:
+            status = transcription.assemblyai().Transcript.get_by_id(transcript_id).status
+        except Exception:
+            logger.exception("Error checking transcript %s for job %s", transcript_id, job_id)
+            continue
+
+        status = getattr(status, 'value', status)
+        if status in ('completed', 'error'):
+            found += record_completion(job_id, transcript_id, status)
+        else:
+            # Not done yet; look again after another grace period
+            get_redis().zadd(PENDING_KEY, {job_id: now}, xx=True)
+    return found
+
+def maybe_poll_missed():
+    """Run poll_missed if this process has not done so in the last WEBHOOK_POLL_INTERVAL seconds"""
+    global _polled_at
+    if not enabled():
+        return
+    with _poll_lock:
+        if _polled_at is not None and time.monotonic() - _polled_at < WEBHOOK_POLL_INTERVAL:
+            return
+        _polled_at = time.monotonic()
+    try:
+        found = poll_missed()
+        if found:
+            logger.info("Found %d finished transcripts whose webhook was missed", found)
+    except Exception:
+        logger.exception("Error polling for missed webhooks")
+
+def _handler_class():
+    from http.server import BaseHTTPRequestHandler
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != WEBHOOK_PATH:
+                self.send_error(404)
+                return
+            if not WEBHOOK_SECRET or not hmac.compare_digest(self.headers.get(WEBHOOK_AUTH_HEADER, ''),
+                                                             WEBHOOK_SECRET):
+                self.send_error(401)
+                return
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                job_id = parse_qs(url.query)['job'][0]
+                transcript_id = body['transcript_id']
+                status = body['status']
+            except (ValueError, KeyError, IndexError):
+                self.send_error(400)
+                return
+
+            # Only the transcript submitted for this job may complete it
+            expected = get_redis().hget(TRANSCRIPTS_KEY, job_id)
+            if expected and expected != transcript_id:
+                self.send_error(400)
+                return
+
+            if status in ('completed', 'error'):
+                record_completion(job_id, transcript_id, status)
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            logger.debug("Webhook request: " + format, *args)
+
+    return WebhookHandler
+
+def start_receiver(port: int = None):
+    """Listen for AssemblyAI callbacks in this process if webhooks are enabled"""
+    global _receiver
+    if not enabled():
+        return None
+    with _receiver_lock:
+        if _receiver is None:
+            from http.server import ThreadingHTTPServer
+            try:
+                _receiver = ThreadingHTTPServer(('0.0.0.0', WEBHOOK_PORT if port is None else port),
+                                                _handler_class())
+            except OSError as e:
+                # Another process on this host is already receiving them
+                logger.warning("Could not listen for webhooks on port %d: %s", WEBHOOK_PORT, e)
+                return None
+            threading.Thread(target=_receiver.serve_forever, name="webhook-receiver", daemon=True).start()
+    return _receiver